@@ -1,20 +1,28 @@
 """
 The main hyperion entry point. Run `hyperion --help` for more info.
 """
+import itertools
 import logging
 from asyncio import get_event_loop, set_event_loop_policy
 
 import click
 import uvloop
-from click import Path
+from click import Path, Choice, File
 from colorama import Fore
 
 from .fetch import ApiError
 from . import logger
 from .api import run_api_server
-from .cli import cli
+from .cli import cli, read_locations
+from .cli.prefetch import prefetch, parse_box, box_locations
+from .fetch.client import initialize_client, close_client, set_offline
 from .fetch.twitter import initialize_twitter
+from .settings import DB_PROFILE, DB_URL, CLI_CONCURRENCY
 from .models import util, initialize_database
+from .models.storage import optimize_database, profiles
+from .models.base import database_proxy
+from .models.directory import import_directory
+from .models.writer import writer
 
 set_event_loop_policy(uvloop.EventLoopPolicy())
 
@@ -26,15 +34,27 @@ set_event_loop_policy(uvloop.EventLoopPolicy())
 @click.option('--crime', '-c', is_flag=True)
 @click.option('--nearby', '-n', is_flag=True)
 @click.option('--json', '-j', is_flag=True)
+@click.option('--format', '-f', 'output_format', type=Choice(["human", "json", "ndjson", "csv"]))
+@click.option('--input', '-i', 'input_file', type=File())
+@click.option('--concurrency', type=click.IntRange(min=1), default=CLI_CONCURRENCY)
+@click.option('--offline', is_flag=True)
+@click.option('--prefetch', 'prefetch_locations', is_flag=True)
+@click.option('--prefetch-box', type=str)
 @click.option('--update-bikes', is_flag=True)
 @click.option('--api-server', is_flag=True)
 @click.option('--cross-origin', is_flag=True)
 @click.option('--host', '-h', type=str)
 @click.option('--port', '-p', type=int)
 @click.option('--db-path', type=Path(dir_okay=False))
+@click.option('--db-url', type=str)
+@click.option('--db-profile', type=Choice(list(profiles)), default=DB_PROFILE)
+@click.option('--optimize-db', is_flag=True)
+@click.option('--import-postcodes', type=File(encoding="utf-8-sig"))
+@click.option('--postcode-names', type=File(encoding="utf-8-sig"), multiple=True)
 @click.option('--verbose', '-v', count=True)
-def run_cli(locations, random, bikes, crime, nearby, json, update_bikes, api_server, cross_origin, host, port, db_path,
-            verbose):
+def run_cli(locations, random, bikes, crime, nearby, json, output_format, input_file, concurrency, offline,
+            prefetch_locations, prefetch_box, update_bikes, api_server, cross_origin, host, port, db_path, db_url,
+            db_profile, optimize_db, import_postcodes, postcode_names, verbose):
     """
     Runs the program. Takes a list of postcodes or coordinates and
     returns various information about them. If using the cli, make
@@ -49,19 +69,48 @@ def run_cli(locations, random, bikes, crime, nearby, json, update_bikes, api_ser
     :param crime: Includes a list of committed crimes in that area.
     :param nearby: Includes a list of wikipedia articles in that area.
     :param json: Returns the data in json format.
+    :param output_format: The format to return the data in. The ndjson and csv formats write each postcode as found.
+    :param input_file: A file (or - for stdin) of postcodes or coordinates to search, one per line.
+    :param concurrency: The most locations or postcodes to look up at once.
+    :param offline: Answers only from the local caches, without any network calls.
+    :param prefetch_locations: Fills the caches for the locations instead of returning their data.
+    :param prefetch_box: Fills the caches for a "lat,long,lat,long" bounding box.
     :param update_bikes: Whether to force update bikes.
     :param api_server: If given, the program will instead run a rest api.
     :param cross_origin:
     :param host:
     :param port: Defines the port to run the rest api on.
     :param db_path: The path to the sqlite db to use.
+    :param db_url: The url of the db to use if no path is given, such as a postgres server.
+    :param db_profile: The storage profile to open the db with.
+    :param optimize_db: Whether to optimize, checkpoint and vacuum the db.
+    :param import_postcodes: An ONS Postcode Directory csv to import for offline lookups.
+    :param postcode_names: Names and codes csvs from the directory's documents, to name districts and zones.
     :param verbose: The verbosity.
     """
 
     log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
     logging.basicConfig(level=log_levels[min(verbose, 2)])
 
-    initialize_database(db_path)
+    box = None
+    if prefetch_box is not None:
+        try:
+            box = parse_box(prefetch_box)
+        except ValueError:
+            raise click.BadParameter("Expected a box in the form lat,long,lat,long", param_hint="--prefetch-box")
+    if offline and (prefetch_locations or box is not None or update_bikes):
+        raise click.UsageError("Can't fetch anything while offline.")
+    set_offline(offline)
+
+    initialize_database(db_path, db_profile, db_url if db_url is not None else DB_URL)
+
+    if optimize_db:
+        logger.info("Optimizing the database.")
+        optimize_database(database_proxy, vacuum=True)
+
+    if import_postcodes is not None:
+        logger.info("Importing the postcode directory.")
+        import_directory(import_postcodes, postcode_names)
 
     try:
         initialize_twitter()
@@ -73,7 +122,11 @@ def run_cli(locations, random, bikes, crime, nearby, json, update_bikes, api_ser
 
     if update_bikes:
         logger.info("Force updating bikes.")
-        loop.run_until_complete(util.update_bikes())
+        loop.run_until_complete(initialize_client())
+        try:
+            loop.run_until_complete(util.update_bikes())
+        finally:
+            loop.run_until_complete(close_client())
 
     if api_server:
         server_args = {"should_enable_cross_origin": cross_origin}
@@ -82,12 +135,36 @@ def run_cli(locations, random, bikes, crime, nearby, json, update_bikes, api_ser
         if port is not None:
             server_args["port"] = port
         run_api_server(**server_args)
-    elif len(locations) > 0 or random > 0:
-        exit(loop.run_until_complete(cli(locations, random, bikes=bikes, crime=crime, nearby=nearby, as_json=json)))
-    else:
+    elif prefetch_locations or box is not None:
+        prefetched = read_locations(locations, input_file)
+        if random > 0:
+            prefetched = itertools.chain(prefetched, [random])
+        if box is not None:
+            prefetched = itertools.chain(prefetched, box_locations(box))
+        exit(run_with_client(loop, prefetch(prefetched, concurrency=concurrency)))
+    elif len(locations) > 0 or random > 0 or input_file is not None:
+        exit(run_with_client(loop, cli(locations, random, bikes=bikes, crime=crime, nearby=nearby, as_json=json,
+                                       concurrency=concurrency, input_file=input_file, output_format=output_format)))
+    elif not (update_bikes or optimize_db or import_postcodes):
         click.echo(Fore.RED + "Either include a post code, or the --api-server flag.")
 
 
+def run_with_client(loop, coroutine):
+    """
+    Runs a cli task with the http client and the database writer,
+    letting any background refreshes and writes finish afterwards.
+    :return: The result of the task.
+    """
+    loop.run_until_complete(initialize_client())
+    loop.run_until_complete(writer.start())
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(util.wait_for_refreshes())
+        loop.run_until_complete(writer.stop())
+        loop.run_until_complete(close_client())
+
+
 def run_server():
     logging.basicConfig(level=logging.INFO)
 
@@ -7,30 +7,76 @@ from datetime import timedelta
 from aiohttp import web
 from aiohttp.web_middlewares import normalize_path_middleware
 
-from ..models.util import update_bikes
+from ..fetch.client import initialize_client, close_client
+from ..models.executor import shutdown_executors
+from ..models.directory import get_postcode_directory
+from ..models.util import update_bikes, maintain_database, wait_for_refreshes, revalidate, fill_random_pool
+from ..models.writer import writer
+from .batch import api_postcodes
 from .bike import api_bikes
 from .crime import api_crime, api_neighbourhood
 from .geo import api_postcode, api_nearby
 from .social import api_twitter
-from .util import normalize_postcode_middleware, enable_cross_origin
+from .summary import api_summary
+from .util import normalize_postcode_middleware, conditional_middleware, enable_cross_origin
 from ..settings import SERVER_HOST, SERVER_PORT
 
 
+async def start_http_client(app):
+    await initialize_client()
+
+
+async def finish_refreshes(app):
+    await wait_for_refreshes()
+
+
+async def close_http_client(app):
+    await close_client()
+
+
+async def start_writer(app):
+    await writer.start()
+
+
+async def stop_writer(app):
+    await writer.stop()
+
+
+async def close_database_executors(app):
+    shutdown_executors()
+
+
 async def start_background_tasks(app):
-    app['bike_fetcher'] = app.loop.create_task(update_bikes(timedelta(days=1)))
+    app['bike_fetcher'] = app.loop.create_task(update_bikes(timedelta(days=1), in_memory=True))
+    app['database_maintainer'] = app.loop.create_task(maintain_database())
+    if get_postcode_directory() is None:
+        revalidate(("random",), fill_random_pool)
 
 
 async def cleanup_background_tasks(app):
-    app['bike_fetcher'].cancel()
-    await app['bike_fetcher']
+    for task in (app['bike_fetcher'], app['database_maintainer']):
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
 
 
-app = web.Application(middlewares=[normalize_path_middleware(), normalize_postcode_middleware])
+app = web.Application(middlewares=[
+    normalize_path_middleware(), normalize_postcode_middleware, conditional_middleware
+])
 
+app.on_startup.append(start_http_client)
+app.on_startup.append(start_writer)
 app.on_startup.append(start_background_tasks)
 app.on_cleanup.append(cleanup_background_tasks)
+app.on_cleanup.append(finish_refreshes)
+app.on_cleanup.append(close_http_client)
+app.on_cleanup.append(stop_writer)
+app.on_cleanup.append(close_database_executors)
 
 app.add_routes([
+    web.post('/api/postcodes/', api_postcodes, name='postcodes'),
     web.get('/api/postcode/{postcode}/', api_postcode, name='postcode'),
     web.get('/api/postcode/{postcode}/bikes/', api_bikes, name='bikes'),
     web.get('/api/postcode/{postcode}/bikes/{radius}/', api_bikes, name='bikes-radius'),
@@ -38,6 +84,7 @@ app.add_routes([
     web.get('/api/postcode/{postcode}/neighbourhood/', api_neighbourhood, name='neighbourhood'),
     web.get('/api/postcode/{postcode}/nearby/', api_nearby, name='nearby'),
     web.get('/api/postcode/{postcode}/nearby/{limit}/', api_nearby, name='nearby-radius'),
+    web.get('/api/postcode/{postcode}/summary/', api_summary, name='summary'),
     web.get('/api/twitter/{handle}/', api_twitter, name='twitter'),
 ])
 
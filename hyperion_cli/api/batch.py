@@ -0,0 +1,114 @@
+from asyncio import gather
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiohttp import web
+
+from .. import logger
+from ..models import CachingError, Postcode
+from ..models.executor import db_read
+from ..models.util import get_postcode, get_bikes, get_crime, get_neighbourhood, get_nearby
+from ..settings import BATCH_MAX_POSTCODES, BATCH_CONCURRENCY
+from ..util import is_uk_postcode, as_completed_bounded
+from .util import str_dumps
+
+
+async def get_bikes_facet(postcode: Postcode):
+    bikes = await get_bikes(postcode, 10)
+    return [bike.serialize() for bike in bikes] if bikes is not None else None
+
+
+async def get_neighbourhood_facet(postcode: Postcode):
+    neighbourhood = await get_neighbourhood(postcode)
+    return await db_read(neighbourhood.serialize) if neighbourhood is not None else None
+
+
+# the data that can be requested for a postcode, with the same defaults as their own routes
+facets: Dict[str, Callable[[Postcode], Awaitable[Any]]] = {
+    "bikes": get_bikes_facet,
+    "crime": get_crime,
+    "neighbourhood": get_neighbourhood_facet,
+    "nearby": lambda postcode: get_nearby(postcode.lat, postcode.long),
+}
+
+
+async def get_postcode_facets(postcode_string: str, requested: List[str]) -> Dict[str, Any]:
+    """
+    Looks up a postcode and the requested facets for it at the same time.
+    :return: The postcode and facets, with any that failed in `errors`, or an `error` if the postcode failed.
+    """
+    result: Dict[str, Any] = {"postcode": postcode_string}
+
+    try:
+        postcode = await get_postcode(postcode_string)
+    except CachingError as e:
+        result["error"] = e.status
+        return result
+
+    if postcode is None:
+        result["error"] = "Invalid Postcode"
+        return result
+
+    result["data"] = await db_read(postcode.serialize)
+    values = await gather(*(facets[facet](postcode) for facet in requested), return_exceptions=True)
+    for facet, value in zip(requested, values):
+        if isinstance(value, CachingError):
+            result.setdefault("errors", {})[facet] = value.status
+        elif isinstance(value, BaseException):
+            raise value
+        else:
+            result[facet] = value
+
+    return result
+
+
+async def api_postcodes(request):
+    """
+    Gets data for many postcodes at once. The body is a json object with
+    a list of `postcodes` and a list of `facets` to include for each one.
+    The postcodes are looked up concurrently, and each is written as a line
+    of json as soon as it is found, with errors reported per postcode.
+    :param request: The aiohttp request.
+    """
+    try:
+        body = await request.json()
+        postcodes, requested = body["postcodes"], body.get("facets", [])
+        assert isinstance(postcodes, list) and isinstance(requested, list)
+        assert all(isinstance(facet, str) for facet in requested)
+    except (ValueError, KeyError, TypeError, AttributeError, AssertionError):
+        raise web.HTTPBadRequest(text="Expected a json object with a list of postcodes")
+
+    if len(postcodes) > BATCH_MAX_POSTCODES:
+        raise web.HTTPBadRequest(text=f"At most {BATCH_MAX_POSTCODES} postcodes can be requested")
+
+    requested = list(dict.fromkeys(requested))
+    invalid_facets = [facet for facet in requested if facet not in facets]
+    if len(invalid_facets) > 0:
+        raise web.HTTPBadRequest(text=f"Invalid facets: {', '.join(invalid_facets)}")
+
+    # repeated postcodes are looked up once
+    normalized = {}
+    for postcode in postcodes:
+        if isinstance(postcode, str) and is_uk_postcode(postcode):
+            normalized.setdefault(postcode.upper().replace(" ", ""), None)
+        else:
+            normalized.setdefault(str(postcode), "Invalid Postcode")
+
+    async def lookup(postcode, error):
+        if error is not None:
+            return {"postcode": postcode, "error": error}
+        try:
+            return await get_postcode_facets(postcode, requested)
+        except Exception:
+            # the response has already started, so a failure is reported for its postcode alone
+            logger.exception(f"Could not look up {postcode} in a batch")
+            return {"postcode": postcode, "error": "Internal Server Error"}
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+
+    lookups = (lookup(postcode, error) for postcode, error in normalized.items())
+    async for result in as_completed_bounded(lookups, BATCH_CONCURRENCY):
+        await response.write((str_dumps(result) + "\n").encode())
+
+    await response.write_eof()
+    return response
@@ -3,10 +3,19 @@ from typing import Optional
 from aiohttp import web
 
 from ..models import CachingError
+from ..models.grid import get_bike_grid
 from ..models.util import get_bikes, get_postcode_random
-from .util import str_json_response
+from ..settings import BIKES_HTTP_MAX_AGE
+from .util import str_json_response, cache_policy
 
 
+def get_bikes_version():
+    # the server answers from the grid, which only changes when the bikes are synced
+    grid = get_bike_grid()
+    return grid.built if grid is not None else None
+
+
+@cache_policy(BIKES_HTTP_MAX_AGE, get_bikes_version)
 async def api_bikes(request):
     """
     Gets stolen bikes within a radius of a given postcode.
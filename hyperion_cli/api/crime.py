@@ -1,15 +1,16 @@
 from typing import Optional
 
-from aiobreaker import CircuitBreakerError
 from aiohttp import web
 
-from ..fetch import ApiError
-from ..fetch.police import fetch_crime
-from ..models import Postcode, CachingError
-from ..models.util import get_postcode, get_neighbourhood, get_postcode_random
-from .util import str_json_response
+from ..models import CachingError
+from ..models.executor import db_read
+from ..models.util import get_neighbourhood, get_postcode, get_postcode_random, get_crime_with_month, \
+    get_crime_version
+from ..settings import CRIME_HTTP_MAX_AGE, NEIGHBOURHOOD_HTTP_MAX_AGE
+from .util import str_json_response, cache_policy, with_last_modified, with_version
 
 
+@cache_policy(CRIME_HTTP_MAX_AGE, get_crime_version)
 async def api_crime(request):
     """
     Gets the crime nearby to a given postcode.
@@ -20,21 +21,26 @@ async def api_crime(request):
 
     try:
         coroutine = get_postcode_random() if postcode == "random" else get_postcode(postcode)
-        postcode: Optional[Postcode] = await coroutine
+        postcode = await coroutine
     except CachingError as e:
-        return web.Response(body=e.status, status=500)
+        raise web.HTTPInternalServerError(text=e.status)
+
+    if postcode is None:
+        raise web.HTTPNotFound(text="Invalid Postcode")
 
     try:
-        crime = await fetch_crime(postcode.lat, postcode.long)
-    except (ApiError, CircuitBreakerError):
-        raise web.HTTPInternalServerError(body=f"Requested crime is not cached, and can't be retrieved.")
+        crime, month = await get_crime_with_month(postcode)
+    except CachingError as e:
+        raise web.HTTPInternalServerError(text=e.status)
 
     if crime is None:
-        return web.HTTPNotFound(body="No Police Data")
-    else:
-        return str_json_response(crime)
+        raise web.HTTPNotFound(text="No Police Data")
+
+    # an older month is served while it is refreshed, and mustn't be validated as the current one
+    return with_version(str_json_response(crime), month)
 
 
+@cache_policy(NEIGHBOURHOOD_HTTP_MAX_AGE)
 async def api_neighbourhood(request):
     """
     Gets police data about a neighbourhood.
@@ -52,4 +58,4 @@ async def api_neighbourhood(request):
     if neighbourhood is None:
         raise web.HTTPNotFound(text="No Police Data")
     else:
-        return str_json_response(neighbourhood.serialize())
+        return with_last_modified(str_json_response(await db_read(neighbourhood.serialize)), neighbourhood.cached_date)
@@ -3,13 +3,14 @@ from typing import Optional
 from aiobreaker import CircuitBreakerError
 from aiohttp import web
 
-from ..fetch import ApiError
-from ..fetch.wikipedia import fetch_nearby
 from ..models import Postcode, CachingError
-from ..models.util import get_postcode, get_postcode_random
-from .util import str_json_response
+from ..models.executor import db_read
+from ..models.util import get_postcode, get_postcode_random, get_nearby
+from ..settings import POSTCODE_HTTP_MAX_AGE, NEARBY_HTTP_MAX_AGE
+from .util import str_json_response, cache_policy, with_last_modified
 
 
+@cache_policy(POSTCODE_HTTP_MAX_AGE)
 async def api_postcode(request):
     """
     Gets data from a postcode.
@@ -26,11 +27,18 @@ async def api_postcode(request):
         pass
     else:
         if postcode is not None:
-            return str_json_response(postcode.serialize())
+            def serialize():
+                # the body includes the neighbourhood, which may have been attached since
+                neighbourhood = postcode.neighbourhood
+                return postcode.serialize(), neighbourhood.cached_date if neighbourhood is not None else None
+
+            data, neighbourhood_date = await db_read(serialize)
+            return with_last_modified(str_json_response(data), postcode.cached_date, neighbourhood_date)
         else:
             return web.HTTPNotFound(body="Invalid Postcode")
 
 
+@cache_policy(NEARBY_HTTP_MAX_AGE)
 async def api_nearby(request):
     """
     Gets wikipedia articles near a given postcode.
@@ -53,9 +61,9 @@ async def api_nearby(request):
         raise web.HTTPNotFound(text="Invalid Postcode")
 
     try:
-        nearby_items = await fetch_nearby(postcode.lat, postcode.long, limit)
-    except ApiError:
-        return web.HTTPInternalServerError(text=f"No nearby locations cached, and can't be retrieved.")
+        nearby_items = await get_nearby(postcode.lat, postcode.long, limit)
+    except CachingError as e:
+        raise web.HTTPInternalServerError(text=e.status)
 
     if nearby_items is None:
         raise web.HTTPNotFound(text="No Results")
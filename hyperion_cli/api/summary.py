@@ -0,0 +1,62 @@
+import asyncio
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from .. import logger
+from ..models import Postcode, CachingError
+from ..models.executor import db_read
+from ..models.util import get_postcode, get_postcode_random
+from ..settings import SUMMARY_BUDGET, SUMMARY_TIMEOUTS, SUMMARY_HTTP_MAX_AGE
+from .batch import facets
+from .util import str_json_response, cache_policy
+
+
+def log_orphaned_error(facet: str, task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Could not get {facet} after the summary was sent: {task.exception()!r}")
+
+
+# without a version, as the facets change independently of each other
+@cache_policy(SUMMARY_HTTP_MAX_AGE)
+async def api_summary(request):
+    """
+    Gets a postcode along with all of its facets. The facets are fetched
+    concurrently, and any that don't finish within their timeout or the
+    overall `SUMMARY_BUDGET` are listed as `partial` rather than waited for.
+    They carry on in the background, so that they are cached for next time.
+    :param request: The aiohttp request.
+    """
+    postcode: Optional[str] = request.match_info.get('postcode', None)
+
+    try:
+        coroutine = get_postcode_random() if postcode == "random" else get_postcode(postcode)
+        postcode: Optional[Postcode] = await coroutine
+    except CachingError as e:
+        raise web.HTTPInternalServerError(text=e.status)
+
+    if postcode is None:
+        raise web.HTTPNotFound(text="Invalid Postcode")
+
+    start = time.monotonic()
+    tasks = {facet: asyncio.ensure_future(get_facet(postcode)) for facet, get_facet in facets.items()}
+    summary = {"postcode": await db_read(postcode.serialize), "partial": [], "errors": {}}
+
+    for facet, task in tasks.items():
+        timeout = min(SUMMARY_TIMEOUTS.get(facet, SUMMARY_BUDGET), SUMMARY_BUDGET) - (time.monotonic() - start)
+        try:
+            # shielded so that a slow facet keeps going once the summary is sent
+            summary[facet] = await asyncio.wait_for(asyncio.shield(task), max(0, timeout))
+        except asyncio.TimeoutError:
+            summary[facet] = None
+            summary["partial"].append(facet)
+            task.add_done_callback(lambda task, facet=facet: log_orphaned_error(facet, task))
+        except CachingError as e:
+            summary[facet] = None
+            summary["errors"][facet] = e.status
+
+    # a summary with missing facets is only good until they are cached
+    if len(summary["partial"]) > 0 or len(summary["errors"]) > 0:
+        return str_json_response(summary, headers={"Cache-Control": "no-store"})
+    return str_json_response(summary)
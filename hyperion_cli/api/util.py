@@ -1,12 +1,16 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
 from functools import partial
+from hashlib import blake2b
 from json import dumps
-from typing import Optional
+from typing import Callable, Hashable, Optional
 
 import aiohttp_cors as aiohttp_cors
-from aiohttp import web
+from aiohttp import hdrs, web
 from aiohttp.web import json_response, middleware
 
-from ..util import is_uk_postcode
+from ..settings import HTTP_VALIDATOR_CACHE_SIZE
+from ..util import is_uk_postcode, TTLCache
 
 str_dumps = partial(dumps, default=str)
 str_json_response = partial(json_response, dumps=str_dumps)
@@ -35,6 +39,132 @@ async def normalize_postcode_middleware(request, handler):
         raise web.HTTPMovedPermanently(str(url.url_for(**params)))
 
 
+class CachePolicy:
+    """
+    How long the responses of a route can be cached for, and the validators
+    of the last response for each of its urls, so that a conditional request
+    for a response that hasn't changed is answered without running the handler.
+    """
+
+    def __init__(self, max_age: int, version: Optional[Callable[[], Hashable]] = None):
+        """
+        :param max_age: The time (in seconds) clients and proxies can cache a response for.
+        :param version: Gets the version of the data the route is built from, without any
+            lookups. Only routes with a version are answered without running the handler,
+            as otherwise the data may have changed since. A datetime is also sent as the
+            `Last-Modified` date of the responses.
+        """
+        self.max_age = max_age
+        self.version = version if version is not None else lambda: None
+        self.validators: TTLCache = TTLCache(HTTP_VALIDATOR_CACHE_SIZE, max_age)
+
+    def headers(self, etag: str, last_modified: datetime) -> dict:
+        return {
+            hdrs.ETAG: etag,
+            hdrs.LAST_MODIFIED: format_datetime(last_modified, usegmt=True),
+            hdrs.CACHE_CONTROL: f"public, max-age={self.max_age}",
+        }
+
+
+def cache_policy(max_age: int, version: Optional[Callable[[], Hashable]] = None):
+    """
+    Sets the cache policy of a handler, which is applied by `conditional_middleware`.
+    """
+
+    def decorator(handler):
+        handler.cache_policy = CachePolicy(max_age, version)
+        return handler
+
+    return decorator
+
+
+def with_last_modified(response: web.Response, *dates: Optional[datetime]) -> web.Response:
+    """
+    Sets the `Last-Modified` date of a response to the latest date of the data it is built from.
+    :param dates: The dates the data was cached, in local time.
+    """
+    known = [date.astimezone(timezone.utc) for date in dates if date is not None]
+    if len(known) > 0:
+        response.last_modified = max(known)
+    return response
+
+
+def with_version(response: web.Response, version: Hashable) -> web.Response:
+    """
+    Sets the version of the data a response was built from, for a handler that
+    can serve an older version than its cache policy's, such as while it is refreshed.
+    """
+    setattr(response, "data_version", version)
+    return response
+
+
+def is_not_modified(request, etag: str, last_modified: datetime) -> bool:
+    """
+    :return: Whether the client already has the response, by its etag or else by its date.
+    """
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and last_modified.replace(microsecond=0) <= if_modified_since
+
+
+@middleware
+async def conditional_middleware(request, handler):
+    """
+    Adds cache headers to the responses of routes with a cache policy, and answers
+    conditional requests with a 304. Routes with a version are answered from the
+    validators of the last response for the url and version. Otherwise, or when those
+    have expired, the handler is run and its response is replaced with a 304 if the
+    body is the same as the client's. Responses given an older version by the handler
+    with `with_version` have their validators kept apart. Random postcodes are never cached.
+    """
+    policy: Optional[CachePolicy] = getattr(request.match_info.handler, "cache_policy", None)
+
+    if policy is None or request.method not in (hdrs.METH_GET, hdrs.METH_HEAD):
+        return await handler(request)
+    elif request.match_info.get('postcode', None) == "random":
+        response = await handler(request)
+        response.headers[hdrs.CACHE_CONTROL] = "no-store"
+        return response
+
+    version = policy.version()
+    key = (request.path, version)
+    validators = policy.validators.get(key)
+    if version is not None and validators is not None and is_not_modified(request, *validators):
+        raise web.HTTPNotModified(headers=policy.headers(*validators))
+
+    response = await handler(request)
+    # handlers opt out of caching a response, such as one with missing data, with their own header
+    if not isinstance(response, web.Response) or response.status != 200 or response.body is None \
+            or hdrs.CACHE_CONTROL in response.headers:
+        return response
+
+    if getattr(response, "data_version", version) != version:
+        version = getattr(response, "data_version")
+        key = (request.path, version)
+        validators = policy.validators.get(key)
+
+    etag = f'"{blake2b(response.body, digest_size=16).hexdigest()}"'
+    if response.last_modified is not None:
+        last_modified = response.last_modified
+    elif validators is not None and validators[0] == etag:
+        last_modified = validators[1]
+    elif isinstance(version, datetime):
+        last_modified = version.astimezone(timezone.utc)
+    else:
+        last_modified = datetime.now(timezone.utc)
+
+    policy.validators.set(key, (etag, last_modified))
+    if is_not_modified(request, etag, last_modified):
+        raise web.HTTPNotModified(headers=policy.headers(etag, last_modified))
+
+    response.headers.update(policy.headers(etag, last_modified))
+    return response
+
+
 def enable_cross_origin(app):
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
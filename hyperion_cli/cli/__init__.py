@@ -2,16 +2,22 @@
 The cli package hosts all the functionality for the command line tools.
 """
 
+import itertools
+from asyncio import Semaphore, gather
 from functools import partial
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Iterable, Iterator, TextIO
 
-from click import echo
+from click import echo, get_text_stream
 
-from ..cli.serializers import PostcodeSerializerHuman, PostcodeSerializerJSON
+from ..cli.serializers import PostcodeSerializerHuman, PostcodeSerializerJSON, PostcodeStreamSerializer, \
+    stream_serializers
 from ..cli.util import get_postcode_data
 from ..fetch import ApiError
 from ..models import CachingError
-from .getters import getters, PostcodeGetter
+from ..models.executor import db_read
+from ..settings import CLI_CONCURRENCY
+from ..util import gather_bounded, as_completed_bounded
+from .getters import match_getter, PostcodeFromRandom
 
 
 # todo write dataclass serialize function
@@ -29,9 +35,22 @@ def partition(condition, collection) -> Tuple[List, List]:
     return succeed, fail
 
 
+def read_locations(location_strings: Iterable[str], input_file: Optional[TextIO] = None) -> Iterator[str]:
+    """
+    Chains the given locations with those in a file, one per line, which is read lazily.
+    """
+    yield from location_strings
+    if input_file is not None:
+        for line in input_file:
+            line = line.strip()
+            if line:
+                yield line
+
+
 async def cli(location_strings: Tuple[str], random_postcodes_count: int, *,
               bikes: bool = False, crime: bool = False,
-              nearby: bool = False, as_json: bool = False):
+              nearby: bool = False, as_json: bool = False, concurrency: int = CLI_CONCURRENCY,
+              input_file: Optional[TextIO] = None, output_format: Optional[str] = None):
     """
     Runs the CLI app.
     Tries to execute as many steps as possible to give the user
@@ -43,14 +62,17 @@ async def cli(location_strings: Tuple[str], random_postcodes_count: int, *,
     :param crime: A flag to include crime.
     :param nearby: A flag to include nearby.
     :param as_json: A flag to make json output.
+    :param concurrency: The most locations or postcodes to look up at once.
+    :param input_file: A file of postcodes or coordinates, one per line, to search as well.
+    :param output_format: One of `human`, `json` or the `stream_serializers`, overriding `as_json`.
     """
+    output_format = output_format or ("json" if as_json else "human")
+    locations = read_locations(location_strings, input_file)
 
-    def match_getter(location) -> Optional[PostcodeGetter]:
-        for getter in getters:
-            if getter.can_provide(location):
-                return getter(location)
-        else:
-            return None
+    if output_format in stream_serializers:
+        stream_serializer = stream_serializers[output_format](get_text_stream("stdout"))
+        return await stream_cli(locations, random_postcodes_count, stream_serializer,
+                                bikes=bikes, crime=crime, nearby=nearby, concurrency=concurrency)
 
     async def handle_getter(exception_list, getter):
         try:
@@ -69,20 +91,72 @@ async def cli(location_strings: Tuple[str], random_postcodes_count: int, *,
     handle_datas = partial(handle_datas, exception_list)
 
     postcode_getters = {location: match_getter(location) for location in
-                        set(location_strings) | ({random_postcodes_count} if random_postcodes_count > 0 else set())}
+                        set(locations) | ({random_postcodes_count} if random_postcodes_count > 0 else set())}
 
     matched, unmatched = partition(lambda k_v: k_v[1] is not None, postcode_getters.items())
 
     for location, getter in unmatched:
         echo(f"Invalid input for {location}")
 
-    postcodes_collection = [await handle_getter(getter) for location, getter in matched]
+    postcodes_collection = await gather_bounded((handle_getter(getter) for location, getter in matched), concurrency)
 
     if len(exception_list) > 0:
         for f in exception_list:
             echo(str(f))
         return 1
 
-    postcode_datas = [await handle_datas(postcode) for entry in postcodes_collection for postcode in entry]
-    serializer = (PostcodeSerializerJSON if as_json else PostcodeSerializerHuman)(postcode_datas)
+    postcode_datas = await gather_bounded(
+        (handle_datas(postcode) for entry in postcodes_collection for postcode in entry), concurrency
+    )
+    serializer = (PostcodeSerializerJSON if output_format == "json" else PostcodeSerializerHuman)(postcode_datas)
     echo(serializer.serialize())
+
+
+async def stream_cli(locations: Iterable[str], random_postcodes_count: int, serializer: PostcodeStreamSerializer, *,
+                     bikes: bool = False, crime: bool = False, nearby: bool = False,
+                     concurrency: int = CLI_CONCURRENCY) -> int:
+    """
+    Looks up the locations as they are read, writing each postcode as soon as its data is
+    found, so that memory use doesn't grow with the number of locations. Unlike `cli`,
+    a location that fails doesn't stop the others; the errors are written to stderr.
+
+    :return: The exit status, which is 1 if any location failed.
+    """
+    data_semaphore = Semaphore(max(1, concurrency))
+
+    async def handle_location(location, getter) -> Tuple[List[dict], List[str]]:
+        if getter is None:
+            return [], [f"Invalid input for {location}"]
+
+        try:
+            postcodes = await getter.get_postcodes()
+        except (CachingError, ApiError):
+            return [], [f"Could not get data for {getter}"]
+
+        async def handle_data(postcode):
+            async with data_semaphore:
+                return await get_postcode_data(postcode, bikes, crime, nearby)
+
+        results = await gather(*(handle_data(postcode) for postcode in postcodes or [] if postcode is not None))
+        datas = [await db_read(data.serialize) for data, _ in results]
+        exceptions = [exception for _, new_exceptions in results for exception in new_exceptions]
+        if len(datas) == 0 and len(exceptions) == 0:
+            exceptions.append(f"No postcodes found for {getter}")
+        return datas, exceptions
+
+    # random postcodes are looked up in batches so that they are written as they are found
+    random_batches = (min(concurrency, random_postcodes_count - start)
+                      for start in range(0, random_postcodes_count, max(1, concurrency)))
+    jobs = itertools.chain(
+        (handle_location(location, match_getter(location)) for location in locations),
+        (handle_location(count, PostcodeFromRandom(count)) for count in random_batches),
+    )
+
+    status = 0
+    async for datas, exceptions in as_completed_bounded(jobs, concurrency):
+        for data in datas:
+            serializer.write(data)
+        for exception in exceptions:
+            echo(exception, err=True)
+            status = 1
+    return status
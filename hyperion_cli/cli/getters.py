@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
-from ..models.util import get_postcode, get_postcodes_from_coordinates, get_postcode_random
+from ..models.util import get_postcode, get_postcodes_from_coordinates, get_postcodes_random
 from ..util import is_uk_postcode
 
 
@@ -37,7 +38,7 @@ class PostcodeFromString(PostcodeGetter):
         return [await get_postcode(self.postcode)]
 
     def __repr__(self):
-        return "fuck"
+        return self.postcode
 
 
 class PostcodeFromCoordinates(PostcodeGetter):
@@ -73,7 +74,8 @@ class PostcodeFromCoordinates(PostcodeGetter):
 class PostcodeFromRandom(PostcodeGetter):
 
     async def get_postcodes(self):
-        return [await get_postcode_random() for _ in range(self.count)]
+        # the cli exits straight after, so there's no point topping up the pool
+        return await get_postcodes_random(self.count, refill=False)
 
     @staticmethod
     def can_provide(to_test):
@@ -90,3 +92,11 @@ class PostcodeFromRandom(PostcodeGetter):
 
 
 getters = [PostcodeFromCoordinates, PostcodeFromString, PostcodeFromRandom]
+
+
+def match_getter(location) -> Optional[PostcodeGetter]:
+    for getter in getters:
+        if getter.can_provide(location):
+            return getter(location)
+    else:
+        return None
@@ -0,0 +1,97 @@
+"""
+Warms the caches ahead of time, so that the locations can later be looked up
+offline or without waiting on the upstreams.
+"""
+from asyncio import Semaphore, gather
+from math import floor
+from typing import Iterable, Iterator, List, Set, Tuple
+
+from click import echo
+
+from ..fetch import ApiError
+from ..models import CachingError, Postcode
+from ..models.util import get_neighbourhood, get_crime, get_nearby
+from ..settings import CLI_CONCURRENCY, CRIME_GRID_SIZE
+from ..util import as_completed_bounded
+from .getters import match_getter
+
+BoundingBox = Tuple[float, float, float, float]
+
+
+def parse_box(box: str) -> BoundingBox:
+    """
+    :param box: The corners of the box, as "lat,long,lat,long".
+    :raises ValueError: If the box isn't four coordinates.
+    """
+    lat_start, long_start, lat_end, long_end = map(float, box.split(","))
+    return min(lat_start, lat_end), min(long_start, long_end), max(lat_start, lat_end), max(long_start, long_end)
+
+
+def box_locations(box: BoundingBox, step: float = CRIME_GRID_SIZE) -> Iterator[str]:
+    """
+    Covers a bounding box with a grid of coordinates, one for each crime grid cell,
+    which are also close enough together to cover every nearby tile.
+    :return: The coordinates, as "lat,long".
+    """
+    lat_start, long_start, lat_end, long_end = box
+    # a little leeway so that rounding errors in the span don't drop the last row or column
+    for row in range(floor((lat_end - lat_start) / step + 1e-9) + 1):
+        for column in range(floor((long_end - long_start) / step + 1e-9) + 1):
+            yield f"{lat_start + row * step:.6f},{long_start + column * step:.6f}"
+
+
+async def prefetch(locations: Iterable[str], *, concurrency: int = CLI_CONCURRENCY) -> int:
+    """
+    Looks up the postcodes for the locations, along with their
+    neighbourhood, crime and nearby articles, so that they are cached.
+    The locations are read as they are needed, and the upstreams
+    are kept inside their rate limits by their sessions.
+
+    :param locations: The postcodes or coordinates to prefetch.
+    :param concurrency: The most locations or postcodes to look up at once.
+    :return: The exit status, which is 1 if anything couldn't be fetched.
+    """
+    data_semaphore = Semaphore(max(1, concurrency))
+    seen: Set[str] = set()
+
+    async def prefetch_postcode(postcode: Postcode) -> List[str]:
+        async with data_semaphore:
+            results = await gather(
+                get_neighbourhood(postcode), get_crime(postcode), get_nearby(postcode.lat, postcode.long),
+                return_exceptions=True,
+            )
+
+        exceptions = []
+        for name, result in zip(("neighbourhood", "crimes", "nearby"), results):
+            if isinstance(result, CachingError):
+                exceptions.append(f"could not get {name} for {postcode.postcode}")
+            elif isinstance(result, BaseException):
+                raise result
+        return exceptions
+
+    async def prefetch_location(location) -> Tuple[int, List[str]]:
+        getter = match_getter(location)
+        if getter is None:
+            return 0, [f"Invalid input for {location}"]
+
+        try:
+            postcodes = await getter.get_postcodes()
+        except (CachingError, ApiError):
+            return 0, [f"Could not get data for {getter}"]
+
+        # neighbouring points in a box share most of their postcodes
+        postcodes = [postcode for postcode in postcodes or [] if postcode is not None and postcode.postcode not in seen]
+        seen.update(postcode.postcode for postcode in postcodes)
+
+        results = await gather(*(prefetch_postcode(postcode) for postcode in postcodes))
+        return len(postcodes), [exception for exceptions in results for exception in exceptions]
+
+    status, count = 0, 0
+    async for found, exceptions in as_completed_bounded((prefetch_location(x) for x in locations), concurrency):
+        count += found
+        for exception in exceptions:
+            echo(exception, err=True)
+            status = 1
+
+    echo(f"Prefetched {count} postcodes.")
+    return status
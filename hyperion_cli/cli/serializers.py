@@ -1,6 +1,7 @@
+import csv
 import json
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Dict, TextIO, Type
 
 from click import echo
 from colorama import Fore
@@ -26,7 +27,7 @@ class PostcodeSerializerJSON(PostcodeSerializer):
         self.postcodes = postcode_datas
 
     def serialize(self):
-        return json.dumps(self.postcodes)
+        return json.dumps([data.serialize() for data in self.postcodes], default=str)
 
 
 class PostcodeSerializerHuman(PostcodeSerializer):
@@ -49,8 +50,59 @@ class PostcodeSerializerHuman(PostcodeSerializer):
                 if len(data.bikes) > 10:
                     echo(f"    {Fore.BLUE}(limited to 10){Fore.RESET}")
             if data.crime is not None:
-                echo(f"  Crimes Committed: {len(data['crimes'])}")
+                echo(f"  Crimes Committed: {len(data.crime)}")
             if data.nearby is not None:
                 echo("  Points of Interest:")
                 for x in data.nearby:
                     echo(f"    {x['dist']}m - {x['title']}")
+
+
+class PostcodeStreamSerializer(ABC):
+    """
+    Writes each postcode as soon as it is found, rather
+    than holding them all until the end.
+    """
+
+    def __init__(self, output: TextIO):
+        self.output = output
+
+    @abstractmethod
+    def write(self, data: Dict):
+        """
+        :param data: A serialized `PostcodeData`.
+        """
+        pass
+
+
+class PostcodeSerializerNDJSON(PostcodeStreamSerializer):
+
+    def write(self, data: Dict):
+        self.output.write(json.dumps(data, default=str) + "\n")
+        self.output.flush()
+
+
+class PostcodeSerializerCSV(PostcodeStreamSerializer):
+    """
+    Writes a row per postcode. The bikes, crime and nearby
+    columns hold the number found, or are empty if not requested.
+    """
+
+    fields = ["postcode", "lat", "long", "district", "country", "zone", "bikes", "crime", "nearby"]
+
+    def __init__(self, output: TextIO):
+        super().__init__(output)
+        self.writer = csv.DictWriter(output, self.fields, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, data: Dict):
+        row = dict(data["postcode"])
+        for facet in ("bikes", "crime", "nearby"):
+            row[facet] = len(data[facet]) if data[facet] is not None else None
+        self.writer.writerow(row)
+        self.output.flush()
+
+
+stream_serializers: Dict[str, Type[PostcodeStreamSerializer]] = {
+    "ndjson": PostcodeSerializerNDJSON,
+    "csv": PostcodeSerializerCSV,
+}
@@ -1,13 +1,11 @@
+from asyncio import gather
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 
 from geopy import Point
 
-from ..fetch import ApiError
-from ..fetch.police import fetch_crime
-from ..fetch.wikipedia import fetch_nearby
 from ..models import Postcode, Bike, CachingError
-from ..models.util import get_bikes
+from ..models.util import get_bikes, get_crime, get_nearby
 
 
 @dataclass
@@ -17,32 +15,33 @@ class PostcodeData:
     crime: Optional[List[Dict]] = field(default=None)
     nearby: Optional[List[Dict]] = field(default=None)
 
+    def serialize(self) -> Dict:
+        return {
+            "postcode": self.postcode.serialize(),
+            "bikes": [bike.serialize() for bike in self.bikes] if self.bikes is not None else None,
+            "crime": self.crime,
+            "nearby": self.nearby,
+        }
+
 
 async def get_postcode_data(postcode, bikes, crime, nearby):
     exceptions = []
     coordinates = Point(postcode.lat, postcode.long)
 
-    bikes_list = None
-    crime_list = None
-    nearby_list = None
-
-    if bikes:
+    async def get_facet(enabled, name, getter):
+        if not enabled:
+            return None
         try:
-            bikes_list = await get_bikes(postcode.postcode)
+            return await getter()
         except CachingError:
-            exceptions.append(f"could not get bikes for {postcode.postcode}")
-
-    if crime:
-        try:
-            crime_list = await fetch_crime(coordinates.latitude, coordinates.longitude)
-        except ApiError:
-            exceptions.append(f"could not get crimes for {postcode.postcode}")
-
-    if nearby:
-        try:
-            nearby_list = await fetch_nearby(coordinates.latitude, coordinates.longitude)
-        except ApiError:
-            exceptions.append(f"could not get nearby for {postcode.postcode}")
+            exceptions.append(f"could not get {name} for {postcode.postcode}")
+
+    # the datasets come from different upstreams, so they are fetched at the same time
+    bikes_list, crime_list, nearby_list = await gather(
+        get_facet(bikes, "bikes", lambda: get_bikes(postcode.postcode)),
+        get_facet(crime, "crimes", lambda: get_crime(postcode)),
+        get_facet(nearby, "nearby", lambda: get_nearby(coordinates.latitude, coordinates.longitude)),
+    )
 
     return PostcodeData(
         postcode,
@@ -1,80 +1,143 @@
+import asyncio
+import codecs
 import json
 from datetime import timedelta
-from typing import List
+from typing import List, Any, AsyncIterator, Callable, Awaitable
 
-from aiohttp import ClientSession, ClientConnectionError
+from aiohttp import ClientConnectionError
 from aiobreaker import CircuitBreaker
 from lxml.html import document_fromstring
 
-from ..util import dataloader
 from .. import logger
 from . import ApiError
+from .client import get_session
 
 bike_breaker = CircuitBreaker(fail_max=3, timeout_duration=timedelta(days=3))
 
 
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Incrementally parses a json array from a stream of bytes,
+    yielding each item as soon as it has been received in full.
+    :param chunks: The raw utf-8 encoded chunks.
+    :raise JSONDecodeError: When the stream is not a valid json array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+
+    async for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\n\r,":
+                position += 1
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != "[":
+                    raise json.JSONDecodeError("Expecting an array", buffer, position)
+                started = True
+                position += 1
+            elif buffer[position] == "]":
+                return
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break  # the item is incomplete, wait for the next chunk
+
+                # an item is always followed by a separator so one at the end might be cut short
+                if end == len(buffer):
+                    break
+
+                yield item
+                position = end
+
+    raise json.JSONDecodeError("Unterminated array", buffer, position)
+
+
 @bike_breaker
-@dataloader
-async def fetch_bikes() -> List[dict]:
+async def fetch_bikes(handler: Callable[[List[dict]], Awaitable[None]], chunk_size: int = 1000) -> int:
     """
-    Gets the full list of bikes from the bikeregister site.
+    Streams the full list of bikes from the bikeregister site.
     The data is hidden behind a form post request and so
     we need to extract an xsrf and session token with bs4.
 
-    todo add pytest tests
+    The response is parsed as it arrives and passed on in
+    chunks so that the whole list is never held in memory.
 
-    :return: All the currently registered bikes.
+    :param handler: Called with each chunk of bikes in the order they are listed.
+    :param chunk_size: The number of bikes in each chunk.
+    :return: The number of bikes that were listed.
     :raise ApiError: When there was an error connecting to the API.
     """
-    async with ClientSession() as session:
-        try:
-            async with session.get('https://www.bikeregister.com/stolen-bikes') as request:
-                document = document_fromstring(await request.text())
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.host}")
-            raise ApiError(f"Could not connect to {con_err.host}")
-
-        token = document.xpath("//input[@name='_token']")
-        if len(token) != 1:
-            raise ApiError(f"Couldn't extract token from page.")
-        else:
-            token = token[0].value
-        xsrf_token = request.cookies["XSRF-TOKEN"]
-        laravel_session = request.cookies["laravel_session"]
-
-        # get the bike data
-        headers = {
-            'cookie': f'XSRF-TOKEN={xsrf_token}; laravel_session={laravel_session}',
-            'origin': 'https://www.bikeregister.com',
-            'accept-encoding': 'gzip, deflate, br',
-            'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:61.0) Gecko/20100101 Firefox/61.0',
-            'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'accept': '*/*',
-            'referer': 'https://www.bikeregister.com/stolen-bikes',
-            'authority': 'www.bikeregister.com',
-            'x-requested-with': 'XMLHttpRequest',
-        }
-
-        data = [
-            ('_token', token),
-            ('make', ''),
-            ('model', ''),
-            ('colour', ''),
-            ('reporting_period', '1'),
-        ]
-
-        try:
-            async with session.post('https://www.bikeregister.com/stolen-bikes', headers=headers, data=data) as request:
-                bikes = json.loads(await request.text())
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.host}")
-            raise ApiError(f"Could not connect to {con_err.host}")
-        except json.JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err.msg}")
-            raise ApiError(f"Could not decode data: {dec_err.msg}")
-
-        return bikes
-
-    # if cant open a session
-    return []
+    session = get_session("bikeregister")
+    try:
+        async with session.get('https://www.bikeregister.com/stolen-bikes') as request:
+            document = document_fromstring(await request.text())
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.host}")
+        raise ApiError(f"Could not connect to {con_err.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to bikeregister")
+        raise ApiError("Timed out connecting to bikeregister")
+
+    token = document.xpath("//input[@name='_token']")
+    if len(token) != 1:
+        raise ApiError("Couldn't extract token from page.")
+    else:
+        token = token[0].value
+    xsrf_token = request.cookies["XSRF-TOKEN"]
+    laravel_session = request.cookies["laravel_session"]
+
+    # get the bike data
+    headers = {
+        'cookie': f'XSRF-TOKEN={xsrf_token}; laravel_session={laravel_session}',
+        'origin': 'https://www.bikeregister.com',
+        'accept-encoding': 'gzip, deflate, br',
+        'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:61.0) Gecko/20100101 Firefox/61.0',
+        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+        'accept': '*/*',
+        'referer': 'https://www.bikeregister.com/stolen-bikes',
+        'authority': 'www.bikeregister.com',
+        'x-requested-with': 'XMLHttpRequest',
+    }
+
+    data = [
+        ('_token', token),
+        ('make', ''),
+        ('model', ''),
+        ('colour', ''),
+        ('reporting_period', '1'),
+    ]
+
+    count = 0
+    try:
+        async with session.post('https://www.bikeregister.com/stolen-bikes', headers=headers, data=data) as request:
+            chunk = []
+            async for bike in iter_json_array(request.content.iter_chunked(64 * 1024)):
+                chunk.append(bike)
+                if len(chunk) == chunk_size:
+                    await handler(chunk)
+                    count += len(chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                await handler(chunk)
+                count += len(chunk)
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.host}")
+        raise ApiError(f"Could not connect to {con_err.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to bikeregister")
+        raise ApiError("Timed out connecting to bikeregister")
+    except json.JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err.msg}")
+        raise ApiError(f"Could not decode data: {dec_err.msg}")
+
+    return count
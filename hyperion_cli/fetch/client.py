@@ -0,0 +1,124 @@
+"""
+Holds the http sessions shared by all the fetchers. Each upstream gets its own
+keep-alive connection pool so that connections, tls sessions and dns lookups are
+reused between requests, and so that a slow upstream can't starve the others.
+Requests to an upstream can also be limited to a rate, to stay inside its
+rate limits however many lookups are run at once.
+
+When offline, no sessions are handed out, so every fetch fails straight away
+and only what is already cached can be served.
+"""
+from dataclasses import dataclass
+from typing import Dict
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, DummyCookieJar, TraceConfig
+
+from .. import logger
+from . import ApiError
+from ..settings import OFFLINE, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT, \
+    POSTCODES_CONNECTIONS, POSTCODES_TIMEOUT, POLICE_CONNECTIONS, POLICE_TIMEOUT, \
+    WIKIPEDIA_CONNECTIONS, WIKIPEDIA_TIMEOUT, BIKEREGISTER_CONNECTIONS, BIKEREGISTER_TIMEOUT, \
+    POSTCODES_RATE, POLICE_RATE, WIKIPEDIA_RATE, BIKEREGISTER_RATE
+from ..util import RateLimiter
+
+
+@dataclass
+class Upstream:
+    """
+    The connection settings for a single upstream api.
+    """
+    connections: int
+    timeout: float
+    rate: float = 0
+    keep_cookies: bool = True
+
+
+upstreams: Dict[str, Upstream] = {
+    "postcodes": Upstream(POSTCODES_CONNECTIONS, POSTCODES_TIMEOUT, POSTCODES_RATE),
+    "police": Upstream(POLICE_CONNECTIONS, POLICE_TIMEOUT, POLICE_RATE),
+    "wikipedia": Upstream(WIKIPEDIA_CONNECTIONS, WIKIPEDIA_TIMEOUT, WIKIPEDIA_RATE),
+    # the bikeregister tokens are passed explicitly so the jar must not leak them between refreshes
+    "bikeregister": Upstream(BIKEREGISTER_CONNECTIONS, BIKEREGISTER_TIMEOUT, BIKEREGISTER_RATE, keep_cookies=False),
+}
+
+sessions: Dict[str, ClientSession] = {}
+
+offline = OFFLINE
+
+
+def set_offline(value: bool):
+    """
+    Stops (or allows) any requests to the upstreams.
+    """
+    global offline
+    offline = value
+
+
+def is_offline() -> bool:
+    return offline
+
+
+def _create_session(upstream: Upstream) -> ClientSession:
+    connector = TCPConnector(
+        limit=upstream.connections,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+
+    trace_configs = []
+    if upstream.rate > 0:
+        limiter = RateLimiter(upstream.rate)
+
+        async def wait_for_rate_limit(session, context, params):
+            await limiter.acquire()
+
+        # request start is signalled before a connection is taken from the pool
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(wait_for_rate_limit)
+        trace_configs.append(trace_config)
+
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=upstream.timeout),
+        cookie_jar=None if upstream.keep_cookies else DummyCookieJar(),
+        trace_configs=trace_configs,
+    )
+
+
+def get_session(upstream: str) -> ClientSession:
+    """
+    Gets the pooled session for an upstream, creating it
+    if the client has not been initialized yet.
+    :param upstream: The name of the upstream in `upstreams`.
+    :return: The session to make requests with. It must not be closed by the caller.
+    :raises ApiError: When offline.
+    """
+    if offline:
+        raise ApiError(f"Not connecting to {upstream} while offline")
+
+    session = sessions.get(upstream)
+    if session is None or session.closed:
+        logger.debug(f"Opening connection pool for {upstream}")
+        session = sessions[upstream] = _create_session(upstreams[upstream])
+    return session
+
+
+async def initialize_client():
+    """
+    Opens the connection pools for all the upstreams.
+    """
+    if offline:
+        return
+
+    for upstream in upstreams:
+        get_session(upstream)
+
+
+async def close_client():
+    """
+    Closes all the connection pools.
+    """
+    for upstream, session in list(sessions.items()):
+        logger.debug(f"Closing connection pool for {upstream}")
+        await session.close()
+    sessions.clear()
@@ -1,12 +1,14 @@
+import asyncio
 from datetime import timedelta
 from json import JSONDecodeError
 from typing import Optional, List, Dict
 
-from aiohttp import ClientSession, ClientConnectionError, ContentTypeError
+from aiohttp import ClientConnectionError, ContentTypeError
 from aiobreaker import CircuitBreaker
 
 from .. import logger
 from . import ApiError
+from .client import get_session
 
 police_breaker = CircuitBreaker(fail_max=3, timeout_duration=timedelta(hours=1))
 
@@ -21,64 +23,112 @@ async def fetch_neighbourhood(lat: float, long: float) -> Optional[dict]:
 
     lookup_url = f"https://data.police.uk/api/locate-neighbourhood?q={lat},{long}"
 
-    async with ClientSession() as session:
-        try:
-            async with session.get(lookup_url) as request:
-                if request.status == 404:
-                    return None
-                neighbourhood = await request.json()
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.host}")
-            raise ApiError(f"Could not connect to {con_err.host}")
-        except JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err}")
-            raise ApiError(f"Could not decode data: {dec_err}")
-        except ContentTypeError as con_err:
-            body = await request.text()
-            logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
-            raise ApiError(f"Police API did not serve valid json: {con_err}")
-
-        neighbourhood_url = f"https://data.police.uk/api/{neighbourhood['force']}/{neighbourhood['neighbourhood']}"
-
-        try:
-            async with session.get(neighbourhood_url) as request:
-                neighbourhood_data = await request.json()
-        except ConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.args[0].pool.host}")
-            raise ApiError(f"Could not connect to {con_err.args[0].pool.host}")
-        except JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err}")
-            raise ApiError(f"Could not decode data: {dec_err}")
-        except ContentTypeError as con_err:
-            body = await request.text()
-            logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
-            raise ApiError(f"Police API did not serve valid json: {con_err}")
-
-        return neighbourhood_data
+    session = get_session("police")
+    try:
+        async with session.get(lookup_url) as request:
+            if request.status == 404:
+                return None
+            neighbourhood = await request.json()
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.host}")
+        raise ApiError(f"Could not connect to {con_err.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to the police api")
+        raise ApiError("Timed out connecting to the police api")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+    except ContentTypeError as con_err:
+        body = await request.text()
+        logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
+        raise ApiError(f"Police API did not serve valid json: {con_err}")
+
+    neighbourhood_url = f"https://data.police.uk/api/{neighbourhood['force']}/{neighbourhood['neighbourhood']}"
+
+    try:
+        async with session.get(neighbourhood_url) as request:
+            neighbourhood_data = await request.json()
+    except ConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.args[0].pool.host}")
+        raise ApiError(f"Could not connect to {con_err.args[0].pool.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to the police api")
+        raise ApiError("Timed out connecting to the police api")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+    except ContentTypeError as con_err:
+        body = await request.text()
+        logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
+        raise ApiError(f"Police API did not serve valid json: {con_err}")
+
+    # the neighbourhood's id is only unique within its force, which the data leaves out
+    neighbourhood_data["force"] = neighbourhood["force"]
+    return neighbourhood_data
 
 
 @police_breaker
-async def fetch_crime(lat: float, long: float) -> List[Dict]:
+async def fetch_crime(lat: float, long: float, month: Optional[str] = None) -> Optional[List[Dict]]:
     """
-    Gets crime for a given lat and long.
+    Gets crime within a mile of a given lat and long.
+    :param month: The month (YYYY-MM) to get crime for, defaulting to the most recent.
+    :return: The crimes, or None if there is no data for the location.
     :raise ApiError: When there was an error connecting to the API.
-
-    todo cache
     """
     crime_lookup = f"https://data.police.uk/api/crimes-street/all-crime?lat={lat}&lng={long}"
-    async with ClientSession() as session:
-        try:
-            async with session.get(crime_lookup) as request:
-                crime_request = await request.json()
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.args[0].pool.host}")
-            raise ApiError(f"Could not connect to {con_err.args[0].pool.host}")
-        except JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err}")
-            raise ApiError(f"Could not decode data: {dec_err}")
-        except ContentTypeError as con_err:
-            body = await request.text()
-            logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
-            raise ApiError(f"Police API did not serve valid json: {con_err}")
-        else:
-            return crime_request
+    if month is not None:
+        crime_lookup += f"&date={month}"
+
+    session = get_session("police")
+    try:
+        async with session.get(crime_lookup) as request:
+            if request.status == 404:
+                return None
+            crime_request = await request.json()
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.args[0].pool.host}")
+        raise ApiError(f"Could not connect to {con_err.args[0].pool.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to the police api")
+        raise ApiError("Timed out connecting to the police api")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+    except ContentTypeError as con_err:
+        body = await request.text()
+        logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
+        raise ApiError(f"Police API did not serve valid json: {con_err}")
+    else:
+        return crime_request
+
+
+@police_breaker
+async def fetch_crime_last_updated() -> str:
+    """
+    Gets the month of the most recently published crime data.
+    :return: The month in the form YYYY-MM.
+    :raise ApiError: When there was an error connecting to the API.
+    """
+    session = get_session("police")
+    try:
+        async with session.get("https://data.police.uk/api/crime-last-updated") as request:
+            last_updated = await request.json()
+    except ClientConnectionError as con_err:
+        # only connector errors know their host, a dropped connection doesn't
+        logger.debug(f"Could not connect to the police api: {con_err}")
+        raise ApiError("Could not connect to the police api")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to the police api")
+        raise ApiError("Timed out connecting to the police api")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+    except ContentTypeError as con_err:
+        body = await request.text()
+        logger.exception(f"Invalid content type: {con_err}\n\n{body}\n\n")
+        raise ApiError(f"Police API did not serve valid json: {con_err}")
+
+    try:
+        return last_updated["date"][:7]
+    except (KeyError, TypeError):
+        raise ApiError(f"Police API did not serve a date: {last_updated}")
@@ -1,13 +1,15 @@
+import asyncio
 from datetime import timedelta
 from json import JSONDecodeError
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Dict
 
-from aiohttp import ClientSession, ClientConnectionError
+from aiohttp import ClientConnectionError
 from aiobreaker import CircuitBreaker
 
 from .. import logger
 from ..models import Postcode
 from . import ApiError
+from .client import get_session
 
 
 postcode_breaker = CircuitBreaker(fail_max=3, timeout_duration=timedelta(hours=1))
@@ -16,19 +18,22 @@ base_url = "https://api.postcodes.io"
 
 @postcode_breaker
 async def _get_postcode_from_url(path) -> Optional[Union[Postcode, List[Postcode]]]:
-    async with ClientSession() as session:
-        try:
-            async with session.get(base_url + path) as request:
-                if request.status == 404:
-                    return None
-                else:
-                    postcode_request = await request.json()
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.host}")
-            raise ApiError(f"Could not connect to {con_err.host}")
-        except JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err}")
-            raise ApiError(f"Could not decode data: {dec_err}")
+    session = get_session("postcodes")
+    try:
+        async with session.get(base_url + path) as request:
+            if request.status == 404:
+                return None
+            else:
+                postcode_request = await request.json()
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.host}")
+        raise ApiError(f"Could not connect to {con_err.host}")
+    except asyncio.TimeoutError:
+        logger.debug(f"Timed out connecting to {base_url}")
+        raise ApiError(f"Timed out connecting to {base_url}")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
 
     if isinstance(postcode_request["result"], list):
         return [Postcode.from_dict(entry) for entry in postcode_request["result"]]
@@ -48,6 +53,42 @@ async def fetch_postcode_from_string(postcode: str) -> Optional[Postcode]:
     return await _get_postcode_from_url(postcode_lookup)
 
 
+@postcode_breaker
+async def fetch_postcodes_from_strings(postcodes: List[str]) -> Dict[str, Optional[Postcode]]:
+    """
+    Gets postcode objects for many postcodes at once using the bulk lookup.
+    :param postcodes: The postcodes to look up, at most 100.
+    :return: A mapping from each given postcode to its object or none if the postcode does not exist.
+    :raises ApiError: When there was an error connecting to the API.
+    :raises CircuitBreakerError: When the circuit breaker is open.
+    """
+    if len(postcodes) > 100:
+        raise ValueError("Can only look up 100 postcodes at once.")
+
+    session = get_session("postcodes")
+    try:
+        async with session.post(base_url + "/postcodes", json={"postcodes": postcodes}) as request:
+            if request.status != 200:
+                raise ApiError(f"Bulk lookup failed with status {request.status}")
+            postcode_request = await request.json()
+    except ClientConnectionError as con_err:
+        # only connector errors know their host, a dropped connection doesn't
+        logger.debug(f"Could not connect to {base_url}: {con_err}")
+        raise ApiError(f"Could not connect to {base_url}")
+    except asyncio.TimeoutError:
+        logger.debug(f"Timed out connecting to {base_url}")
+        raise ApiError(f"Timed out connecting to {base_url}")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+
+    # results are returned in the order they were requested
+    return {
+        postcode: Postcode.from_dict(entry["result"]) if entry["result"] is not None else None
+        for postcode, entry in zip(postcodes, postcode_request["result"])
+    }
+
+
 async def fetch_postcodes_from_coordinates(lat: float, long: float) -> Optional[List[Postcode]]:
     """
     Gets a postcode object from the lat and long.
@@ -1,47 +1,54 @@
+import asyncio
 from json import JSONDecodeError
 from typing import Dict, List, Optional
 
-from aiohttp import ClientConnectionError, ClientSession
+from aiohttp import ClientConnectionError
 from aiobreaker import CircuitBreaker
 
 from .. import logger
 from . import ApiError
+from .client import get_session
 
 wikipedia_breaker = CircuitBreaker()
 
+search_radius = 10000
+max_limit = 500
+
 
 @wikipedia_breaker
 async def fetch_nearby(lat: float, long: float, limit: int = 10) -> Optional[List[Dict]]:
     """
     Gets wikipedia articles near a given set of coordinates.
+    :param limit: The number of articles to get, at most `max_limit`.
     :raise ApiError: When there was an error connecting to the API.
-
-    todo cache
     """
     request_url = f"https://en.wikipedia.org/w/api.php?action=query" \
                   f"&list=geosearch" \
                   f"&gscoord={lat}%7C{long}" \
-                  f"&gsradius=10000" \
+                  f"&gsradius={search_radius}" \
                   f"&gslimit={limit}" \
                   f"&format=json"
 
-    async with ClientSession() as session:
-        try:
-            async with session.get(request_url) as request:
-                if request.status == 404:
-                    return None
-                data = (await request.json())["query"]["geosearch"]
-
-        except ClientConnectionError as con_err:
-            logger.debug(f"Could not connect to {con_err.host}")
-            raise ApiError(f"Could not connect to {con_err.host}")
-        except JSONDecodeError as dec_err:
-            logger.error(f"Could not decode data: {dec_err}")
-            raise ApiError(f"Could not decode data: {dec_err}")
-        except KeyError:
-            return None
-        else:
-            for location in data:
-                location.pop("ns")
-                location.pop("primary")
-            return data
+    session = get_session("wikipedia")
+    try:
+        async with session.get(request_url) as request:
+            if request.status == 404:
+                return None
+            data = (await request.json())["query"]["geosearch"]
+
+    except ClientConnectionError as con_err:
+        logger.debug(f"Could not connect to {con_err.host}")
+        raise ApiError(f"Could not connect to {con_err.host}")
+    except asyncio.TimeoutError:
+        logger.debug("Timed out connecting to wikipedia")
+        raise ApiError("Timed out connecting to wikipedia")
+    except JSONDecodeError as dec_err:
+        logger.error(f"Could not decode data: {dec_err}")
+        raise ApiError(f"Could not decode data: {dec_err}")
+    except KeyError:
+        return None
+    else:
+        for location in data:
+            location.pop("ns")
+            location.pop("primary")
+        return data
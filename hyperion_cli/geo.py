@@ -0,0 +1,58 @@
+"""
+Helpers for working with coordinates.
+"""
+from math import floor
+from typing import Tuple, Sequence, Union
+
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS = 6371008.8
+
+distance_methods = ("haversine", "equirectangular", "geodesic")
+
+
+def distances(lat: float, long: float, lats: Union[Sequence[float], np.ndarray],
+              longs: Union[Sequence[float], np.ndarray], method: str = "haversine") -> np.ndarray:
+    """
+    Gets the distance from a point to each of a set of points in a single pass.
+    :param method: One of `distance_methods`. The haversine and equirectangular
+        methods assume a spherical earth and are fast, while geodesic distances
+        are accurate to the ellipsoid but are computed one at a time.
+    :return: The distances in meters, in the same order as the points.
+    """
+    other_lats = np.asarray(lats, dtype=np.float64)
+    other_longs = np.asarray(longs, dtype=np.float64)
+
+    if method == "geodesic":
+        return np.fromiter(
+            (geodesic((lat, long), (other_lat, other_long)).meters
+             for other_lat, other_long in zip(other_lats, other_longs)),
+            dtype=np.float64, count=len(other_lats))
+
+    lat_r, long_r = np.radians(lat), np.radians(long)
+    lats_r, longs_r = np.radians(other_lats), np.radians(other_longs)
+
+    if method == "haversine":
+        a = np.sin((lats_r - lat_r) / 2) ** 2 + np.cos(lat_r) * np.cos(lats_r) * np.sin((longs_r - long_r) / 2) ** 2
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+    elif method == "equirectangular":
+        x = (longs_r - long_r) * np.cos((lats_r + lat_r) / 2)
+        y = lats_r - lat_r
+        return EARTH_RADIUS * np.hypot(x, y)
+    else:
+        raise ValueError(f"Unknown distance method {method}, expected one of {distance_methods}")
+
+
+def snap_to_grid(lat: float, long: float, cell_size: float) -> Tuple[float, float]:
+    """
+    Snaps a pair of coordinates to the centre of the grid cell they fall in.
+    :param lat: The latitude to snap.
+    :param long: The longitude to snap.
+    :param cell_size: The size of the grid cells in degrees.
+    :return: The latitude and longitude of the centre of the cell.
+    """
+    return (
+        round((floor(lat / cell_size) + 0.5) * cell_size, 6),
+        round((floor(long / cell_size) + 0.5) * cell_size, 6),
+    )
@@ -5,24 +5,41 @@ The models package hosts the io for the database, currently through peewee.
 from os.path import expanduser, join
 from typing import Union, Optional
 
-from peewee import SqliteDatabase
-
 from ..fetch import ApiError
+from ..settings import DB_PATH, DB_PROFILE, DB_URL
 from .base import database_proxy
-from .bike import Bike
+from .bike import Bike, BikeSync
+from .crime import Crime
+from .migrations import run_migrations
+from .nearby import Nearby
 from .neighbourhood import Location, Neighbourhood, Link
 from .postcode import Postcode
+from .storage import open_database, connect_database
 
 PostCodeLike = Union[Postcode, str]
 
+models = [Neighbourhood, Bike, BikeSync, Location, Link, Postcode, Crime, Nearby]
+
 
 class CachingError(ApiError):
     pass
 
 
-def initialize_database(path: Optional[str] = None):
-    path = path if path is not None else join(expanduser("~"), '.hyperion.db')
-    database = SqliteDatabase(path)
+def initialize_database(path: Optional[str] = None, profile: str = DB_PROFILE, url: Optional[str] = DB_URL):
+    """
+    Opens the database and brings its schema up to date.
+    :param path: The path to an sqlite database, by default `DB_PATH` or ~/.hyperion.db.
+    :param profile: The name of the storage profile to open an sqlite database with.
+    :param url: The url of the database, used if no path is given.
+    """
+    if path is None and url is not None:
+        database = connect_database(url, profile)
+    else:
+        path = path if path is not None else DB_PATH if DB_PATH is not None else join(expanduser("~"), '.hyperion.db')
+        database = open_database(path, profile)
+    from .util import clear_caches
+
+    clear_caches()
     database_proxy.initialize(database)
     database.connect()
-    database.create_tables([Neighbourhood, Bike, Location, Link, Postcode], safe=True)
+    run_migrations(database, models)
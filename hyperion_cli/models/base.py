@@ -1,9 +1,16 @@
-from peewee import Model, SqliteDatabase, Proxy
+from peewee import Model, SqliteDatabase, PostgresqlDatabase, Database, Proxy, EXCLUDED, fn
 from playhouse.shortcuts import model_to_dict
 
 database_proxy = Proxy()
 
 
+def is_postgres(database: Database = database_proxy) -> bool:
+    """
+    :return: Whether the database (or the database behind the proxy) is PostgreSQL.
+    """
+    return isinstance(database.obj if isinstance(database, Proxy) else database, PostgresqlDatabase)
+
+
 class BaseModel(Model):
     """
     Defines some base properties for a model.
@@ -12,5 +19,33 @@ class BaseModel(Model):
     def serialize(self):
         return model_to_dict(self)
 
+    def upsert(self):
+        """
+        Saves the instance, merging it into the existing row with the same
+        `Meta.upsert_key` rather than inserting a duplicate. Fields left
+        empty on the instance keep the value already in the database.
+        """
+        upsert_key = getattr(self._meta, "upsert_key", None)
+        if upsert_key is None or self._pk is not None:
+            return self.save()
+
+        data = dict(self.__data__)
+        self._populate_unsaved_relations(data)
+        data.pop(self._meta.primary_key.name, None)
+
+        key_fields = [self._meta.fields[name] for name in upsert_key]
+        update = {
+            field: fn.COALESCE(getattr(EXCLUDED, field.column_name), field)
+            for name, field in self._meta.fields.items()
+            if name in data and name not in upsert_key
+        }
+
+        type(self).insert(**data).on_conflict(conflict_target=key_fields, update=update).execute()
+        self._pk = type(self).select(self._meta.primary_key).where(
+            *[field == data[field.name] for field in key_fields]
+        ).scalar()
+        self._dirty.clear()
+        return 1
+
     class Meta:
         database: SqliteDatabase = database_proxy
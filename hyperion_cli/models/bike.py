@@ -1,16 +1,27 @@
 import datetime
-from typing import Optional
+import hashlib
+import json
+from dataclasses import dataclass
 
 import peewee as pw
 from playhouse.shortcuts import model_to_dict
 
-from .base import BaseModel
+from .base import BaseModel, is_postgres
+
+# values the feed uses in place of a frame number or rfid, which don't identify a bike
+placeholder_identifiers = {
+    "UNKNOWN", "NOTKNOWN", "UNK", "NONE", "NULL", "NIL", "NA", "TBC", "NOTAVAILABLE", "NOFRAMENUMBER", "UNREADABLE",
+}
 
 
 class Bike(BaseModel):
     """
     The class for the bike model entity.
+    Bikes are identified by a stable key derived from the
+    feed so that they can be updated in place on each sync.
     """
+    key = pw.CharField(unique=True)
+    content_hash = pw.CharField()
     make = pw.TextField(null=True)
     model = pw.TextField(null=True)
     colour = pw.TextField(null=True)
@@ -21,31 +32,153 @@ class Bike(BaseModel):
     description = pw.TextField(null=True)
     reported_at = pw.TextField(null=True)
     cached_date = pw.DateTimeField(default=datetime.datetime.now)
+    last_seen = pw.DateTimeField(default=datetime.datetime.now, index=True)
+    removed = pw.BooleanField(default=False)
 
     def serialize(self):
-        return model_to_dict(self, exclude=[Bike.cached_date, Bike.id])
+        data = model_to_dict(self, exclude=[
+            Bike.id, Bike.key, Bike.content_hash, Bike.cached_date, Bike.last_seen, Bike.removed
+        ])
+        if hasattr(self, "distance"):
+            data["distance"] = self.distance
+        return data
+
+    @staticmethod
+    def in_box(lat_start: float, lat_end: float, long_start: float, long_end: float) -> pw.ModelSelect:
+        """
+        Selects the id and coordinates of the bikes in a box through the spatial index.
+        Tombstoned bikes and bikes without coordinates are never selected.
+        """
+        query = Bike.select(Bike.id, Bike.latitude, Bike.longitude)
+        if is_postgres():
+            return query.where(
+                Bike.removed == False,  # noqa: E712
+                pw.SQL("point(longitude, latitude) <@ box(point(%s, %s), point(%s, %s))",
+                       (long_start, lat_start, long_end, lat_end)),
+            )
+
+        return query.join(BikeIndex, on=(Bike.id == BikeIndex.id)).where(
+            lat_start <= BikeIndex.max_lat,
+            BikeIndex.min_lat <= lat_end,
+            long_start <= BikeIndex.max_long,
+            BikeIndex.min_long <= long_end
+        )
 
     @staticmethod
-    def get_most_recent_bike() -> Optional['Bike']:
+    def get_key(data: dict) -> str:
         """
-        Gets the most recently cached bike from the database.
-        :return: The bike that was cached most recently.
+        Gets the stable key for a bike in the feed. This is the frame number or
+        rfid tag along with the make, as serials repeat between manufacturers,
+        if it has a real one, or else a hash of the report.
         """
-        try:
-            return Bike.select().order_by(Bike.cached_date.desc()).get()
-        except pw.DoesNotExist:
-            return None
+        make = "".join(str(data.get("make") or "").split()).upper()
+        for field in ("frame_number", "rfid"):
+            value = "".join(character for character in str(data.get(field) or "") if character.isalnum()).upper()
+            if len(value) >= 4 and value not in placeholder_identifiers and len(set(value)) > 1:
+                return f"{field}:{make}:{value}"
+
+        identity = [data.get(field) for field in ("make", "model", "colour", "latitude", "longitude", "reported_at")]
+        return "hash:" + hashlib.sha1(json.dumps(identity).encode()).hexdigest()
 
     @staticmethod
     def from_dict(data: dict) -> 'Bike':
+        """
+        :raises KeyError: When a field is missing.
+        :raises ValueError: When the coordinates are invalid.
+        """
         return Bike(
+            key=Bike.get_key(data),
+            content_hash=hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest(),
             make=data["make"],
             model=data["model"],
             colour=data["colour"],
-            latitude=data["latitude"] if not data["latitude"] == "" else None,
-            longitude=data["longitude"] if not data["longitude"] == "" else None,
+            latitude=float(data["latitude"]) if data["latitude"] not in ("", None) else None,
+            longitude=float(data["longitude"]) if data["longitude"] not in ("", None) else None,
             frame_number=data["frame_number"],
             rfid=data["rfid"],
             description=data["description"],
             reported_at=data["reported_at"]
         )
+
+
+class BikeIndex(BaseModel):
+    """
+    An sqlite r*tree over the bike coordinates so that area queries only touch
+    nearby bikes. It is a virtual table kept in sync with the bike table by
+    triggers, so it is created with `create_bike_index` rather than peewee.
+    It only exists in sqlite databases.
+    """
+    min_lat = pw.FloatField()
+    max_lat = pw.FloatField()
+    min_long = pw.FloatField()
+    max_long = pw.FloatField()
+
+    class Meta:
+        table_name = "bike_index"
+
+
+class BikeSync(BaseModel):
+    """
+    Records a sync of the bike feed that ran to completion, so that a sync
+    which failed partway is retried even though some bikes were seen.
+    """
+    started = pw.DateTimeField()
+    finished = pw.DateTimeField(default=datetime.datetime.now, index=True)
+
+
+def create_bike_index(database: pw.Database):
+    """
+    Creates the bike index and the triggers that keep it in sync, indexing any existing bikes.
+    Bikes without coordinates and tombstoned bikes are left out of the index. PostgreSQL
+    has no r*tree, so it gets a partial GiST index over the coordinates instead.
+    """
+    if is_postgres(database):
+        database.execute_sql(
+            "CREATE INDEX IF NOT EXISTS bike_location ON bike USING gist (point(longitude, latitude)) "
+            "WHERE NOT removed AND latitude IS NOT NULL AND longitude IS NOT NULL")
+        return
+
+    if BikeIndex.table_exists():
+        return
+
+    with database.atomic():
+        database.execute_sql(
+            "CREATE VIRTUAL TABLE bike_index USING rtree(id, min_lat, max_lat, min_long, max_long)")
+        database.execute_sql(
+            "INSERT INTO bike_index SELECT id, latitude, latitude, longitude, longitude FROM bike "
+            "WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND NOT removed")
+        database.execute_sql(
+            "CREATE TRIGGER IF NOT EXISTS bike_index_insert AFTER INSERT ON bike "
+            "WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL AND NOT NEW.removed BEGIN "
+            "INSERT INTO bike_index VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude); "
+            "END")
+        database.execute_sql(
+            "CREATE TRIGGER IF NOT EXISTS bike_index_update AFTER UPDATE OF latitude, longitude, removed ON bike "
+            "BEGIN "
+            "DELETE FROM bike_index WHERE id = OLD.id; "
+            "INSERT INTO bike_index SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude "
+            "WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL AND NOT NEW.removed; "
+            "END")
+        database.execute_sql(
+            "CREATE TRIGGER IF NOT EXISTS bike_index_delete AFTER DELETE ON bike BEGIN "
+            "DELETE FROM bike_index WHERE id = OLD.id; "
+            "END")
+
+
+@dataclass
+class SyncStats:
+    """
+    Describes the changes made by a sync of the bike feed.
+    """
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    duration: float = 0.0
+
+    def __str__(self):
+        return f"{self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged, " \
+               f"{self.removed} removed, {self.invalid} invalid and {self.duplicates} duplicates " \
+               f"in {self.duration:.1f}s"
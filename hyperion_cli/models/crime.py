@@ -0,0 +1,33 @@
+import datetime
+import json
+from typing import List, Dict
+
+import peewee as pw
+
+from .base import BaseModel
+
+
+class Crime(BaseModel):
+    """
+    Caches the crimes reported around a grid cell in a given month.
+    """
+    cell = pw.CharField()
+    month = pw.CharField()
+    crimes = pw.TextField()
+    cached_date = pw.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        indexes = (
+            (('cell', 'month'), True),
+        )
+
+    def serialize(self) -> List[Dict]:
+        return json.loads(self.crimes)
+
+    @staticmethod
+    def from_list(cell: str, month: str, crimes: List[Dict]) -> 'Crime':
+        return Crime(
+            cell=cell,
+            month=month,
+            crimes=json.dumps(crimes),
+        )
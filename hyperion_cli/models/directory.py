@@ -0,0 +1,312 @@
+"""
+A local copy of the ONS Postcode Directory, so that postcodes can be looked up
+and reverse geocoded without the postcodes api. The directory is imported once
+from the ONSPD csv into a folder of numpy arrays, which are memory mapped when
+loaded so that only the pages a lookup touches are read from disk.
+"""
+import csv
+import json
+import os
+import shutil
+from datetime import datetime
+from itertools import islice
+from math import ceil, cos, floor, radians
+from os.path import exists, expanduser, join
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+from .. import logger
+from ..geo import distances
+from ..settings import DIRECTORY_PATH, DIRECTORY_GRID_SIZE
+from .postcode import Postcode
+
+# the countries aren't named in the directory itself
+country_names = {
+    "E92000001": "England",
+    "W92000004": "Wales",
+    "S92000003": "Scotland",
+    "N92000002": "Northern Ireland",
+    "L93000001": "Channel Islands",
+    "M83000003": "Isle of Man",
+}
+
+# the column names vary between releases of the directory
+columns = {
+    "postcode": ("pcd", "pcds", "pcd2"),
+    "lat": ("lat",),
+    "long": ("long",),
+    "terminated": ("doterm",),
+    "country": ("ctry", "ctry25cd"),
+    "district": ("oslaua", "lad25cd", "lad23cd"),
+    "zone": ("msoa11", "msoa21", "msoa21cd"),
+}
+
+arrays = ("keys", "lats", "longs", "districts", "countries", "zones", "cells", "cell_rows")
+
+DirectoryRow = Tuple[str, float, float, str, str, Optional[str]]
+
+
+class PostcodeDirectory:
+    """
+    A read only table of postcodes. The rows are sorted by postcode so that a
+    lookup is a binary search, and a second ordering of the rows by grid cell
+    finds the postcodes near a point in the same way as the bike grid.
+    """
+
+    keys: np.ndarray
+    lats: np.ndarray
+    longs: np.ndarray
+    districts: np.ndarray
+    countries: np.ndarray
+    zones: np.ndarray
+    cells: np.ndarray
+    cell_rows: np.ndarray
+
+    def __init__(self, path: str):
+        """
+        :param path: The folder the directory was imported into.
+        :raises FileNotFoundError: If there is no directory at the path.
+        """
+        with open(join(path, "directory.json")) as f:
+            meta = json.load(f)
+
+        self.cell_size: float = meta["cell_size"]
+        self.width = ceil(360 / self.cell_size) + 1
+        self.strings: List[str] = meta["strings"]
+        self.imported: datetime = datetime.fromisoformat(meta["imported"])
+
+        def load(name: str) -> np.ndarray:
+            return np.load(join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.keys = load("keys")
+        self.lats = load("lats")
+        self.longs = load("longs")
+        self.districts = load("districts")
+        self.countries = load("countries")
+        self.zones = load("zones")
+        self.cells = load("cells")
+        self.cell_rows = load("cell_rows")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, postcode: str) -> Optional[Postcode]:
+        """
+        :param postcode: The postcode, without spaces and in upper case.
+        :return: The postcode, or None if it isn't in the directory.
+        """
+        key = postcode.encode()
+        row = int(np.searchsorted(self.keys, key))
+        if row < len(self.keys) and self.keys[row] == key:
+            return self._postcode(row)
+        return None
+
+    def nearest(self, lat: float, long: float, meters: float = 100, limit: int = 10) -> List[Postcode]:
+        """
+        Gets the postcodes within a radius of a point, like the postcodes api.
+        :return: The postcodes, closest first.
+        """
+        lat_span = meters / 111000 * 1.01
+        long_span = lat_span / max(cos(radians(min(abs(lat) + lat_span, 89.9))), 0.001)
+
+        first_row, first_column = self._cell(lat - lat_span, long - long_span)
+        last_row, last_column = self._cell(lat + lat_span, long + long_span)
+
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = np.searchsorted(self.cells, row * self.width + first_column, side="left")
+            end = np.searchsorted(self.cells, row * self.width + last_column, side="right")
+            if start < end:
+                slices.append(self.cell_rows[start:end])
+
+        if len(slices) == 0:
+            return []
+
+        candidates = np.concatenate(slices)
+        candidate_distances = distances(lat, long, self.lats[candidates], self.longs[candidates])
+        in_radius = np.flatnonzero(candidate_distances < meters)
+        closest = in_radius[np.argsort(candidate_distances[in_radius], kind="stable")][:limit]
+        return [self._postcode(int(candidates[index])) for index in closest]
+
+    def sample(self, count: int) -> List[Postcode]:
+        """
+        :return: Up to `count` distinct postcodes, chosen at random.
+        """
+        rows = np.random.default_rng().choice(len(self.keys), min(count, len(self.keys)), replace=False)
+        return [self._postcode(int(row)) for row in rows]
+
+    def _cell(self, lat: float, long: float) -> Tuple[int, int]:
+        return floor((lat + 90) / self.cell_size), floor((long + 180) / self.cell_size)
+
+    def _postcode(self, row: int) -> Postcode:
+        zone = int(self.zones[row])
+        return Postcode(
+            postcode=self.keys[row].decode(),
+            lat=float(self.lats[row]),
+            long=float(self.longs[row]),
+            country=self.strings[int(self.countries[row])],
+            district=self.strings[int(self.districts[row])],
+            zone=self.strings[zone] if zone > 0 else None,
+            cached_date=datetime.now(),
+        )
+
+    @staticmethod
+    def build(rows: Iterable[DirectoryRow], path: str, cell_size: float = DIRECTORY_GRID_SIZE,
+              chunk_size: int = 65536) -> int:
+        """
+        Writes a directory, replacing any existing one at the path.
+        :param rows: The postcode, lat, long, district, country and zone of each postcode.
+        :param chunk_size: How many rows to read into each block of the arrays.
+        :return: The number of postcodes written.
+        """
+        strings: Dict[Optional[str], int] = {None: 0}
+        chunks: Dict[str, List[np.ndarray]] = {name: [] for name in ("keys", "lats", "longs", "indexes")}
+
+        # the rows are read into fixed size blocks rather than lists of python objects,
+        # so the import only ever holds the arrays themselves and one block of rows
+        iterator = iter(rows)
+        while True:
+            keys = np.empty(chunk_size, dtype="S7")
+            lats = np.empty(chunk_size, dtype=np.float64)
+            longs = np.empty(chunk_size, dtype=np.float64)
+            indexes = np.empty((chunk_size, 3), dtype=np.uint32)
+            count = 0
+            for postcode, lat, long, district, country, zone in islice(iterator, chunk_size):
+                keys[count] = postcode.encode()
+                lats[count] = lat
+                longs[count] = long
+                indexes[count] = (strings.setdefault(district, len(strings)),
+                                  strings.setdefault(country, len(strings)),
+                                  strings.setdefault(zone, len(strings)))
+                count += 1
+            chunks["keys"].append(keys[:count])
+            chunks["lats"].append(lats[:count])
+            chunks["longs"].append(longs[:count])
+            chunks["indexes"].append(indexes[:count])
+            if count < chunk_size:
+                break
+
+        index_type = np.uint16 if len(strings) <= np.iinfo(np.uint16).max else np.uint32
+        all_keys = np.concatenate(chunks.pop("keys"))
+        order = np.argsort(all_keys, kind="stable")
+        all_indexes = np.concatenate(chunks.pop("indexes"))[order].astype(index_type)
+        data = {
+            "keys": all_keys[order],
+            "lats": np.concatenate(chunks.pop("lats"))[order],
+            "longs": np.concatenate(chunks.pop("longs"))[order],
+            "districts": all_indexes[:, 0],
+            "countries": all_indexes[:, 1],
+            "zones": all_indexes[:, 2],
+        }
+
+        width = ceil(360 / cell_size) + 1
+        cells = (np.floor((data["lats"] + 90) / cell_size).astype(np.int64) * width +
+                 np.floor((data["longs"] + 180) / cell_size).astype(np.int64))
+        cell_order = np.argsort(cells, kind="stable")
+        data["cells"] = cells[cell_order]
+        data["cell_rows"] = cell_order.astype(np.uint32)
+
+        # write alongside and swap in, so a failed import leaves the old directory usable
+        building = path + ".building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        for name in arrays:
+            np.save(join(building, f"{name}.npy"), data[name])
+        with open(join(building, "directory.json"), "w") as f:
+            json.dump({
+                "cell_size": cell_size,
+                "imported": datetime.now().isoformat(),
+                "strings": [string for string, _ in sorted(strings.items(), key=lambda item: item[1])],
+            }, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        shutil.move(building, path)
+        return len(data["keys"])
+
+
+def read_onspd(file: TextIO, names: Optional[Dict[str, str]] = None) -> Iterable[DirectoryRow]:
+    """
+    Reads the live postcodes with coordinates from an ONS Postcode Directory csv.
+    :param names: Names for the district and zone codes, which are used as is if missing.
+    :raises ValueError: If a needed column is missing.
+    """
+    names = dict(country_names, **(names or {}))
+    reader = csv.DictReader(file)
+
+    fields = {}
+    for column, candidates in columns.items():
+        found = [candidate for candidate in candidates if candidate in (reader.fieldnames or [])]
+        if len(found) == 0 and column != "zone":
+            raise ValueError(f"The directory has no {column} column, expected one of {candidates}")
+        fields[column] = found[0] if len(found) > 0 else None
+
+    for row in reader:
+        # terminated postcodes and postcodes without a location (99.999999) are left out
+        if row[fields["terminated"]] or float(row[fields["lat"]] or 99.999999) > 90:
+            continue
+
+        zone = row[fields["zone"]] if fields["zone"] is not None else None
+        yield (
+            row[fields["postcode"]].replace(" ", "").upper(),
+            float(row[fields["lat"]]),
+            float(row[fields["long"]]),
+            names.get(row[fields["district"]], row[fields["district"]]),
+            names.get(row[fields["country"]], row[fields["country"]]),
+            names.get(zone, zone) if zone else None,
+        )
+
+
+def read_names(file: TextIO) -> Dict[str, str]:
+    """
+    Reads a names and codes lookup from the directory's documents, such as
+    the local authority districts. The first two columns are the code and name.
+    """
+    reader = csv.reader(file)
+    next(reader, None)
+    return {row[0]: row[1] for row in reader if len(row) >= 2}
+
+
+def import_directory(file: TextIO, name_files: Iterable[TextIO] = (), path: Optional[str] = None) -> int:
+    """
+    Imports an ONS Postcode Directory csv and loads it.
+    :param name_files: Any names and codes lookups for the districts and zones.
+    :param path: Where to write the directory, by default `DIRECTORY_PATH`.
+    :return: The number of postcodes imported.
+    """
+    global postcode_directory, directory_loaded
+
+    path = path if path is not None else default_path()
+    names: Dict[str, str] = {}
+    for name_file in name_files:
+        names.update(read_names(name_file))
+
+    count = PostcodeDirectory.build(read_onspd(file, names), path)
+    postcode_directory = PostcodeDirectory(path)
+    directory_loaded = True
+    logger.info(f"Imported {count} postcodes into {path}.")
+    return count
+
+
+postcode_directory: Optional[PostcodeDirectory] = None
+directory_loaded = False
+
+
+def default_path() -> str:
+    return DIRECTORY_PATH if DIRECTORY_PATH is not None else join(expanduser("~"), ".hyperion-directory")
+
+
+def get_postcode_directory() -> Optional[PostcodeDirectory]:
+    """
+    :return: The postcode directory, loading it on first use, or None if it hasn't been imported.
+    """
+    global postcode_directory, directory_loaded
+
+    if not directory_loaded:
+        directory_loaded = True
+        path = default_path()
+        if exists(join(path, "directory.json")):
+            postcode_directory = PostcodeDirectory(path)
+            logger.info(f"Loaded {len(postcode_directory)} postcodes from {path}.")
+
+    return postcode_directory
@@ -0,0 +1,51 @@
+"""
+Runs database queries off the event loop so that they don't stall other requests.
+Reads share a pool of threads while writes go through a single thread, so that
+writes are serialized and never contend with each other for the database lock.
+"""
+from asyncio import get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar, Optional
+
+from ..settings import DB_READ_THREADS
+
+T = TypeVar('T')
+
+read_executor: Optional[ThreadPoolExecutor] = None
+write_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def db_read(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a function that reads from the database on the read pool.
+    """
+    global read_executor
+
+    if read_executor is None:
+        read_executor = ThreadPoolExecutor(DB_READ_THREADS, thread_name_prefix="db-read")
+    return await get_event_loop().run_in_executor(read_executor, partial(func, *args, **kwargs))
+
+
+async def db_write(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a function that writes to the database on the write thread.
+    Any transaction must be opened and closed inside the function.
+    """
+    global write_executor
+
+    if write_executor is None:
+        write_executor = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+    return await get_event_loop().run_in_executor(write_executor, partial(func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """
+    Waits for any running queries and stops the threads.
+    """
+    global read_executor, write_executor
+
+    for executor in (read_executor, write_executor):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    read_executor = write_executor = None
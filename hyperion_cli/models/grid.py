@@ -0,0 +1,121 @@
+"""
+An in-memory index of the stolen bikes, so that area queries can be answered
+without touching the database. The grid is rebuilt from the database after
+each sync and swapped in whole, so readers never see a partial grid.
+"""
+from datetime import datetime
+from math import ceil, cos, floor, radians
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .. import logger
+from ..geo import distances
+from ..settings import BIKE_GRID_CELL_SIZE
+from .bike import Bike
+from .executor import db_read
+
+# the columns kept for each bike, enough to rebuild the model for serialization
+columns = (Bike.id, Bike.make, Bike.model, Bike.colour, Bike.latitude, Bike.longitude,
+           Bike.frame_number, Bike.rfid, Bike.description, Bike.reported_at)
+
+
+class BikeGrid:
+    """
+    Buckets bikes into fixed size cells. The coordinates are held in arrays
+    sorted by cell, so that each row of cells in a query is a single slice.
+    """
+
+    def __init__(self, rows: List[tuple], cell_size: float = BIKE_GRID_CELL_SIZE):
+        """
+        :param rows: The values of `columns` for each bike with coordinates.
+        :param cell_size: The size of the cells in degrees.
+        """
+        self.cell_size = cell_size
+        self.built = datetime.now()
+        self.width = ceil(360 / cell_size) + 1
+
+        lats = np.array([row[4] for row in rows], dtype=np.float64)
+        longs = np.array([row[5] for row in rows], dtype=np.float64)
+        cells = self._cells(lats, longs)
+
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.lats = lats[order]
+        self.longs = longs[order]
+        self.rows = [rows[index] for index in order]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cells(self, lats: np.ndarray, longs: np.ndarray) -> np.ndarray:
+        row = np.floor((lats + 90) / self.cell_size).astype(np.int64)
+        column = np.floor((longs + 180) / self.cell_size).astype(np.int64)
+        return row * self.width + column
+
+    def _cell(self, lat: float, long: float) -> Tuple[int, int]:
+        return floor((lat + 90) / self.cell_size), floor((long + 180) / self.cell_size)
+
+    @staticmethod
+    def from_database(cell_size: float = BIKE_GRID_CELL_SIZE) -> 'BikeGrid':
+        query = Bike.select(*columns).where(
+            Bike.removed == False,  # noqa: E712
+            Bike.latitude.is_null(False),
+            Bike.longitude.is_null(False),
+        ).tuples()
+        return BikeGrid(list(query), cell_size)
+
+    def query(self, lat: float, long: float, meters: float, method: str = "haversine") -> List[Bike]:
+        """
+        Gets the bikes within a radius of a point.
+        :param method: How to measure distances, one of `geo.distance_methods`.
+        :return: The bikes, closest first, with their distance (m) attached.
+        """
+        # pad the box slightly so the spherical approximation never cuts off a bike
+        lat_span = meters / 111000 * 1.01
+        long_span = lat_span / max(cos(radians(min(abs(lat) + lat_span, 89.9))), 0.001)
+
+        first_row, first_column = self._cell(lat - lat_span, long - long_span)
+        last_row, last_column = self._cell(lat + lat_span, long + long_span)
+
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = np.searchsorted(self.cells, row * self.width + first_column, side="left")
+            end = np.searchsorted(self.cells, row * self.width + last_column, side="right")
+            if start < end:
+                slices.append(np.arange(start, end))
+
+        if len(slices) == 0:
+            return []
+
+        candidates = np.concatenate(slices)
+        candidate_distances = distances(lat, long, self.lats[candidates], self.longs[candidates], method)
+        in_radius = np.flatnonzero(candidate_distances < meters)
+
+        bikes = []
+        for index in in_radius[np.argsort(candidate_distances[in_radius], kind="stable")]:
+            bike = Bike(**{column.name: value for column, value in zip(columns, self.rows[candidates[index]])})
+            bike.distance = round(float(candidate_distances[index]))
+            bikes.append(bike)
+        return bikes
+
+
+bike_grid: Optional[BikeGrid] = None
+
+
+def get_bike_grid() -> Optional[BikeGrid]:
+    """
+    :return: The current grid, or None if it hasn't been built.
+    """
+    return bike_grid
+
+
+async def rebuild_bike_grid(cell_size: float = BIKE_GRID_CELL_SIZE):
+    """
+    Builds a new grid from the database off the event loop and swaps it in.
+    """
+    global bike_grid
+
+    grid = await db_read(BikeGrid.from_database, cell_size)
+    bike_grid = grid
+    logger.info(f"Loaded {len(grid)} bikes into memory.")
@@ -0,0 +1,157 @@
+"""
+Evolves the schema of an existing database. Each migration is numbered and
+applied at most once, with the applied versions recorded in the database.
+A new database is created with the current schema and needs no migrations.
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, Sequence, Tuple, Type
+
+import peewee as pw
+from playhouse.migrate import SchemaMigrator, migrate
+
+from .. import logger
+from .base import BaseModel
+from .bike import Bike, BikeIndex, create_bike_index
+
+migrations: Dict[int, Tuple[str, Callable[[pw.Database], None]]] = {}
+
+
+class Migration(BaseModel):
+    """
+    Records a migration that has been applied to the database.
+    """
+    version = pw.IntegerField(primary_key=True)
+    description = pw.CharField()
+    applied_at = pw.DateTimeField(default=datetime.now)
+
+
+def migration(version: int, description: str):
+    """
+    Registers a function as the migration to a given version.
+    """
+
+    def register(func: Callable[[pw.Database], None]):
+        migrations[version] = (description, func)
+        return func
+
+    return register
+
+
+def columns(database: pw.Database, table: str) -> List[str]:
+    return [column.name for column in database.get_columns(table)]
+
+
+def deduplicate(database: pw.Database, table: str, key: Sequence[str],
+                references: Sequence[Tuple[str, str]] = (), merge: Sequence[str] = ()):
+    """
+    Deletes all but the first row for each value of a key, pointing
+    any references to the deleted rows at the row that was kept.
+    :param table: The table to deduplicate.
+    :param key: The columns that should be unique.
+    :param references: The (table, column) pairs that refer to the table.
+    :param merge: The columns to fill in on the kept row from the deleted rows if it has no value.
+    """
+    param = database.param
+    key_columns = ", ".join(key)
+    replaced = database.execute_sql(f"""
+        SELECT t.id, kept.id FROM {table} t
+        JOIN (SELECT MIN(id) AS id, {key_columns} FROM {table} GROUP BY {key_columns}) kept
+        ON {" AND ".join(f"t.{column} = kept.{column}" for column in key)}
+        WHERE t.id != kept.id
+    """).fetchall()
+    if len(replaced) == 0:
+        return
+
+    for column in merge:
+        database.cursor().executemany(
+            f"UPDATE {table} SET {column} = COALESCE({column}, (SELECT {column} FROM {table} WHERE id = {param})) "
+            f"WHERE id = {param}",
+            replaced,
+        )
+    for other_table, column in references:
+        if database.table_exists(other_table):
+            database.cursor().executemany(
+                f"UPDATE {other_table} SET {column} = {param} WHERE {column} = {param}",
+                [(new, old) for old, new in replaced],
+            )
+
+    database.execute_sql(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {key_columns})")
+    logger.info(f"Removed {len(replaced)} duplicate rows from {table}.")
+
+
+@migration(1, "Rebuild the bike table for incremental syncs")
+def rebuild_bikes(database: pw.Database):
+    # the bike table is a copy of the feed, so an outdated one is rebuilt on the next sync
+    if Bike.table_exists() and "key" not in columns(database, Bike._meta.table_name):
+        database.drop_tables([Bike, BikeIndex])
+
+
+@migration(2, "Key neighbourhoods by their force and code")
+def neighbourhood_forces(database: pw.Database):
+    if not database.table_exists("neighbourhood"):
+        return
+
+    # existing rows don't record their force, so rows with the same code can't
+    # be told apart and are kept as they are, to be replaced as they are refreshed
+    if "force" not in columns(database, "neighbourhood"):
+        migrate(SchemaMigrator.from_database(database).add_column("neighbourhood", "force", pw.CharField(null=True)))
+    database.execute_sql("CREATE UNIQUE INDEX IF NOT EXISTS neighbourhood_force_code ON neighbourhood (force, code)")
+
+
+@migration(3, "Make postcodes unique")
+def unique_postcodes(database: pw.Database):
+    if not database.table_exists("postcode"):
+        return
+
+    # keep any neighbourhood that was only saved against one of the copies
+    deduplicate(database, "postcode", ["postcode"], [("location", "postcode_id")], merge=["neighbourhood_id"])
+    database.execute_sql("CREATE UNIQUE INDEX IF NOT EXISTS postcode_postcode ON postcode (postcode)")
+
+
+@migration(4, "Make neighbourhood links and locations unique")
+def unique_links(database: pw.Database):
+    if database.table_exists("link"):
+        deduplicate(database, "link", ["neighbourhood_id", "url"])
+        database.execute_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS link_neighbourhood_id_url ON link (neighbourhood_id, url)"
+        )
+    if database.table_exists("location"):
+        deduplicate(database, "location", ["neighbourhood_id", "address"])
+        database.execute_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS location_neighbourhood_id_address "
+            "ON location (neighbourhood_id, address)"
+        )
+
+
+@migration(5, "Track when postcodes and neighbourhoods were cached")
+def cached_dates(database: pw.Database):
+    migrator = SchemaMigrator.from_database(database)
+    for table in ("postcode", "neighbourhood"):
+        # existing rows are left without a date, so they are refreshed on their next use
+        if database.table_exists(table) and "cached_date" not in columns(database, table):
+            migrate(migrator.add_column(table, "cached_date", pw.DateTimeField(null=True)))
+
+
+def run_migrations(database: pw.Database, models: List[Type[BaseModel]]):
+    """
+    Brings the database up to date, applying any migrations that haven't
+    been run and creating any missing tables and indexes.
+    :param models: The models to create tables for.
+    """
+    is_new = not any(database.table_exists(model._meta.table_name) for model in models)
+    database.create_tables([Migration], safe=True)
+    applied = {migration.version for migration in Migration.select(Migration.version)}
+
+    for version in sorted(migrations):
+        if version in applied:
+            continue
+
+        description, func = migrations[version]
+        with database.atomic():
+            if not is_new:
+                logger.info(f"Migrating database to version {version}: {description}.")
+                func(database)
+            Migration.create(version=version, description=description)
+
+    database.create_tables(models, safe=True)
+    create_bike_index(database)
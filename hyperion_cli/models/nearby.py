@@ -0,0 +1,29 @@
+import datetime
+import json
+from typing import List, Dict
+
+import peewee as pw
+
+from .base import BaseModel
+
+
+class Nearby(BaseModel):
+    """
+    Caches the wikipedia articles around the centre of a tile.
+    """
+    tile = pw.CharField(unique=True)
+    articles = pw.TextField()
+    cached_date = pw.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        upsert_key = ("tile",)
+
+    def serialize(self) -> List[Dict]:
+        return json.loads(self.articles)
+
+    @staticmethod
+    def from_list(tile: str, articles: List[Dict]) -> 'Nearby':
+        return Nearby(
+            tile=tile,
+            articles=json.dumps(articles),
+        )
@@ -1,3 +1,5 @@
+import datetime
+
 import peewee as pw
 from playhouse.shortcuts import model_to_dict
 
@@ -6,27 +8,54 @@ from .base import BaseModel
 
 class Neighbourhood(BaseModel):
     """
-    Contains information about a police neighbourhood.
+    Contains information about a police neighbourhood. The codes
+    are only unique within a force, so the force is part of the key.
     """
     name = pw.CharField()
+    force = pw.CharField(null=True)
     code = pw.CharField()
     description = pw.CharField(null=True)
     email = pw.CharField(null=True)
     facebook = pw.CharField(null=True)
     telephone = pw.CharField(null=True)
     twitter = pw.CharField(null=True)
+    cached_date = pw.DateTimeField(default=datetime.datetime.now, null=True)
 
     def serialize(self):
-        data = model_to_dict(self, backrefs=True)
+        from .postcode import Postcode
+
+        if self.id is None or hasattr(self, "cached_links"):
+            # either still queued for writing or preloaded, so the links and locations are in memory
+            data = model_to_dict(self, exclude=[Neighbourhood.cached_date])
+            data["links"] = [model_to_dict(link, exclude=[Link.neighbourhood])
+                             for link in getattr(self, "cached_links", [])]
+            data["locations"] = [model_to_dict(location, exclude=[
+                Location.neighbourhood, Postcode.neighbourhood, Postcode.cached_date
+            ]) for location in getattr(self, "cached_locations", [])]
+            return data
+
+        data = model_to_dict(self, backrefs=True, exclude=[Neighbourhood.cached_date, Postcode.cached_date])
         data["links"] = data.pop("links")
         data["locations"] = data.pop("locations")
         data.pop("postcodes")
         return data
 
+    def preload(self):
+        """
+        Loads the links and locations into memory, so that
+        the neighbourhood can be serialized without the database.
+        """
+        from .postcode import Postcode
+
+        self.cached_links = list(self.links)
+        self.cached_locations = list(Location.select(Location, Postcode).join(Postcode)
+                                     .where(Location.neighbourhood == self))
+
     @staticmethod
     def from_dict(data):
         neighbourhood = Neighbourhood(
             name=data["name"],
+            force=data["force"],
             code=data["id"],
             description=data["description"] if "description" in data else None,
             email=data["contact_details"]["email"] if "email" in data["contact_details"] else None,
@@ -37,6 +66,10 @@ class Neighbourhood(BaseModel):
 
         return neighbourhood
 
+    class Meta:
+        indexes = ((("force", "code"), True),)
+        upsert_key = ("force", "code")
+
 
 class Link(BaseModel):
     """
@@ -54,6 +87,10 @@ class Link(BaseModel):
             neighbourhood=neighbourhood,
         )
 
+    class Meta:
+        indexes = ((("neighbourhood", "url"), True),)
+        upsert_key = ("neighbourhood", "url")
+
 
 class Location(BaseModel):
     """
@@ -82,3 +119,7 @@ class Location(BaseModel):
             postcode=postcode,
             type=location["type"],
         )
+
+    class Meta:
+        indexes = ((("neighbourhood", "address"), True),)
+        upsert_key = ("neighbourhood", "address")
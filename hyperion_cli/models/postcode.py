@@ -1,8 +1,10 @@
+import datetime
+
 import peewee as pw
-from geopy import Point
-from geopy.distance import geodesic
 from playhouse.shortcuts import model_to_dict
 
+from ..geo import distances
+from ..settings import DISTANCE_METHOD
 from .base import BaseModel
 
 
@@ -12,21 +14,29 @@ class Postcode(BaseModel):
     """
     from .neighbourhood import Neighbourhood
 
-    postcode = pw.CharField()
+    postcode = pw.CharField(unique=True)
     lat = pw.FloatField()
     long = pw.FloatField()
     country = pw.CharField()
     district = pw.CharField()
     zone = pw.CharField(null=True)
     neighbourhood = pw.ForeignKeyField(Neighbourhood, null=True, related_name="postcodes")
+    cached_date = pw.DateTimeField(default=datetime.datetime.now, null=True)
 
     def serialize(self):
-        return model_to_dict(self, exclude=[Postcode.id])
+        return model_to_dict(self, exclude=[
+            Postcode.id, Postcode.cached_date, Postcode.neighbourhood.rel_model.cached_date
+        ])
+
+    def distance_to(self, other: 'Postcode', method: str = DISTANCE_METHOD) -> float:
+        """
+        :param method: One of `geo.distance_methods`.
+        :return: The distance to the other postcode in kilometers.
+        """
+        return float(distances(self.lat, self.long, [other.lat], [other.long], method)[0]) / 1000
 
-    def distance_to(self, other: 'Postcode'):
-        source = Point(self.lat, self.long)
-        destination = Point(other.lat, other.long)
-        return geodesic(source, destination).kilometers
+    class Meta:
+        upsert_key = ("postcode",)
 
     @staticmethod
     def from_dict(data):
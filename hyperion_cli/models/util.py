@@ -1,49 +1,169 @@
 import asyncio
+import time
 from datetime import timedelta, datetime
-from typing import List, Optional
+from functools import partial
+from typing import List, Optional, Dict, Callable, Awaitable, Union, Tuple
 
+import numpy as np
 from aiobreaker import CircuitBreakerError
 from geopy import Point
 from geopy.distance import geodesic
-from peewee import DoesNotExist, chunked
+from peewee import DoesNotExist, chunked, fn
 
-from ..util import dataloader
+from ..util import dataloader, BatchLoader, TTLCache
 from .. import logger
 from ..fetch import ApiError
+from ..fetch.client import is_offline
 from ..fetch.bikeregister import fetch_bikes
-from ..fetch.police import fetch_neighbourhood
-from ..fetch.postcode import fetch_postcode_from_string, fetch_postcode_random, fetch_postcodes_from_coordinates
-from . import CachingError, PostCodeLike, Postcode, Neighbourhood, Bike, Location, Link
+from ..fetch.police import fetch_neighbourhood, fetch_crime, fetch_crime_last_updated
+from ..fetch.wikipedia import fetch_nearby, search_radius, max_limit
+from ..fetch.postcode import fetch_postcodes_from_strings, fetch_postcode_random, fetch_postcodes_from_coordinates
+from ..geo import snap_to_grid, distances
+from ..settings import POSTCODE_BATCH_WINDOW, CRIME_GRID_SIZE, CRIME_MONTH_TTL, NEARBY_TILE_SIZE, NEARBY_CACHE_TTL, \
+    NEARBY_CACHE_SIZE, BIKE_TOMBSTONE_DAYS, DISTANCE_METHOD, DB_MAINTENANCE_INTERVAL, POSTCODE_CACHE_SIZE, \
+    POSTCODE_CACHE_TTL, NEIGHBOURHOOD_CACHE_SIZE, NEIGHBOURHOOD_CACHE_TTL, NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL, \
+    POSTCODE_MAX_AGE, NEIGHBOURHOOD_MAX_AGE, NEARBY_STALE_TTL, RANDOM_POOL_SIZE
+from .base import database_proxy, is_postgres
+from .bike import SyncStats
+from .directory import get_postcode_directory
+from .executor import db_read, db_write
+from .grid import get_bike_grid, rebuild_bike_grid
+from .storage import optimize_database
+from .writer import writer
+from . import CachingError, PostCodeLike, Postcode, Neighbourhood, Bike, BikeSync, Location, Link, Crime, Nearby
+
+postcode_loader = BatchLoader(fetch_postcodes_from_strings, max_batch_size=100, delay=POSTCODE_BATCH_WINDOW)
+
+nearby_cache: TTLCache = TTLCache(NEARBY_CACHE_SIZE, NEARBY_CACHE_TTL, NEARBY_STALE_TTL)
+
+# hot postcodes and their neighbourhoods, keyed by the normalized postcode
+postcode_cache: TTLCache = TTLCache(POSTCODE_CACHE_SIZE, POSTCODE_CACHE_TTL)
+neighbourhood_cache: TTLCache = TTLCache(NEIGHBOURHOOD_CACHE_SIZE, NEIGHBOURHOOD_CACHE_TTL)
+
+# lookups that the upstream had nothing for, keyed by a (kind, *args) tuple, so that
+# misses aren't fetched again until they expire
+negative_cache: TTLCache = TTLCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+
+# random postcodes fetched ahead of time, so that random requests don't wait on the api
+random_pool: List[Postcode] = []
+
+crime_month: Optional[str] = None
+crime_month_checked: Optional[datetime] = None
+
+# background refreshes of stale entries, keyed like the negative cache
+refreshes: Dict[tuple, asyncio.Future] = {}
+
+
+def revalidate(key: tuple, refresh: Callable[[], Awaitable]):
+    """
+    Refreshes a stale entry in the background while the stale copy is served.
+    Only one refresh runs at a time for each entry, and a failed refresh (such
+    as when the circuit breaker is open) leaves the stale copy in place.
+    Nothing is refreshed while offline.
+    """
+    if key in refreshes or is_offline():
+        return
+
+    async def run():
+        try:
+            await refresh()
+        except (ApiError, CircuitBreakerError) as e:
+            logger.debug(f"Could not refresh {key}, serving stale data: {e!r}")
+        except Exception:
+            logger.exception(f"Could not refresh {key}.")
+        finally:
+            del refreshes[key]
+
+    refreshes[key] = asyncio.ensure_future(run())
+
+
+async def wait_for_refreshes():
+    """
+    Waits for any background refreshes to finish.
+    """
+    while len(refreshes) > 0:
+        await asyncio.gather(*refreshes.values())
+
+
+def is_stale(instance: Union[Postcode, Neighbourhood], max_age: int) -> bool:
+    """
+    :param instance: A cached row with a `cached_date`.
+    :param max_age: The age (in seconds) after which the row should be refreshed.
+    """
+    return instance.cached_date is None or instance.cached_date < datetime.now() - timedelta(seconds=max_age)
+
+
+def invalidate_postcode(postcode: str):
+    """
+    Drops a postcode and its neighbourhood from the in-memory caches.
+    Must be called whenever the row for the postcode is written.
+    """
+    postcode_cache.invalidate(postcode)
+    neighbourhood_cache.invalidate(postcode)
+    negative_cache.invalidate(("postcode", postcode))
+    negative_cache.invalidate(("neighbourhood", postcode))
+
+
+def clear_caches():
+    """
+    Empties the in-memory copies of database rows, such as when switching databases.
+    """
+    postcode_cache.clear()
+    neighbourhood_cache.clear()
+    negative_cache.clear()
+    random_pool.clear()
 
 
-async def update_bikes(delta: Optional[timedelta] = None):
+async def save_postcode(postcode: Postcode):
+    """
+    Queues a fetched postcode to be written and caches it. A copy that is already
+    cached is updated in place instead, so that it keeps its neighbourhood.
+    """
+    cached = postcode_cache.get(postcode.postcode)
+    if cached is not None and cached is not postcode:
+        for field in ("lat", "long", "country", "district", "zone", "cached_date"):
+            setattr(cached, field, getattr(postcode, field))
+        negative_cache.invalidate(("postcode", postcode.postcode))
+        postcode = cached
+    else:
+        invalidate_postcode(postcode.postcode)
+        postcode_cache.set(postcode.postcode, postcode)
+
+    await writer.save(postcode, key=postcode.postcode)
+
+
+async def refresh_postcode(postcode: str):
+    fresh = await postcode_loader.load(postcode)
+    if fresh is not None:
+        await save_postcode(fresh)
+
+
+async def update_bikes(delta: Optional[timedelta] = None, in_memory: bool = False):
     """
     A background task that retrieves bike data.
     :param delta: The amount of time to wait between checks.
+    :param in_memory: Whether to keep a grid of the bikes in memory for `get_bikes`.
     """
 
     async def update(delta: timedelta):
         logger.info("Fetching bike data.")
+        synced = False
         if await should_update_bikes(delta):
             try:
-                bike_data = await fetch_bikes()
+                stats = await sync_bikes()
             except ApiError:
-                logger.debug(f"Failed to fetch bikes.")
+                logger.debug("Failed to fetch bikes.")
             except CircuitBreakerError:
-                logger.debug(f"Failed to fetch bikes (circuit breaker open).")
+                logger.debug("Failed to fetch bikes (circuit breaker open).")
             else:
-                # save only bikes that aren't in the db
-                most_recent_bike = Bike.get_most_recent_bike()
-                most_recent_bike_id = most_recent_bike.id if most_recent_bike is not None else -1
-                new_bikes = [Bike.from_dict(bike) for index, bike in enumerate(bike_data)][most_recent_bike_id+1:]
-
-                with Bike._meta.database.atomic():
-                    Bike.bulk_create(new_bikes, 1000)
-
-                logger.info(f"Saved {len(new_bikes)} new entries.")
+                logger.info(f"Synced bikes: {stats}.")
+                synced = True
         else:
             logger.info("Bike data up to date.")
 
+        if in_memory and (synced or get_bike_grid() is None):
+            await rebuild_bike_grid()
+
     if delta is None:
         await update(timedelta(days=1000))
     else:
@@ -52,22 +172,123 @@ async def update_bikes(delta: Optional[timedelta] = None):
             await asyncio.sleep(delta.total_seconds())
 
 
+async def maintain_database(interval: float = DB_MAINTENANCE_INTERVAL):
+    """
+    A background task that periodically optimizes and checkpoints
+    the database, vacuuming it when it has grown sparse.
+    :param interval: The time (in seconds) to wait between runs.
+    """
+    if is_postgres():
+        return  # the autovacuum daemon looks after postgres
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            vacuumed = await db_write(optimize_database, database_proxy)
+        except Exception:
+            logger.exception("Could not optimize the database.")
+        else:
+            logger.debug(f"Optimized the database{' and vacuumed it' if vacuumed else ''}.")
+
+
 async def should_update_bikes(delta: timedelta):
     """
-    Checks the most recently cached bike and returns true if
-    it either doesn't exist or
+    Checks when the bikes were last synced and returns true
+    if they never have been or it was longer than delta ago.
     :return: Whether the cache should be updated.
-
-    todo what if there are no bikes added for a week? ... every request will be triggered.
     """
-    bike = Bike.get_most_recent_bike()
-    if bike is not None:
-        return bike.cached_date < datetime.now() - delta
+    last_sync = await db_read(BikeSync.select(fn.MAX(BikeSync.finished)).scalar)
+    if last_sync is not None:
+        return last_sync < datetime.now() - delta
     else:
         return True
 
 
-async def get_bikes(postcode: PostCodeLike, kilometers=1.0) -> Optional[List[Bike]]:
+async def sync_bikes() -> SyncStats:
+    """
+    Syncs the bike table with the bikeregister feed. Bikes are matched
+    on their stable key, so new bikes are inserted, changed bikes are
+    updated in place and bikes no longer in the feed are tombstoned.
+    Tombstones are deleted after `BIKE_TOMBSTONE_DAYS`.
+    :return: The changes that were made.
+    :raise ApiError: When there was an error connecting to the API, or the feed had no bikes.
+    :raise CircuitBreakerError: When the circuit breaker is open.
+    """
+    started = datetime.now()
+    timer = time.monotonic()
+    stats = SyncStats()
+
+    def save(bikes: Dict[str, Bike]):
+        with Bike._meta.database.atomic():
+            existing: Dict[str, Bike] = {}
+            for keys in chunked(bikes, 500):
+                query = Bike.select(Bike.id, Bike.key, Bike.content_hash, Bike.last_seen, Bike.removed)
+                existing.update((bike.key, bike) for bike in query.where(Bike.key.in_(keys)))
+
+            new_bikes = []
+            unchanged_ids = []
+            for key, bike in bikes.items():
+                current = existing.get(key)
+                if current is None:
+                    new_bikes.append(bike)
+                elif current.last_seen >= started:
+                    stats.duplicates += 1  # listed twice in the feed
+                elif current.content_hash != bike.content_hash or current.removed:
+                    bike.id = current.id
+                    bike.save()
+                    stats.updated += 1
+                else:
+                    unchanged_ids.append(current.id)
+
+            Bike.bulk_create(new_bikes, 100)
+            for ids in chunked(unchanged_ids, 500):
+                Bike.update(last_seen=started).where(Bike.id.in_(ids)).execute()
+
+        stats.inserted += len(new_bikes)
+        stats.unchanged += len(unchanged_ids)
+
+    def remove_missing() -> int:
+        with Bike._meta.database.atomic():
+            Bike.delete().where(
+                Bike.removed == True,  # noqa: E712
+                Bike.last_seen < started - timedelta(days=BIKE_TOMBSTONE_DAYS),
+            ).execute()
+            return Bike.update(removed=True).where(
+                Bike.last_seen < started,
+                Bike.removed == False,  # noqa: E712
+            ).execute()
+
+    async def save_chunk(chunk: List[dict]):
+        bikes = {}
+        for data in chunk:
+            try:
+                bike = Bike.from_dict(data)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                logger.debug(f"Skipping invalid bike: {e!r}")
+                stats.invalid += 1
+            else:
+                bike.last_seen = started
+                if bike.key in bikes:
+                    stats.duplicates += 1
+                else:
+                    bikes[bike.key] = bike
+
+        await db_write(save, bikes)
+
+    await fetch_bikes(save_chunk, 1000)
+
+    # an empty feed is an upstream problem, and would otherwise tombstone every bike
+    if stats.inserted + stats.updated + stats.unchanged == 0:
+        raise ApiError("The bike feed had no valid bikes")
+
+    stats.removed = await db_write(remove_missing)
+    await db_write(BikeSync.create, started=started)
+
+    stats.duration = time.monotonic() - timer
+    return stats
+
+
+async def get_bikes(postcode: PostCodeLike, kilometers=1.0, method: str = DISTANCE_METHOD) -> Optional[List[Bike]]:
     """
     Gets stolen bikes from the database within a
     certain radius (km) of a given postcode. Selects
@@ -75,7 +296,9 @@ async def get_bikes(postcode: PostCodeLike, kilometers=1.0) -> Optional[List[Bik
     the corners of the square.
     :param postcode: The postcode to look up.
     :param kilometers: The radius (km) of the search.
-    :return: The bikes in that radius or None if the postcode doesn't exist.
+    :param method: How to measure distances, one of `geo.distance_methods`.
+    :return: The bikes in that radius, closest first, with their distance (m)
+        attached or None if the postcode doesn't exist.
     """
 
     try:
@@ -86,10 +309,14 @@ async def get_bikes(postcode: PostCodeLike, kilometers=1.0) -> Optional[List[Bik
     if postcode_opt is None:
         return None
     else:
-        postcode = postcode_opt
+        lat, long = postcode_opt.lat, postcode_opt.long
+
+    grid = get_bike_grid()
+    if grid is not None:
+        return grid.query(lat, long, kilometers * 1000, method)
 
     # create point and distance
-    center = Point(postcode.lat, postcode.long)
+    center = Point(lat, long)
     distance = geodesic(kilometers=kilometers)
 
     # calculate edges of a square and retrieve
@@ -98,34 +325,104 @@ async def get_bikes(postcode: PostCodeLike, kilometers=1.0) -> Optional[List[Bik
     long_start = distance.destination(point=center, bearing=270).longitude
     long_end = distance.destination(point=center, bearing=90).longitude
 
-    bikes_in_area = Bike.select().where(
-        lat_start <= Bike.latitude,
-        Bike.latitude <= lat_end,
-        long_start <= Bike.longitude,
-        Bike.longitude <= long_end
-    )
-
-    # filter out items in square that aren't within the radius and return
-    return [
-        bike for bike in bikes_in_area
-        if geodesic(Point(bike.latitude, bike.longitude), center).kilometers < kilometers
-    ]
+    def bikes_in_radius() -> List[Bike]:
+        candidates = list(Bike.in_box(lat_start, lat_end, long_start, long_end).tuples())
+
+        ids, lats, longs = zip(*candidates) if len(candidates) > 0 else ((), (), ())
+
+        # filter out items in square that aren't within the radius
+        bike_distances = distances(lat, long, lats, longs, method)
+        in_radius = {ids[index]: round(float(bike_distances[index])) for index in
+                     np.flatnonzero(bike_distances < kilometers * 1000)}
+
+        bikes = []
+        for chunk in chunked(in_radius, 500):
+            bikes.extend(Bike.select().where(Bike.id.in_(chunk)))
+        for bike in bikes:
+            bike.distance = in_radius[bike.id]
+
+        return sorted(bikes, key=lambda bike: bike.distance)
+
+    return await db_read(bikes_in_radius)
 
 
 async def get_postcode_random() -> Postcode:
     """
-    Gets a random postcode object..
-    Acts as a middleware between us and the API, caching results.
-    :return: The PostCode object else None if the postcode does not exist.
+    Gets a random postcode object.
+    :return: The PostCode object.
+    :raises CachingError: When there is no postcode directory, and the API is unreachable.
     """
-    try:
-        postcode = await fetch_postcode_random()
-    except (ApiError, CircuitBreakerError):
-        raise CachingError(f"Requested postcode is not cached, and can't be retrieved.")
+    return (await get_postcodes_random(1))[0]
 
-    if postcode is not None:
-        postcode.save()
-    return postcode
+
+async def get_postcodes_random(count: int, refill: bool = True) -> List[Postcode]:
+    """
+    Gets a number of random postcodes. They are sampled from the postcode directory
+    if it has been imported, and otherwise taken from a pool that is topped up in the
+    background. Any that the pool is short of are fetched concurrently, or sampled
+    from the database if the API is unreachable. New ones aren't written to the database.
+    :param refill: Whether to top the pool back up afterwards.
+    :return: The postcodes, of which there may be fewer than requested.
+    :raises CachingError: When there is no postcode directory, and the API is unreachable.
+    """
+    directory = get_postcode_directory()
+    if directory is not None and len(directory) > 0:
+        return directory.sample(count)
+
+    postcodes = random_pool[:count]
+    del random_pool[:count]
+
+    if len(postcodes) < count:
+        try:
+            postcodes += await fetch_postcodes_random(count - len(postcodes))
+        except (ApiError, CircuitBreakerError):
+            taken = {postcode.postcode for postcode in postcodes}
+            cached = await db_read(
+                lambda: list(Postcode.select().order_by(fn.Random()).limit(count - len(postcodes)))
+            )
+            postcodes += [postcode for postcode in cached if postcode.postcode not in taken]
+
+    if len(postcodes) == 0:
+        raise CachingError("Requested postcode is not cached, and can't be retrieved.")
+
+    # random postcodes are only written once their neighbourhood is fetched, or
+    # when they refresh a copy we already have, so sampling doesn't grow the table
+    for postcode in postcodes:
+        if postcode.id is None and postcode_cache.get(postcode.postcode) is not None:
+            await save_postcode(postcode)
+        else:
+            postcode_cache.set(postcode.postcode, postcode)
+
+    if refill and len(random_pool) <= RANDOM_POOL_SIZE // 2:
+        revalidate(("random",), fill_random_pool)
+    return postcodes
+
+
+async def fetch_postcodes_random(count: int) -> List[Postcode]:
+    """
+    Fetches a number of random postcodes from the API concurrently.
+    :return: The postcodes that could be fetched.
+    :raises ApiError: When none of them could be fetched.
+    :raises CircuitBreakerError: When the circuit breaker is open.
+    """
+    results = await asyncio.gather(*(fetch_postcode_random() for _ in range(count)), return_exceptions=True)
+    postcodes = [result for result in results if isinstance(result, Postcode)]
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, (ApiError, CircuitBreakerError)):
+            raise result
+        elif isinstance(result, BaseException) and len(postcodes) == 0:
+            raise result
+    return postcodes
+
+
+async def fill_random_pool(size: Optional[int] = None):
+    """
+    Tops the pool of random postcodes up to a given size in a single batch.
+    :param size: The size of the pool, by default `RANDOM_POOL_SIZE`.
+    """
+    size = size if size is not None else RANDOM_POOL_SIZE
+    if len(random_pool) < size:
+        random_pool.extend(await fetch_postcodes_random(size - len(random_pool)))
 
 
 @dataloader
@@ -133,6 +430,8 @@ async def get_postcode(postcode_like: PostCodeLike) -> Optional[Postcode]:
     """
     Gets the postcode object for a given postcode string.
     Acts as a middleware between us and the API, caching results.
+    Postcodes that aren't in the database are looked up in the
+    postcode directory if it has been imported, before the API.
     :param postcode_like: The either a string postcode or PostCode object.
     :return: The PostCode object else None if the postcode does not exist..
     :raises CachingError: When the postcode is not in cache, and the API is unreachable.
@@ -142,28 +441,63 @@ async def get_postcode(postcode_like: PostCodeLike) -> Optional[Postcode]:
 
     postcode_like = postcode_like.replace(" ", "").upper()
 
-    try:
-        postcode = Postcode.get(Postcode.postcode == postcode_like)
-    except DoesNotExist:
-        logger.info(f"Postcode {postcode_like} not cached, fetching from API")
+    postcode: Optional[Postcode] = postcode_cache.get(postcode_like) or writer.get_pending(Postcode, postcode_like)
+    if postcode is None:
         try:
-            postcode = await fetch_postcode_from_string(postcode_like)
-        except (ApiError, CircuitBreakerError):
-            raise CachingError(f"Requested postcode is not cached, and can't be retrieved.")
-        if postcode is not None:
-            postcode.save()
+            stored: Postcode = await db_read(Postcode.get, Postcode.postcode == postcode_like)
+        except DoesNotExist:
+            directory = get_postcode_directory()
+            postcode = directory.get(postcode_like) if directory is not None else None
+            if postcode is not None:
+                postcode_cache.set(postcode_like, postcode)
+                return postcode
+            elif ("postcode", postcode_like) in negative_cache:
+                return None
+
+            logger.info(f"Postcode {postcode_like} not cached, fetching from API")
+            try:
+                postcode = await postcode_loader.load(postcode_like)
+            except (ApiError, CircuitBreakerError):
+                raise CachingError("Requested postcode is not cached, and can't be retrieved.")
+            if postcode is not None:
+                await save_postcode(postcode)
+            else:
+                negative_cache.set(("postcode", postcode_like), True)
+            return postcode
 
+        postcode = stored
+        postcode_cache.set(postcode_like, postcode)
+
+    if is_stale(postcode, POSTCODE_MAX_AGE):
+        revalidate(("postcode", postcode_like), partial(refresh_postcode, postcode_like))
     return postcode
 
 
 async def get_postcodes_from_coordinates(lat: float, long: float) -> Optional[List[Postcode]]:
+    """
+    Gets the postcodes near a pair of coordinates, closest first,
+    from the postcode directory if it has been imported.
+    :return: The postcodes or None if there are none nearby.
+    :raises CachingError: When there is no directory, and the API is unreachable.
+    """
+    directory = get_postcode_directory()
+    if directory is not None:
+        nearest = [postcode_cache.get(postcode.postcode) or postcode for postcode in directory.nearest(lat, long)]
+        if len(nearest) > 0:
+            return nearest
+
+    if ("coordinates", lat, long) in negative_cache:
+        return None
+
     try:
         postcodes = await fetch_postcodes_from_coordinates(lat, long)
     except (ApiError, CircuitBreakerError):
-        raise CachingError(f"Requested postcode is not cached, and can't be retrieved.")
-    if postcodes is not None:
+        raise CachingError("Requested postcode is not cached, and can't be retrieved.")
+    if postcodes:
         for postcode in postcodes:
-            postcode.save()
+            await save_postcode(postcode)
+    else:
+        negative_cache.set(("coordinates", lat, long), True)
 
     return postcodes
 
@@ -172,6 +506,7 @@ async def get_neighbourhood(postcode_like: PostCodeLike) -> Optional[Neighbourho
     """
     Gets a police neighbourhood from the database.
     Acts as a middleware between us and the API, caching results.
+    Neighbourhoods older than `NEIGHBOURHOOD_MAX_AGE` are refreshed in the background.
     :param postcode_like: The UK postcode to look up.
     :return: The Neighbourhood or None if the postcode does not exist.
     :raises CachingError: If the needed neighbourhood is not in cache, and the fetch isn't responding.
@@ -185,27 +520,227 @@ async def get_neighbourhood(postcode_like: PostCodeLike) -> Optional[Neighbourho
     else:
         if postcode is None:
             return None
-        elif postcode.neighbourhood is not None:
-            return postcode.neighbourhood
+
+    neighbourhood = neighbourhood_cache.get(postcode.postcode) or \
+        writer.get_pending(Neighbourhood, postcode.postcode)
+    if neighbourhood is not None:
+        if is_stale(neighbourhood, NEIGHBOURHOOD_MAX_AGE):
+            revalidate(("neighbourhood", postcode.postcode), partial(refresh_neighbourhood, postcode))
+        return neighbourhood
+
+    def load_neighbourhood() -> Optional[Neighbourhood]:
+        # looked up by postcode, as the instance may be a fresh copy without its neighbourhood
+        neighbourhood = Neighbourhood.select().join(Postcode).where(Postcode.postcode == postcode.postcode).first()
+        if neighbourhood is not None:
+            neighbourhood.preload()
+        return neighbourhood
+
+    neighbourhood = await db_read(load_neighbourhood)
+    if neighbourhood is not None:
+        neighbourhood_cache.set(postcode.postcode, neighbourhood)
+        if is_stale(neighbourhood, NEIGHBOURHOOD_MAX_AGE):
+            revalidate(("neighbourhood", postcode.postcode), partial(refresh_neighbourhood, postcode))
+        return neighbourhood
+    elif ("neighbourhood", postcode.postcode) in negative_cache:
+        return None
 
     try:
         data = await fetch_neighbourhood(postcode.lat, postcode.long)
-    except ApiError as e:
-        raise CachingError(f"Neighbourhood not in cache, and could not reach API: {e.status}")
+    except (ApiError, CircuitBreakerError):
+        raise CachingError("Neighbourhood not in cache, and could not reach API.")
 
     if data is not None:
-        neighbourhood = Neighbourhood.from_dict(data)
-        locations = [Location.from_dict(neighbourhood, postcode, location) for location in data["locations"]]
-        links = [Link.from_dict(neighbourhood, link) for link in data["links"]]
-
-        with Neighbourhood._meta.database.atomic():
-            neighbourhood.save()
-            postcode.neighbourhood = neighbourhood
-            postcode.save()
-            for location in locations:
-                location.save()
-            for link in links:
-                link.save()
+        neighbourhood = await save_neighbourhood(postcode, data)
     else:
+        negative_cache.set(("neighbourhood", postcode.postcode), True)
         neighbourhood = None
     return neighbourhood
+
+
+async def save_neighbourhood(postcode: Postcode, data: dict) -> Neighbourhood:
+    """
+    Queues a fetched neighbourhood to be written along with its links and locations, and caches it.
+    """
+    neighbourhood = Neighbourhood.from_dict(data)
+    locations = [Location.from_dict(neighbourhood, postcode, location) for location in data["locations"]]
+    links = [Link.from_dict(neighbourhood, link) for link in data["links"]]
+
+    neighbourhood.cached_links = links
+    neighbourhood.cached_locations = locations
+    postcode.neighbourhood = neighbourhood
+    invalidate_postcode(postcode.postcode)
+    postcode_cache.set(postcode.postcode, postcode)
+    neighbourhood_cache.set(postcode.postcode, neighbourhood)
+    await writer.save(neighbourhood, postcode, *locations, *links, key=postcode.postcode)
+    return neighbourhood
+
+
+async def refresh_neighbourhood(postcode: Postcode):
+    data = await fetch_neighbourhood(postcode.lat, postcode.long)
+    if data is not None:
+        await save_neighbourhood(postcode, data)
+
+
+async def get_crime_month() -> Optional[str]:
+    """
+    Gets the month of the most recent police data, checking
+    the police api at most once every `CRIME_MONTH_TTL` seconds.
+    :return: The month in the form YYYY-MM, or None if it has never been reachable.
+    """
+    global crime_month, crime_month_checked
+
+    if crime_month_checked is None or crime_month_checked < datetime.now() - timedelta(seconds=CRIME_MONTH_TTL):
+        try:
+            month = await fetch_crime_last_updated()
+        except (ApiError, CircuitBreakerError):
+            logger.debug(f"Could not get the latest police data month, using {crime_month}.")
+        else:
+            if month != crime_month:
+                logger.info(f"Police data available for {month}.")
+            crime_month = month
+            crime_month_checked = datetime.now()
+
+    return crime_month
+
+
+def get_crime_version() -> Optional[str]:
+    """
+    :return: The month of the most recent police data as last checked, without checking it.
+    """
+    return crime_month
+
+
+async def get_crime(postcode_like: PostCodeLike) -> Optional[List[Dict]]:
+    """
+    Gets the crime within a mile of a postcode.
+    Acts as a middleware between us and the API, caching results.
+    The postcode is snapped to a grid so that nearby postcodes share a
+    cache entry. When a new month is published the old month is served
+    while the entry is replaced in the background.
+    :param postcode_like: The UK postcode to look up.
+    :return: The crimes or None if the postcode does not exist or there is no data for it.
+    :raises CachingError: If the crime is not in cache, and the API is unreachable.
+    """
+    crimes, _ = await get_crime_with_month(postcode_like)
+    return crimes
+
+
+async def get_crime_with_month(postcode_like: PostCodeLike) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """
+    Gets the crime within a mile of a postcode, like `get_crime`.
+    :return: The crimes, and the month of the police data they are from,
+        which is older than the current month while it is being refreshed.
+    """
+    try:
+        postcode = await get_postcode(postcode_like)
+    except CachingError as e:
+        raise e
+
+    if postcode is None:
+        return None, None
+
+    lat, long = snap_to_grid(postcode.lat, postcode.long, CRIME_GRID_SIZE)
+    cell = f"{lat},{long}"
+    month = await get_crime_month()
+
+    # the most recent entry is either current or the best we can do offline
+    cached = await db_read(Crime.select().where(Crime.cell == cell).order_by(Crime.month.desc()).first)
+    if cached is not None and (month is None or cached.month >= month):
+        return cached.serialize(), cached.month
+    elif month is None:
+        raise CachingError("Requested crime is not cached, and can't be retrieved.")
+    elif cached is not None:
+        revalidate(("crime", cell), partial(update_crime, lat, long, month))
+        return cached.serialize(), cached.month
+
+    try:
+        return await update_crime(lat, long, month), month
+    except (ApiError, CircuitBreakerError):
+        raise CachingError("Requested crime is not cached, and can't be retrieved.")
+
+
+@dataloader
+async def update_crime(lat: float, long: float, month: str) -> Optional[List[Dict]]:
+    """
+    Fetches the crime for a grid cell and replaces the cached entry.
+    :return: The crimes or None if there is no data for the cell.
+    :raise ApiError: When there was an error connecting to the API.
+    :raise CircuitBreakerError: When the circuit breaker is open.
+    """
+    cell = f"{lat},{long}"
+    if ("crime", cell, month) in negative_cache:
+        return None
+
+    crimes = await fetch_crime(lat, long, month)
+    if crimes is None:
+        negative_cache.set(("crime", cell, month), True)
+        return None
+
+    def save():
+        with Crime._meta.database.atomic():
+            Crime.delete().where(Crime.cell == cell).execute()
+            Crime.from_list(cell, month, crimes).save()
+
+    await db_write(save)
+    return crimes
+
+
+async def get_nearby(lat: float, long: float, limit: int = 10) -> Optional[List[Dict]]:
+    """
+    Gets wikipedia articles near a given set of coordinates.
+    The full set of articles around the centre of a tile is cached
+    and any limit is served by slicing it, with the distances
+    recomputed from the given coordinates. Expired tiles are served
+    for up to `NEARBY_STALE_TTL` seconds while they are refreshed.
+    Tiles are also kept in the database, so they outlive the process.
+    :param limit: The number of articles to get.
+    :return: The articles, closest first, or None if there are none.
+    :raises CachingError: If the tile is not in cache, and the API is unreachable.
+    """
+    tile = snap_to_grid(lat, long, NEARBY_TILE_SIZE)
+    articles, fresh = nearby_cache.get_stale(tile)
+
+    if articles is None:
+        cached = await db_read(Nearby.select().where(Nearby.tile == f"{tile[0]},{tile[1]}").first)
+        if cached is not None:
+            articles = cached.serialize()
+            fresh = cached.cached_date >= datetime.now() - timedelta(seconds=NEARBY_CACHE_TTL)
+            nearby_cache.set(tile, articles)
+
+    if articles is None:
+        try:
+            articles = await update_nearby(tile)
+        except (ApiError, CircuitBreakerError):
+            raise CachingError("No nearby locations cached, and can't be retrieved.")
+        if articles is None:
+            return None
+    elif not fresh:
+        revalidate(("nearby", *tile), partial(update_nearby, tile))
+
+    article_distances = distances(lat, long, [x["lat"] for x in articles], [x["lon"] for x in articles])
+    nearby = [
+        dict(articles[index], dist=round(float(article_distances[index]), 1))
+        for index in np.argsort(article_distances, kind="stable")
+        if article_distances[index] <= search_radius
+    ]
+    return nearby[:limit]
+
+
+@dataloader
+async def update_nearby(tile: Tuple[float, float]) -> Optional[List[Dict]]:
+    """
+    Fetches the articles around the centre of a tile and caches them.
+    :return: The articles or None if there are none.
+    :raise ApiError: When there was an error connecting to the API.
+    :raise CircuitBreakerError: When the circuit breaker is open.
+    """
+    if ("nearby", *tile) in negative_cache:
+        return None
+
+    articles = await fetch_nearby(*tile, max_limit)
+    if articles is None:
+        negative_cache.set(("nearby", *tile), True)
+    else:
+        nearby_cache.set(tile, articles)
+        await db_write(Nearby.from_list(f"{tile[0]},{tile[1]}", articles).upsert)
+    return articles
@@ -0,0 +1,121 @@
+"""
+Persists newly fetched rows in the background, so that responses don't wait on the
+database and cold cache bursts are written in a few large transactions instead of
+one per row. Rows that are still queued can be looked up so readers never miss them.
+"""
+import asyncio
+from typing import Dict, Tuple, Optional, List, Type, TypeVar, Hashable
+
+from peewee import Model
+
+from .. import logger
+from ..settings import WRITE_BATCH_SIZE, WRITE_INTERVAL
+from .base import database_proxy
+from .executor import db_write
+
+M = TypeVar('M', bound=Model)
+
+
+class WriteBehind:
+    """
+    Queues groups of model instances and upserts them in batched transactions.
+    The instances in a group are saved in order, so that a row can refer to
+    rows earlier in the group that haven't been given an id yet.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, interval: float = WRITE_INTERVAL):
+        """
+        :param batch_size: The most groups to write in one transaction.
+        :param interval: The time (in seconds) to wait for more groups before writing.
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending: Dict[Tuple[type, Hashable], Model] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[Tuple[Tuple[Model, ...], Optional[Hashable]]] = []
+
+    def get_pending(self, model: Type[M], key: Hashable) -> Optional[M]:
+        """
+        Gets an instance that has been queued but not yet written.
+        :param model: The type of the instance.
+        :param key: The key the instance was queued with.
+        """
+        return self._pending.get((model, key))  # type: ignore
+
+    async def save(self, *instances: Model, key: Optional[Hashable] = None):
+        """
+        Saves a group of instances, in the background if the writer is running.
+        :param key: If given, the first instance can be found with `get_pending` until it is written.
+        """
+        group = (instances, key)
+        if key is not None:
+            self._pending[(type(instances[0]), key)] = instances[0]
+
+        if self._queue is None:
+            await self._flush([group])
+        else:
+            self._queue.put_nowait(group)
+
+    async def start(self):
+        """
+        Starts writing in the background.
+        """
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Stops the background task and writes anything still queued.
+        """
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        queue, self._queue = self._queue, None
+
+        # a batch taken off the queue when the task was cancelled may not have been written
+        remaining, self._batch = self._batch, []
+        while not queue.empty():
+            remaining.append(queue.get_nowait())
+        if len(remaining) > 0:
+            await self._flush(remaining)
+
+    async def _run(self):
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            await asyncio.sleep(self.interval)
+            while not self._queue.empty() and len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._flush(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Could not write {len(batch)} queued groups.")
+            self._batch = []
+
+    async def _flush(self, batch: List[Tuple[Tuple[Model, ...], Optional[Hashable]]]):
+        def write():
+            with database_proxy.atomic():
+                for instances, _ in batch:
+                    for instance in instances:
+                        instance.upsert()
+
+        try:
+            await db_write(write)
+            logger.debug(f"Wrote {len(batch)} queued groups.")
+        finally:
+            for instances, key in batch:
+                if key is not None and self._pending.get((type(instances[0]), key)) is instances[0]:
+                    del self._pending[(type(instances[0]), key)]
+
+
+writer = WriteBehind()
@@ -11,3 +11,96 @@ TWITTER_ACCESS_TOKEN_SECRET = os.environ.get("TWITTER_ACCESS_TOKEN_SECRET")
 
 SERVER_HOST = os.getenv("HYPERION_HOST", "0.0.0.0")
 SERVER_PORT = os.getenv("HYPERION_PORT", "8080")
+
+HTTP_DNS_CACHE_TTL = int(os.getenv("HYPERION_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HYPERION_KEEPALIVE_TIMEOUT", "30"))
+
+POSTCODES_CONNECTIONS = int(os.getenv("HYPERION_POSTCODES_CONNECTIONS", "20"))
+POSTCODES_TIMEOUT = float(os.getenv("HYPERION_POSTCODES_TIMEOUT", "10"))
+POLICE_CONNECTIONS = int(os.getenv("HYPERION_POLICE_CONNECTIONS", "10"))
+POLICE_TIMEOUT = float(os.getenv("HYPERION_POLICE_TIMEOUT", "30"))
+WIKIPEDIA_CONNECTIONS = int(os.getenv("HYPERION_WIKIPEDIA_CONNECTIONS", "10"))
+WIKIPEDIA_TIMEOUT = float(os.getenv("HYPERION_WIKIPEDIA_TIMEOUT", "10"))
+BIKEREGISTER_CONNECTIONS = int(os.getenv("HYPERION_BIKEREGISTER_CONNECTIONS", "2"))
+BIKEREGISTER_TIMEOUT = float(os.getenv("HYPERION_BIKEREGISTER_TIMEOUT", "300"))
+
+# the requests per second allowed to each upstream, where 0 is unlimited
+POSTCODES_RATE = float(os.getenv("HYPERION_POSTCODES_RATE", "0"))
+POLICE_RATE = float(os.getenv("HYPERION_POLICE_RATE", "15"))
+WIKIPEDIA_RATE = float(os.getenv("HYPERION_WIKIPEDIA_RATE", "0"))
+BIKEREGISTER_RATE = float(os.getenv("HYPERION_BIKEREGISTER_RATE", "0"))
+
+CLI_CONCURRENCY = int(os.getenv("HYPERION_CLI_CONCURRENCY", "16"))
+
+BATCH_MAX_POSTCODES = int(os.getenv("HYPERION_BATCH_MAX_POSTCODES", "100"))
+BATCH_CONCURRENCY = int(os.getenv("HYPERION_BATCH_CONCURRENCY", "8"))
+
+# the time (in seconds) the summary waits for its facets, overall and for each one
+SUMMARY_BUDGET = float(os.getenv("HYPERION_SUMMARY_BUDGET", "2"))
+SUMMARY_TIMEOUTS = {
+    facet: float(os.getenv(f"HYPERION_SUMMARY_{facet.upper()}_TIMEOUT", str(SUMMARY_BUDGET)))
+    for facet in ("bikes", "crime", "neighbourhood", "nearby")
+}
+
+# the time (in seconds) clients and proxies can cache each kind of response for
+POSTCODE_HTTP_MAX_AGE = int(os.getenv("HYPERION_POSTCODE_HTTP_MAX_AGE", str(7 * 86400)))
+NEIGHBOURHOOD_HTTP_MAX_AGE = int(os.getenv("HYPERION_NEIGHBOURHOOD_HTTP_MAX_AGE", "86400"))
+CRIME_HTTP_MAX_AGE = int(os.getenv("HYPERION_CRIME_HTTP_MAX_AGE", "21600"))
+BIKES_HTTP_MAX_AGE = int(os.getenv("HYPERION_BIKES_HTTP_MAX_AGE", "3600"))
+NEARBY_HTTP_MAX_AGE = int(os.getenv("HYPERION_NEARBY_HTTP_MAX_AGE", "86400"))
+SUMMARY_HTTP_MAX_AGE = int(os.getenv("HYPERION_SUMMARY_HTTP_MAX_AGE", "3600"))
+HTTP_VALIDATOR_CACHE_SIZE = int(os.getenv("HYPERION_HTTP_VALIDATOR_CACHE_SIZE", "4096"))
+
+# answer only from the local caches, without any network calls
+OFFLINE = os.getenv("HYPERION_OFFLINE", "false").lower() in ("1", "true", "yes")
+
+POSTCODE_BATCH_WINDOW = float(os.getenv("HYPERION_POSTCODE_BATCH_WINDOW", "0.01"))
+
+CRIME_GRID_SIZE = float(os.getenv("HYPERION_CRIME_GRID_SIZE", "0.0025"))
+CRIME_MONTH_TTL = int(os.getenv("HYPERION_CRIME_MONTH_TTL", "21600"))
+
+POSTCODE_CACHE_SIZE = int(os.getenv("HYPERION_POSTCODE_CACHE_SIZE", "4096"))
+POSTCODE_CACHE_TTL = int(os.getenv("HYPERION_POSTCODE_CACHE_TTL", "3600"))
+NEIGHBOURHOOD_CACHE_SIZE = int(os.getenv("HYPERION_NEIGHBOURHOOD_CACHE_SIZE", "1024"))
+NEIGHBOURHOOD_CACHE_TTL = int(os.getenv("HYPERION_NEIGHBOURHOOD_CACHE_TTL", "3600"))
+
+POSTCODE_MAX_AGE = int(os.getenv("HYPERION_POSTCODE_MAX_AGE", str(30 * 86400)))
+NEIGHBOURHOOD_MAX_AGE = int(os.getenv("HYPERION_NEIGHBOURHOOD_MAX_AGE", str(7 * 86400)))
+
+RANDOM_POOL_SIZE = int(os.getenv("HYPERION_RANDOM_POOL_SIZE", "32"))
+
+DIRECTORY_PATH = os.getenv("HYPERION_DIRECTORY_PATH")
+DIRECTORY_GRID_SIZE = float(os.getenv("HYPERION_DIRECTORY_GRID_SIZE", "0.01"))
+
+NEGATIVE_CACHE_SIZE = int(os.getenv("HYPERION_NEGATIVE_CACHE_SIZE", "4096"))
+NEGATIVE_CACHE_TTL = int(os.getenv("HYPERION_NEGATIVE_CACHE_TTL", "600"))
+
+NEARBY_TILE_SIZE = float(os.getenv("HYPERION_NEARBY_TILE_SIZE", "0.01"))
+NEARBY_CACHE_TTL = int(os.getenv("HYPERION_NEARBY_CACHE_TTL", "86400"))
+NEARBY_STALE_TTL = int(os.getenv("HYPERION_NEARBY_STALE_TTL", str(7 * 86400)))
+NEARBY_CACHE_SIZE = int(os.getenv("HYPERION_NEARBY_CACHE_SIZE", "1024"))
+
+BIKE_TOMBSTONE_DAYS = int(os.getenv("HYPERION_BIKE_TOMBSTONE_DAYS", "30"))
+
+DISTANCE_METHOD = os.getenv("HYPERION_DISTANCE_METHOD", "haversine")
+
+BIKE_GRID_CELL_SIZE = float(os.getenv("HYPERION_BIKE_GRID_CELL_SIZE", "0.05"))
+
+DB_READ_THREADS = int(os.getenv("HYPERION_DB_READ_THREADS", "4"))
+
+WRITE_BATCH_SIZE = int(os.getenv("HYPERION_WRITE_BATCH_SIZE", "200"))
+WRITE_INTERVAL = float(os.getenv("HYPERION_WRITE_INTERVAL", "0.25"))
+
+DB_PATH = os.getenv("HYPERION_DB_PATH")
+DB_URL = os.getenv("HYPERION_DB_URL")
+DB_POOL_SIZE = int(os.getenv("HYPERION_DB_POOL_SIZE", "8"))
+DB_POOL_STALE_TIMEOUT = int(os.getenv("HYPERION_DB_POOL_STALE_TIMEOUT", "300"))
+DB_PROFILE = os.getenv("HYPERION_DB_PROFILE", "tuned")
+DB_JOURNAL_MODE = os.getenv("HYPERION_DB_JOURNAL_MODE", "wal")
+DB_SYNCHRONOUS = os.getenv("HYPERION_DB_SYNCHRONOUS", "normal")
+DB_MMAP_SIZE = int(os.getenv("HYPERION_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE = int(os.getenv("HYPERION_DB_CACHE_SIZE", str(64 * 1024)))
+DB_BUSY_TIMEOUT = float(os.getenv("HYPERION_DB_BUSY_TIMEOUT", "10"))
+DB_STATEMENT_CACHE = int(os.getenv("HYPERION_DB_STATEMENT_CACHE", "256"))
+DB_MAINTENANCE_INTERVAL = int(os.getenv("HYPERION_DB_MAINTENANCE_INTERVAL", "3600"))
+DB_VACUUM_FREE_RATIO = float(os.getenv("HYPERION_DB_VACUUM_FREE_RATIO", "0.25"))
@@ -1,10 +1,17 @@
 import re
+import time
+from asyncio import CancelledError, Future, Semaphore, TimerHandle, ensure_future, gather, get_event_loop, shield, \
+    sleep, wait, FIRST_COMPLETED
 from asyncio.locks import Event
-from typing import Dict, Tuple, Generic, TypeVar
+from collections import OrderedDict
+from functools import wraps
+from math import ceil
+from typing import Dict, Tuple, Generic, TypeVar, Callable, Awaitable, List, Optional, Any, Iterable, AsyncIterator
 
 from hyperion_cli import logger
 
 T = TypeVar('T')
+K = TypeVar('K')
 
 postcode_regex = re.compile("^([Gg][Ii][Rr] 0[Aa]{2})|"
                             "((([A-Za-z][0-9]{1,2})|"
@@ -23,10 +30,12 @@ def dataloader(func):
     Allows multiple parallel calls of the same
     async function 'memoize. Handy if a server
     is making multiple of the same request.
+    Errors are raised to every caller.
     """
 
     requests: Dict[Tuple, DataEvent] = {}
 
+    @wraps(func)
     async def inner_func(*args):
         key = tuple(args)
 
@@ -35,10 +44,15 @@ def dataloader(func):
             response = await requests[key].wait()
         else:
             logger.debug(f"Protecting {func.__name__} with data loader")
-            requests[key] = DataEvent()
-            response = await func(*args)
-            requests[key].send(response)
-            del requests[key]
+            event = requests[key] = DataEvent()
+            try:
+                response = await func(*args)
+            except BaseException as e:
+                event.fail(e)
+                raise
+            finally:
+                del requests[key]
+            event.send(response)
         return response
 
     return inner_func
@@ -49,22 +63,242 @@ class DataEvent(Generic[T]):
     def __init__(self):
         self._event = Event()
         self._data = None
+        self._exception: Optional[BaseException] = None
 
     async def wait(self) -> T:
         if self._sent:
             raise Exception("Data Event Has Happened")
 
         await self._event.wait()
+        if self._exception is not None:
+            raise self._exception
         return self._data
 
     def reset(self):
         self._data = None
+        self._exception = None
         self._event.clear()
 
     def send(self, data: T):
         self._data = data
         self._event.set()
 
+    def fail(self, exception: BaseException):
+        self._exception = exception
+        self._event.set()
+
     @property
     def _sent(self):
         return self._event.is_set()
+
+
+class BatchLoader(Generic[K, T]):
+    """
+    Collects the distinct keys requested over a short
+    window and resolves them with a single call to a batch
+    function, fanning the results back out to the callers.
+    Handy if an api has a bulk endpoint.
+    """
+
+    def __init__(self, batch_func: Callable[[List[K]], Awaitable[Dict[K, T]]],
+                 max_batch_size: int = 100, delay: float = 0.01):
+        """
+        :param batch_func: Resolves a list of keys to a dict of results. Missing keys resolve to None.
+        :param max_batch_size: The most keys to send in one call.
+        :param delay: The time (in seconds) to wait for more keys before dispatching.
+        """
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.delay = delay
+        self._queue: Dict[K, Future] = {}
+        self._in_flight: Dict[K, Future] = {}
+        self._handle: Optional[TimerHandle] = None
+
+    async def load(self, key: K) -> Optional[T]:
+        future = self._queue.get(key, self._in_flight.get(key))
+
+        if future is None:
+            loop = get_event_loop()
+            future = self._queue[key] = loop.create_future()
+            if len(self._queue) >= self.max_batch_size:
+                self._dispatch()
+            elif self._handle is None:
+                self._handle = loop.call_later(self.delay, self._dispatch)
+
+        # one caller being cancelled shouldn't cancel the others
+        return await shield(future)
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        batch, self._queue = self._queue, {}
+        if len(batch) > 0:
+            self._in_flight.update(batch)
+            ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch: Dict[K, Future]):
+        logger.debug(f"Resolving a batch of {len(batch)} with {getattr(self.batch_func, '__name__', 'loader')}")
+        try:
+            results = await self.batch_func(list(batch))
+        except CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key in batch:
+                del self._in_flight[key]
+
+
+class TTLCache(Generic[K, T]):
+    """
+    A bounded in-memory cache. Entries expire after a ttl
+    and the least recently used entry is evicted when full.
+    Expired entries can be kept for a while longer so that
+    they can be served stale while they are refreshed.
+    """
+
+    def __init__(self, max_size: int, ttl: float, stale_ttl: float = 0):
+        """
+        :param max_size: The most entries to hold.
+        :param ttl: The time (in seconds) an entry is valid for.
+        :param stale_ttl: The time (in seconds) after expiring that an entry can still be served by `get_stale`.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[K, Tuple[float, T]]' = OrderedDict()
+
+    def get(self, key: K, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None and entry[0] + self.stale_ttl < time.monotonic():
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get_stale(self, key: K, default: Any = None) -> Tuple[Any, bool]:
+        """
+        Gets an entry even if it has expired, as long as it is within the stale ttl.
+        :return: The value and whether it is still fresh.
+        """
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] + self.stale_ttl < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default, False
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[0] >= time.monotonic()
+
+    def set(self, key: K, value: T):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: K):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that no more than `rate` start
+    each second on average, allowing short bursts.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        :param rate: The calls allowed per second, or 0 for no limit.
+        :param burst: The calls that can start at once, by default a second's worth.
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, ceil(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Waits until a call can start.
+        """
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        # each caller reserves a token, waiting for the deficit if there are none left
+        self._tokens -= 1
+        if self._tokens < 0:
+            await sleep(-self._tokens / self.rate)
+
+
+async def gather_bounded(awaitables: Iterable[Awaitable[T]], limit: int) -> List[T]:
+    """
+    Like `asyncio.gather`, but runs no more than `limit` of the awaitables at once.
+    :return: The results, in the same order as the awaitables.
+    """
+    semaphore = Semaphore(max(1, limit))
+
+    async def run(awaitable: Awaitable[T]) -> T:
+        async with semaphore:
+            return await awaitable
+
+    return await gather(*(run(awaitable) for awaitable in awaitables))
+
+
+async def as_completed_bounded(awaitables: Iterable[Awaitable[T]], limit: int) -> AsyncIterator[T]:
+    """
+    Runs no more than `limit` of the awaitables at once, yielding their results
+    as they finish. The awaitables are only taken from the iterable when there is
+    room for them, so it can be a generator of any length.
+    """
+    iterator = iter(awaitables)
+    pending = set()
+
+    try:
+        while True:
+            for awaitable in iterator:
+                pending.add(ensure_future(awaitable))
+                if len(pending) >= limit:
+                    break
+
+            if len(pending) == 0:
+                return
+
+            done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,49 @@
+"""
+Fixtures shared by the test modules.
+"""
+
+from pytest import fixture
+
+from hyperion_cli.models import initialize_database, Postcode, util, directory as directory_module
+from hyperion_cli.util import TTLCache
+
+
+@fixture(scope="function")
+def upstream(tmp_path, monkeypatch):
+    """
+    A fresh database, with the upstream apis replaced by dummy data.
+    :return: The postcodes looked up and the crime fetched, in order.
+    """
+    initialize_database(str(tmp_path / "test-db.sqlite"))
+    monkeypatch.setattr(directory_module, "postcode_directory", None)
+    monkeypatch.setattr(directory_module, "directory_loaded", True)
+    monkeypatch.setattr(util, "crime_month_checked", None)
+    monkeypatch.setattr(util, "nearby_cache", TTLCache(10, 60))
+    calls = []
+
+    async def load(postcode):
+        calls.append(postcode)
+        if postcode == "EH99ZZ":
+            return None
+        return Postcode(postcode=postcode, lat=55.95, long=-3.19, country="Scotland", district="Edinburgh")
+
+    async def fetch_neighbourhood(lat, long):
+        return {"name": "Old Town", "force": "scotland", "id": "OT",
+                "contact_details": {}, "links": [], "locations": []}
+
+    async def fetch_crime(lat, long, month):
+        calls.append("crime")
+        return [{"category": "burglary", "month": month}]
+
+    async def fetch_crime_last_updated():
+        return "2020-01"
+
+    async def fetch_nearby(lat, long, limit):
+        return [{"pageid": 1, "title": "Castle", "lat": 55.9486, "lon": -3.1999, "dist": 0}]
+
+    monkeypatch.setattr(util.postcode_loader, "load", load)
+    monkeypatch.setattr(util, "fetch_neighbourhood", fetch_neighbourhood)
+    monkeypatch.setattr(util, "fetch_crime", fetch_crime)
+    monkeypatch.setattr(util, "fetch_crime_last_updated", fetch_crime_last_updated)
+    monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+    return calls
@@ -7,11 +7,22 @@ General patterns:
     call the api over http
     assert that the data is as expected
 """
+import asyncio
+import json
+from email.utils import parsedate_to_datetime
 from os import remove
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
 from pytest import mark, fixture
 
-from hyperion_cli.models import initialize_database
+from hyperion_cli.api import batch, summary, crime as crime_api
+from hyperion_cli.api.batch import api_postcodes
+from hyperion_cli.api.crime import api_crime
+from hyperion_cli.api.geo import api_postcode
+from hyperion_cli.api.summary import api_summary
+from hyperion_cli.api.util import conditional_middleware
+from hyperion_cli.models import initialize_database, util
 from test.util import postcodes_io_ok
 
 
@@ -47,3 +58,208 @@ class TestApi:
 
     async def test_postcode_nearby_radius(self, db):
         assert False
+
+
+def make_client(*routes, middlewares=()) -> TestClient:
+    app = web.Application(middlewares=middlewares)
+    app.add_routes(routes)
+    return TestClient(TestServer(app))
+
+
+@mark.asyncio
+class TestBatch:
+
+    async def test_postcodes_with_facets(self, upstream, monkeypatch):
+        async def fetch_nearby(lat, long, limit):
+            raise util.ApiError("Wikipedia is down")
+
+        monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+
+        async with make_client(web.post('/api/postcodes/', api_postcodes)) as client:
+            response = await client.post("/api/postcodes/", json={
+                "postcodes": ["EH1 1AA", "eh11ab", "EH11AA", "EH9 9ZZ", "nope"],
+                "facets": ["crime", "nearby"],
+            })
+            assert response.status == 200
+            assert response.headers["Content-Type"] == "application/x-ndjson"
+            lines = (await response.text()).splitlines()
+
+        results = {result["postcode"]: result for result in map(json.loads, lines)}
+        assert sorted(results) == ["EH11AA", "EH11AB", "EH99ZZ", "nope"]
+        assert results["EH11AA"]["data"]["district"] == "Edinburgh"
+        assert results["EH11AA"]["crime"][0]["category"] == "burglary"
+        assert "nearby" in results["EH11AA"]["errors"]
+        assert results["EH99ZZ"]["error"] == "Invalid Postcode"
+        assert results["nope"]["error"] == "Invalid Postcode"
+
+        # the postcodes share a crime cell, so it is only fetched once
+        assert upstream.count("crime") == 1
+        assert upstream.count("EH11AA") == 1
+
+    async def test_unexpected_errors_are_per_postcode(self, upstream, monkeypatch):
+        get_crime = batch.facets["crime"]
+
+        async def broken_crime(postcode):
+            if postcode.postcode == "EH11AB":
+                raise RuntimeError("Broken")
+            return await get_crime(postcode)
+
+        monkeypatch.setitem(batch.facets, "crime", broken_crime)
+
+        async with make_client(web.post('/api/postcodes/', api_postcodes)) as client:
+            response = await client.post("/api/postcodes/", json={
+                "postcodes": ["EH11AA", "EH11AB", "EH11AD"],
+                "facets": ["crime"],
+            })
+            assert response.status == 200
+            lines = (await response.text()).splitlines()
+
+        results = {result["postcode"]: result for result in map(json.loads, lines)}
+        assert sorted(results) == ["EH11AA", "EH11AB", "EH11AD"]
+        assert results["EH11AB"]["error"] == "Internal Server Error"
+        assert results["EH11AA"]["crime"][0]["category"] == "burglary"
+        assert results["EH11AD"]["crime"][0]["category"] == "burglary"
+
+    async def test_invalid_requests(self, upstream):
+        async with make_client(web.post('/api/postcodes/', api_postcodes)) as client:
+            assert (await client.post("/api/postcodes/", data="nope")).status == 400
+            assert (await client.post("/api/postcodes/", json={"postcodes": "EH11AA"})).status == 400
+            assert (await client.post("/api/postcodes/", json={"postcodes": [], "facets": ["weather"]})).status == 400
+            assert (await client.post("/api/postcodes/", json={"postcodes": ["EH11AA"] * 101})).status == 400
+
+
+@mark.asyncio
+class TestCrime:
+
+    async def test_missing_data_is_not_an_invalid_postcode(self, upstream, monkeypatch):
+        async def fetch_crime(lat, long, month):
+            return None
+
+        monkeypatch.setattr(util, "fetch_crime", fetch_crime)
+
+        async with make_client(web.get('/api/postcode/{postcode}/crime/', api_crime)) as client:
+            response = await client.get("/api/postcode/EH11AA/crime/")
+            assert (response.status, await response.text()) == (404, "No Police Data")
+            response = await client.get("/api/postcode/EH99ZZ/crime/")
+            assert (response.status, await response.text()) == (404, "Invalid Postcode")
+
+
+@mark.asyncio
+class TestSummary:
+
+    async def test_slow_facets_are_partial(self, upstream, monkeypatch):
+        async def fetch_nearby(lat, long, limit):
+            await asyncio.sleep(0.3)
+            return [{"pageid": 1, "title": "Castle", "lat": 55.9486, "lon": -3.1999, "dist": 0}]
+
+        async def fetch_neighbourhood(lat, long):
+            raise util.ApiError("The police api is down")
+
+        monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+        monkeypatch.setattr(util, "fetch_neighbourhood", fetch_neighbourhood)
+        monkeypatch.setattr(summary, "SUMMARY_BUDGET", 0.1)
+
+        async with make_client(web.get('/api/postcode/{postcode}/summary/', api_summary)) as client:
+            response = await client.get("/api/postcode/EH11AA/summary/")
+            assert response.status == 200
+            data = await response.json()
+
+        assert data["postcode"]["postcode"] == "EH11AA"
+        assert data["bikes"] == []
+        assert data["crime"][0]["category"] == "burglary"
+        assert data["partial"] == ["nearby"]
+        assert list(data["errors"]) == ["neighbourhood"]
+
+        # the slow facet is still cached for the next request
+        await asyncio.sleep(0.3)
+        assert len(util.nearby_cache) == 1
+
+
+@mark.asyncio
+class TestConditional:
+
+    async def test_not_modified_without_the_handler(self, upstream, monkeypatch):
+        handled = []
+        get_crime_with_month = crime_api.get_crime_with_month
+
+        async def counted_get_crime(postcode):
+            handled.append(postcode.postcode)
+            return await get_crime_with_month(postcode)
+
+        monkeypatch.setattr(crime_api, "get_crime_with_month", counted_get_crime)
+        routes = (web.get('/api/postcode/{postcode}/crime/', api_crime),)
+
+        async with make_client(*routes, middlewares=[conditional_middleware]) as client:
+            response = await client.get("/api/postcode/EH11AA/crime/")
+            assert response.status == 200
+            assert response.headers["Cache-Control"] == "public, max-age=21600"
+            etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+            response = await client.get("/api/postcode/EH11AA/crime/", headers={"If-None-Match": etag})
+            assert response.status == 304
+            assert response.headers["ETag"] == etag
+            response = await client.get("/api/postcode/EH11AA/crime/", headers={"If-Modified-Since": last_modified})
+            assert response.status == 304
+            assert handled == ["EH11AA"]
+
+            # a neighbouring postcode runs the handler, but shares the same crime
+            response = await client.get("/api/postcode/EH11AB/crime/", headers={"If-None-Match": etag})
+            assert response.status == 304
+            assert handled == ["EH11AA", "EH11AB"]
+
+            # a new month runs the handler again, but the client still has the same crime
+            monkeypatch.setattr(util, "crime_month", "2020-02")
+            response = await client.get("/api/postcode/EH11AA/crime/", headers={"If-None-Match": etag})
+            assert response.status == 304
+            assert handled == ["EH11AA", "EH11AB", "EH11AA"]
+
+            await util.wait_for_refreshes()
+
+    async def test_stale_crime_is_not_validated_for_the_new_month(self, upstream, monkeypatch):
+        routes = (web.get('/api/postcode/{postcode}/crime/', api_crime),)
+
+        async with make_client(*routes, middlewares=[conditional_middleware]) as client:
+            etag = (await client.get("/api/postcode/EH11AA/crime/")).headers["ETag"]
+
+            # the old month is still served while the new one is fetched
+            monkeypatch.setattr(util, "crime_month", "2020-02")
+            response = await client.get("/api/postcode/EH11AA/crime/", headers={"If-None-Match": etag})
+            assert response.status == 304
+            await util.wait_for_refreshes()
+
+            response = await client.get("/api/postcode/EH11AA/crime/", headers={"If-None-Match": etag})
+            assert response.status == 200
+            assert (await response.json())[0]["month"] == "2020-02"
+
+    async def test_changed_body_is_sent_again(self, upstream):
+        routes = (web.get('/api/postcode/{postcode}/', api_postcode),)
+
+        async with make_client(*routes, middlewares=[conditional_middleware]) as client:
+            response = await client.get("/api/postcode/EH11AA/")
+            assert response.status == 200
+            etag, last_modified = response.headers["ETag"], parsedate_to_datetime(response.headers["Last-Modified"])
+            response = await client.get("/api/postcode/EH11AA/", headers={"If-None-Match": etag})
+            assert response.status == 304
+
+            # attaching the neighbourhood changes the body, and dates it
+            neighbourhood = await util.get_neighbourhood("EH11AA")
+            response = await client.get("/api/postcode/EH11AA/", headers={"If-None-Match": etag})
+            assert response.status == 200
+            assert (await response.json())["neighbourhood"]["code"] == "OT"
+            assert response.headers["ETag"] != etag
+            changed = parsedate_to_datetime(response.headers["Last-Modified"])
+            assert changed >= last_modified
+            assert changed >= neighbourhood.cached_date.astimezone().replace(microsecond=0)
+
+    async def test_random_is_not_cached(self, upstream, monkeypatch):
+        async def get_postcode_random():
+            return "EH11AA"
+
+        monkeypatch.setattr(crime_api, "get_postcode_random", get_postcode_random)
+        routes = (web.get('/api/postcode/{postcode}/crime/', api_crime),)
+
+        async with make_client(*routes, middlewares=[conditional_middleware]) as client:
+            response = await client.get("/api/postcode/random/crime/")
+            assert response.status == 200
+            assert response.headers["Cache-Control"] == "no-store"
+            assert "ETag" not in response.headers
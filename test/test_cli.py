@@ -2,12 +2,17 @@
 This module contains integration tests for the command line interface.
 """
 
+import io
+import json
 from os import remove
 
 from pytest import mark, fixture
 
 from hyperion_cli.cli import cli
-from hyperion_cli.models import initialize_database
+from hyperion_cli.cli.prefetch import prefetch, parse_box, box_locations
+from hyperion_cli.fetch import client
+from hyperion_cli.models import initialize_database, Postcode, Crime, Nearby, util
+from hyperion_cli.util import TTLCache
 from test.util import postcodes_io_ok
 
 
@@ -25,3 +30,70 @@ class TestApi:
 
     async def test_postcodes(self, db):
         await cli(("eh47bl",), 0)
+
+
+@mark.asyncio
+class TestStreaming:
+
+    @fixture(scope="function")
+    def db(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        for postcode in ("EH11AA", "EH11AB", "EH11AD"):
+            Postcode.create(postcode=postcode, lat=55.95, long=-3.19, country="Scotland", district="Edinburgh")
+
+    async def test_ndjson_from_input(self, db, capsys):
+        status = await cli(("EH11AA",), 0, input_file=io.StringIO("EH1 1AB\n\neh11ad\nnot a postcode\n"),
+                           output_format="ndjson", concurrency=2)
+        out, err = capsys.readouterr()
+
+        assert status == 1
+        assert sorted(json.loads(line)["postcode"]["postcode"] for line in out.splitlines()) == \
+               ["EH11AA", "EH11AB", "EH11AD"]
+        assert "Invalid input for not a postcode" in err
+
+    async def test_csv(self, db, capsys):
+        status = await cli(("EH11AA",), 0, output_format="csv")
+        out, _ = capsys.readouterr()
+
+        assert status == 0
+        assert out.splitlines() == [
+            "postcode,lat,long,district,country,zone,bikes,crime,nearby",
+            "EH11AA,55.95,-3.19,Edinburgh,Scotland,,,,",
+        ]
+
+
+@mark.asyncio
+class TestPrefetch:
+
+    async def test_prefetch_then_offline(self, upstream, capsys, monkeypatch):
+        await util.writer.start()
+        try:
+            assert await prefetch(["EH11AA", "not a postcode"]) == 1
+        finally:
+            await util.writer.stop()
+
+        assert Postcode.get().neighbourhood.code == "OT"
+        assert Crime.select().count() == 1
+        assert Nearby.select().count() == 1
+        assert "Prefetched 1 postcodes." in capsys.readouterr().out
+
+        # a fresh process, with nothing in memory
+        initialize_database(Postcode._meta.database.obj.database)
+        monkeypatch.setattr(client, "offline", True)
+        monkeypatch.setattr(util, "crime_month_checked", None)
+        monkeypatch.setattr(util, "crime_month", None)
+        monkeypatch.setattr(util, "nearby_cache", TTLCache(10, 60))
+
+        assert await cli(("EH11AA",), 0, crime=True, nearby=True, output_format="ndjson") == 0
+        data = json.loads(capsys.readouterr().out)
+        assert data["crime"][0]["category"] == "burglary"
+        assert data["nearby"][0]["title"] == "Castle"
+
+
+class TestBoundingBox:
+
+    def test_box_locations(self):
+        box = parse_box("55.955,-3.19,55.95,-3.2")
+
+        assert box == (55.95, -3.2, 55.955, -3.19)
+        assert len(list(box_locations(box, 0.0025))) == 3 * 5
@@ -1,5 +1,12 @@
-from pytest import mark
+import json
+import time
 
+from aiohttp import web, DummyCookieJar
+from aiohttp.test_utils import TestServer
+from pytest import mark, raises, fixture
+
+from hyperion_cli.fetch import client, ApiError
+from hyperion_cli.fetch.bikeregister import iter_json_array
 from test.util import postcodes_io_ok
 
 
@@ -9,3 +16,88 @@ class TestApi:
 
     async def test_true(self):
         assert False
+
+
+async def stream(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@mark.asyncio
+class TestJsonStream:
+
+    @mark.parametrize("size", [1, 3, 1024])
+    async def test_items_across_chunks(self, size):
+        items = [{"make": "Ünbranded", "rfid": ""}, 12, [1, 2], "bike", None]
+        data = json.dumps(items, ensure_ascii=False).encode()
+
+        assert [item async for item in iter_json_array(stream(data, size))] == items
+
+    async def test_empty_array(self):
+        assert [item async for item in iter_json_array(stream(b" [ ] ", 1))] == []
+
+    async def test_truncated_array(self):
+        with raises(json.JSONDecodeError):
+            [item async for item in iter_json_array(stream(b'[{"make": 1}, {"ma', 4))]
+
+
+@fixture(scope="function")
+def sessions(monkeypatch):
+    monkeypatch.setattr(client, "sessions", {})
+    monkeypatch.setattr(client, "offline", False)
+    return client.sessions
+
+
+@mark.asyncio
+class TestSessions:
+
+    async def test_shared_per_upstream(self, sessions):
+        await client.initialize_client()
+        assert set(sessions) == set(client.upstreams)
+        assert client.get_session("police") is client.get_session("police")
+        assert client.get_session("police") is not client.get_session("wikipedia")
+
+        opened = list(sessions.values())
+        await client.close_client()
+        assert all(session.closed for session in opened)
+        assert len(sessions) == 0
+
+        # a closed pool is replaced on the next request
+        assert not client.get_session("police").closed
+        await client.close_client()
+
+    async def test_limits_and_timeouts(self, sessions, monkeypatch):
+        monkeypatch.setitem(client.upstreams, "police", client.Upstream(3, 4.5))
+
+        police, bikeregister = client.get_session("police"), client.get_session("bikeregister")
+        assert police.connector.limit == 3
+        assert police.timeout.total == 4.5
+        assert not isinstance(police.cookie_jar, DummyCookieJar)
+        assert isinstance(bikeregister.cookie_jar, DummyCookieJar)
+        await client.close_client()
+
+    async def test_rate_limit(self, sessions, monkeypatch):
+        async def handler(request):
+            return web.Response(text="ok")
+
+        app = web.Application()
+        app.add_routes([web.get("/", handler)])
+        monkeypatch.setitem(client.upstreams, "police", client.Upstream(10, 10, rate=20))
+
+        async with TestServer(app) as server:
+            session = client.get_session("police")
+            start = time.monotonic()
+            for _ in range(25):
+                async with session.get(server.make_url("/")) as response:
+                    assert response.status == 200
+
+            # a burst of 20, then 5 more at 20 a second
+            assert time.monotonic() - start >= 0.2
+            await client.close_client()
+
+    async def test_offline(self, sessions, monkeypatch):
+        monkeypatch.setattr(client, "offline", True)
+        await client.initialize_client()
+        assert len(sessions) == 0
+        with raises(ApiError):
+            client.get_session("police")
@@ -0,0 +1,726 @@
+"""
+This module contains tests for the caching model helpers.
+
+General patterns:
+
+    replace the fetch functions with mocked versions and dummy data
+    call the model helper
+    assert that the upstream was only hit when needed
+"""
+import asyncio
+import io
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from aiobreaker import CircuitBreakerError
+from peewee import IntegrityError
+from pytest import mark, fixture, raises
+
+from hyperion_cli.models import initialize_database, models, Postcode, Bike, Link, Neighbourhood
+from hyperion_cli.models.bike import BikeIndex
+from hyperion_cli.models.base import database_proxy, is_postgres
+from hyperion_cli.models.migrations import Migration
+from hyperion_cli.models.storage import connect_database, optimize_database
+from hyperion_cli.models import util, grid, executor, directory as directory_module
+from hyperion_cli.models.executor import db_read, db_write
+from hyperion_cli.models.directory import import_directory, read_onspd, PostcodeDirectory
+from hyperion_cli.models.writer import WriteBehind
+from hyperion_cli.fetch import client, ApiError
+from hyperion_cli.util import TTLCache
+
+
+def make_postcode(postcode, lat, long):
+    return Postcode(postcode=postcode, lat=lat, long=long, country="Scotland", district="Edinburgh")
+
+
+@mark.asyncio
+class TestCrime:
+
+    @fixture(scope="function")
+    def db(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        monkeypatch.setattr(util, "crime_month_checked", None)
+
+    @fixture(scope="function")
+    def upstream(self, monkeypatch):
+        calls = []
+        months = ["2020-01"]
+
+        async def fetch_crime(lat, long, month):
+            calls.append((lat, long, month))
+            return [{"category": "burglary", "month": month}]
+
+        async def fetch_crime_last_updated():
+            return months[-1]
+
+        monkeypatch.setattr(util, "fetch_crime", fetch_crime)
+        monkeypatch.setattr(util, "fetch_crime_last_updated", fetch_crime_last_updated)
+        return calls, months
+
+    async def test_nearby_postcodes_share_entry(self, db, upstream):
+        calls, _ = upstream
+
+        first = await util.get_crime(make_postcode("EH47BL", 55.94881, -3.19641))
+        second = await util.get_crime(make_postcode("EH47BT", 55.94882, -3.19642))
+
+        assert first == second
+        assert len(calls) == 1
+
+    async def test_new_month_expires_entry(self, db, upstream, monkeypatch):
+        calls, months = upstream
+        postcode = make_postcode("EH47BL", 55.94881, -3.19641)
+
+        await util.get_crime(postcode)
+        months.append("2020-02")
+        monkeypatch.setattr(util, "crime_month_checked", None)
+        stale = await util.get_crime(postcode)
+        await util.wait_for_refreshes()
+        crime = await util.get_crime(postcode)
+
+        assert stale[0]["month"] == "2020-01"
+        assert crime[0]["month"] == "2020-02"
+        assert [month for _, _, month in calls] == ["2020-01", "2020-02"]
+
+
+@mark.asyncio
+class TestNearby:
+
+    @fixture(scope="function")
+    def db(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+
+    async def test_limits_are_sliced_from_tile(self, db, monkeypatch):
+        calls = []
+
+        async def fetch_nearby(lat, long, limit):
+            calls.append(limit)
+            return [
+                {"pageid": 1, "title": "Far", "lat": 55.96, "lon": -3.19, "dist": 0},
+                {"pageid": 2, "title": "Near", "lat": 55.949, "lon": -3.196, "dist": 0},
+            ]
+
+        monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+        monkeypatch.setattr(util, "nearby_cache", TTLCache(10, 60))
+
+        one = await util.get_nearby(55.94881, -3.19641, 1)
+        both = await util.get_nearby(55.94882, -3.19642, 10)
+
+        assert [x["title"] for x in one] == ["Near"]
+        assert [x["title"] for x in both] == ["Near", "Far"]
+        assert 0 < both[0]["dist"] < both[1]["dist"]
+        assert len(calls) == 1
+
+    async def test_tiles_are_kept_in_database(self, db, monkeypatch):
+        async def fetch_nearby(lat, long, limit):
+            return [{"pageid": 1, "title": "Near", "lat": 55.949, "lon": -3.196, "dist": 0}]
+
+        monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+        monkeypatch.setattr(util, "nearby_cache", TTLCache(10, 60))
+        await util.get_nearby(55.94881, -3.19641)
+
+        async def fetch_nearby(lat, long, limit):
+            raise AssertionError("Fetched from the API")
+
+        monkeypatch.setattr(util, "fetch_nearby", fetch_nearby)
+        monkeypatch.setattr(util, "nearby_cache", TTLCache(10, 60))
+        assert [x["title"] for x in await util.get_nearby(55.94882, -3.19642)] == ["Near"]
+
+
+def make_bike(frame_number, colour="red"):
+    return {
+        "make": "Raleigh", "model": "Chopper", "colour": colour, "latitude": "55.9", "longitude": "-3.2",
+        "frame_number": frame_number, "rfid": "", "description": "", "reported_at": "2020-01-01",
+    }
+
+
+@mark.asyncio
+class TestBikeSync:
+
+    @fixture(scope="function")
+    def feed(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        feed = []
+
+        async def fetch_bikes(handler, chunk_size):
+            for start in range(0, len(feed), chunk_size):
+                await handler(feed[start:start + chunk_size])
+
+        monkeypatch.setattr(util, "fetch_bikes", fetch_bikes)
+        return feed
+
+    async def test_sync_upserts_and_tombstones(self, feed):
+        feed.extend([make_bike("AAAA1"), make_bike("BBBB2"), {"make": "invalid"}])
+        stats = await util.sync_bikes()
+        assert (stats.inserted, stats.updated, stats.removed, stats.invalid) == (2, 0, 0, 1)
+
+        feed[:] = [make_bike("BBBB2", colour="blue"), make_bike("CCCC3")]
+        stats = await util.sync_bikes()
+        assert (stats.inserted, stats.updated, stats.unchanged, stats.removed) == (1, 1, 0, 1)
+
+        bikes = {bike.frame_number: bike for bike in Bike.select()}
+        assert bikes["AAAA1"].removed
+        assert bikes["BBBB2"].colour == "blue"
+        assert not bikes["CCCC3"].removed
+
+    async def test_radius_query_uses_index(self, feed):
+        far = dict(make_bike("BBBB2"), latitude="56.5")
+        near = dict(make_bike("DDDD4"), latitude="55.91")
+        feed.extend([near, make_bike("AAAA1"), far, make_bike("CCCC3")])
+        await util.sync_bikes()
+        feed[:] = [near, make_bike("AAAA1"), far]
+        await util.sync_bikes()
+
+        assert BikeIndex.select().count() == 3
+        bikes = await util.get_bikes(make_postcode("EH11AA", 55.9, -3.2), 5)
+        assert [bike.frame_number for bike in bikes] == ["AAAA1", "DDDD4"]
+        assert [bike.distance for bike in bikes] == [0, 1112]
+
+    async def test_grid_matches_index(self, feed, monkeypatch):
+        feed.extend(dict(make_bike(f"BIKE{i}"), latitude=str(55.8 + i / 100), longitude=str(-3.3 + i / 150))
+                    for i in range(30))
+        await util.sync_bikes()
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+
+        from_index = await util.get_bikes(postcode, 10)
+        monkeypatch.setattr(grid, "bike_grid", grid.BikeGrid.from_database(0.01))
+        from_grid = await util.get_bikes(postcode, 10)
+
+        assert 0 < len(from_grid) < 30
+        assert [bike.serialize() for bike in from_grid] == [bike.serialize() for bike in from_index]
+
+    async def test_failed_sync_is_retried(self, feed, monkeypatch):
+        # the feed fails after some of the bikes are saved
+        async def fetch_bikes(handler, chunk_size):
+            await handler([make_bike("AAAA1")])
+            raise ApiError("Timed out connecting to bikeregister")
+
+        monkeypatch.setattr(util, "fetch_bikes", fetch_bikes)
+        with raises(ApiError):
+            await util.sync_bikes()
+        assert Bike.select().count() == 1
+        assert await util.should_update_bikes(timedelta(days=1))
+
+        monkeypatch.setattr(util, "fetch_bikes", lambda handler, chunk_size: handler(feed))
+        feed.extend([make_bike("AAAA1"), dict(make_bike(12345678), rfid=None), ["not", "a", "bike"]])
+        stats = await util.sync_bikes()
+        assert (stats.unchanged, stats.inserted, stats.invalid) == (1, 1, 1)
+        assert not await util.should_update_bikes(timedelta(days=1))
+
+    async def test_keys_are_scoped_and_duplicates_counted(self, feed):
+        feed.extend([
+            make_bike("UNKNOWN", colour="red"), make_bike("not known", colour="blue"),
+            make_bike("0000", colour="green"), make_bike("AAAA1"), dict(make_bike("AAAA1"), make="Trek"),
+            make_bike("AAAA1", colour="blue"),
+        ])
+        feed.extend(make_bike("AAAA1", colour="blue") for _ in range(1000))
+        stats = await util.sync_bikes()
+
+        assert (stats.inserted, stats.duplicates) == (5, 1001)
+        assert Bike.select().where(Bike.key.startswith("hash:")).count() == 3
+
+    async def test_empty_feed_keeps_bikes(self, feed):
+        feed.append(make_bike("AAAA1"))
+        await util.sync_bikes()
+
+        feed[:] = [{"make": "invalid"}]
+        with raises(ApiError):
+            await util.sync_bikes()
+        assert Bike.select().where(Bike.removed == True).count() == 0  # noqa: E712
+
+
+@mark.asyncio
+class TestExecutor:
+
+    async def test_concurrent_queries(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        codes = [f"EH1{i}AA" for i in range(8)]
+        await asyncio.gather(*(db_write(make_postcode(code, 55.9, -3.2).save) for code in codes))
+
+        # both reads have to be running at once to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def read(code):
+            barrier.wait()
+            return Postcode.get(Postcode.postcode == code).postcode, threading.current_thread().name
+
+        results = await asyncio.gather(db_read(read, codes[0]), db_read(read, codes[1]))
+        assert [code for code, _ in results] == codes[:2]
+        assert all(thread.startswith("db-read") for _, thread in results)
+
+        counts = await asyncio.gather(*(db_read(Postcode.select().where(Postcode.postcode == code).count)
+                                        for code in codes))
+        assert counts == [1] * len(codes)
+
+    async def test_shutdown(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        await db_read(Postcode.select().count)
+        await db_write(make_postcode("EH11AA", 55.9, -3.2).save)
+        pools = [executor.read_executor, executor.write_executor]
+
+        executor.shutdown_executors()
+        assert executor.read_executor is None and executor.write_executor is None
+        for pool in pools:
+            with raises(RuntimeError):
+                pool.submit(print)
+
+        # the pools are opened again on the next query
+        assert await db_read(Postcode.select().count) == 1
+
+
+@mark.asyncio
+class TestWriteBehind:
+
+    async def test_queued_rows_are_visible_until_written(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+
+        async def load(postcode):
+            return make_postcode(postcode, 55.9, -3.2)
+
+        monkeypatch.setattr(util.postcode_loader, "load", load)
+        writer = WriteBehind(interval=60)
+        monkeypatch.setattr(util, "writer", writer)
+        await writer.start()
+
+        fetched = await util.get_postcode("EH11AA")
+        assert await util.get_postcode("EH11AA") is fetched
+        assert Postcode.select().count() == 0
+
+        await writer.stop()
+        assert writer.get_pending(Postcode, "EH11AA") is None
+        assert Postcode.select().count() == 1
+
+    async def test_batch_being_written_survives_stop(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        writer = WriteBehind(interval=60)
+        await writer.start()
+
+        await writer.save(make_postcode("EH11AA", 55.9, -3.2), key="EH11AA")
+        await asyncio.sleep(0)
+        await writer.stop()
+
+        assert writer.get_pending(Postcode, "EH11AA") is None
+        assert Postcode.select().count() == 1
+
+    async def test_stop_writes_everything_queued(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        writer = WriteBehind(batch_size=2, interval=60)
+        await writer.start()
+
+        codes = [f"EH1{i}AA" for i in range(5)]
+        for code in codes:
+            await writer.save(make_postcode(code, 55.9, -3.2), key=code)
+        # the writer takes the first group off the queue and waits for more
+        await asyncio.sleep(0)
+        await writer.stop()
+
+        assert all(writer.get_pending(Postcode, code) is None for code in codes)
+        assert sorted(postcode.postcode for postcode in Postcode.select()) == codes
+
+        # once stopped, saves are written straight away
+        await writer.save(make_postcode("EH99AA", 55.9, -3.2), key="EH99AA")
+        assert Postcode.select().count() == len(codes) + 1
+
+
+class TestMigrations:
+
+    def test_duplicates_are_merged(self, tmp_path):
+        path = str(tmp_path / "test-db.sqlite")
+        connection = sqlite3.connect(path)
+        connection.executescript("""
+            CREATE TABLE neighbourhood (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, code VARCHAR(255) NOT NULL,
+                description VARCHAR(255), email VARCHAR(255), facebook VARCHAR(255), telephone VARCHAR(255),
+                twitter VARCHAR(255));
+            CREATE TABLE postcode (id INTEGER PRIMARY KEY, postcode VARCHAR(255) NOT NULL, lat REAL NOT NULL,
+                long REAL NOT NULL, country VARCHAR(255) NOT NULL, district VARCHAR(255) NOT NULL, zone VARCHAR(255),
+                neighbourhood_id INTEGER);
+            CREATE TABLE link (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, url VARCHAR(255) NOT NULL,
+                neighbourhood_id INTEGER NOT NULL);
+            INSERT INTO neighbourhood (id, name, code) VALUES (1, 'Old Town', 'OT'), (2, 'Old Town', 'OT');
+            INSERT INTO postcode (id, postcode, lat, long, country, district, neighbourhood_id)
+                VALUES (1, 'EH11AA', 55.9, -3.2, 'Scotland', 'Edinburgh', NULL),
+                       (2, 'EH11AA', 55.9, -3.2, 'Scotland', 'Edinburgh', 2);
+            INSERT INTO link (name, url, neighbourhood_id) VALUES ('Police', 'http://a', 1), ('Police', 'http://a', 2);
+        """)
+        connection.close()
+
+        initialize_database(path)
+
+        # the neighbourhoods may be from different forces, so they are kept
+        postcode = Postcode.get(Postcode.postcode == "EH11AA")
+        assert Postcode.select().count() == 1
+        assert postcode.neighbourhood.id == 2
+        assert Neighbourhood.select().count() == 2
+        assert Link.select().count() == 2
+
+        with raises(IntegrityError):
+            make_postcode("EH11AA", 55.9, -3.2).save()
+
+    def test_upsert_keeps_existing_row(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        neighbourhood = Neighbourhood.create(name="Old Town", force="scotland", code="OT")
+        make_postcode("EH11AA", 55.9, -3.2).upsert()
+        Postcode.update(neighbourhood=neighbourhood).execute()
+
+        postcode = make_postcode("EH11AA", 55.95, -3.2)
+        postcode.upsert()
+
+        assert Postcode.select().count() == 1
+        assert postcode.id == Postcode.get().id
+        assert Postcode.get().lat == 55.95
+        assert Postcode.get().neighbourhood_id == neighbourhood.id
+
+    def test_neighbourhoods_are_keyed_by_force(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        for force, name in (("scotland", "Old Town"), ("met", "Soho"), ("scotland", "Old Town Centre")):
+            Neighbourhood(name=name, force=force, code="OT").upsert()
+
+        assert sorted((n.force, n.name) for n in Neighbourhood.select()) == [
+            ("met", "Soho"), ("scotland", "Old Town Centre")
+        ]
+
+
+class TestStorage:
+
+    def test_tuned_profile(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"), "tuned")
+
+        assert database_proxy.journal_mode == "wal"
+        assert database_proxy.execute_sql("PRAGMA synchronous").fetchone()[0] == 1
+        assert database_proxy.execute_sql("PRAGMA temp_store").fetchone()[0] == 2
+
+    def test_optimize_vacuums_free_pages(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        Bike.bulk_create([Bike.from_dict(make_bike(f"BIKE{i}", colour="x" * 500)) for i in range(500)], 100)
+        Bike.delete().execute()
+
+        assert optimize_database(database_proxy)
+        assert database_proxy.execute_sql("PRAGMA freelist_count").fetchone()[0] == 0
+        assert not optimize_database(database_proxy)
+
+    def test_sqlite_url(self, tmp_path):
+        database = connect_database(f"sqlite:///{tmp_path / 'test-db.sqlite'}", "compatible")
+
+        assert not is_postgres(database)
+        assert database.journal_mode == "delete"
+
+
+@mark.skipif("HYPERION_TEST_DB_URL" not in os.environ, reason="No test postgres database (HYPERION_TEST_DB_URL)")
+@mark.asyncio
+class TestPostgres:
+
+    @fixture(scope="function")
+    def db(self):
+        initialize_database(url=os.environ["HYPERION_TEST_DB_URL"])
+        assert is_postgres()
+        yield
+        database_proxy.drop_tables(models + [Migration], safe=True)
+        database_proxy.close_all()
+
+    async def test_radius_query_uses_index(self, db, monkeypatch):
+        monkeypatch.setattr(grid, "bike_grid", None)
+        Bike.bulk_create([Bike.from_dict(dict(make_bike("AAAA1"))),
+                          Bike.from_dict(dict(make_bike("BBBB2"), latitude="56.5"))])
+
+        bikes = await util.get_bikes(make_postcode("EH11AA", 55.9, -3.2), 5)
+
+        assert [bike.frame_number for bike in bikes] == ["AAAA1"]
+
+
+class TestPostcode:
+
+    @fixture(scope="function")
+    def db(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+
+    def test_serialize_without_neighbourhood(self, db):
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+        postcode.save()
+
+        data = postcode.serialize()
+
+        assert data["postcode"] == "EH11AA"
+        assert data["neighbourhood"] is None
+        assert "cached_date" not in data
+
+    def test_serialize_with_neighbourhood(self, db):
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+        postcode.neighbourhood = Neighbourhood.create(name="Old Town", force="scotland", code="OT")
+        postcode.save()
+
+        data = postcode.serialize()
+
+        assert data["neighbourhood"]["code"] == "OT"
+        assert "cached_date" not in data["neighbourhood"]
+
+
+@mark.asyncio
+class TestPostcodeCache:
+
+    @fixture(scope="function")
+    def db(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        neighbourhood = Neighbourhood.create(name="Old Town", force="scotland", code="OT")
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+        postcode.neighbourhood = neighbourhood
+        postcode.save()
+        Link.create(name="Police", url="http://a", neighbourhood=neighbourhood)
+        monkeypatch.setattr(util, "postcode_cache", TTLCache(10, 60))
+        monkeypatch.setattr(util, "neighbourhood_cache", TTLCache(10, 60))
+
+        reads = []
+        db_read = util.db_read
+
+        async def counting_db_read(func, *args, **kwargs):
+            reads.append(func)
+            return await db_read(func, *args, **kwargs)
+
+        monkeypatch.setattr(util, "db_read", counting_db_read)
+        return reads
+
+    async def test_hot_rows_skip_database(self, db, monkeypatch):
+        postcode = await util.get_postcode("EH1 1AA")
+        neighbourhood = await util.get_neighbourhood("EH11AA")
+        assert len(db) == 2
+
+        assert await util.get_postcode("eh11aa") is postcode
+        assert await util.get_neighbourhood("EH11AA") is neighbourhood
+        assert len(db) == 2
+        assert util.postcode_cache.hits == 3
+
+        def execute_sql(*args, **kwargs):
+            raise AssertionError("Queried the database")
+
+        monkeypatch.setattr(database_proxy.obj, "execute_sql", execute_sql)
+        assert neighbourhood.serialize()["links"][0]["url"] == "http://a"
+
+    async def test_fetched_postcode_updates_cached_copy(self, db, monkeypatch):
+        cached = await util.get_postcode("EH11AA")
+        neighbourhood = await util.get_neighbourhood("EH11AA")
+
+        async def fetch_postcode_random():
+            return make_postcode("EH11AA", 55.95, -3.2)
+
+        monkeypatch.setattr(util, "fetch_postcode_random", fetch_postcode_random)
+        await util.get_postcode_random()
+
+        assert await util.get_postcode("EH11AA") is cached
+        assert cached.lat == 55.95
+        assert Postcode.get().lat == 55.95
+        assert (await util.get_neighbourhood("EH11AA")).code == neighbourhood.code
+        await util.wait_for_refreshes()
+
+
+@mark.asyncio
+class TestNegativeCache:
+
+    @fixture(scope="function")
+    def db(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        monkeypatch.setattr(util, "negative_cache", TTLCache(10, 60))
+
+    async def test_missing_postcode_is_not_refetched(self, db, monkeypatch):
+        calls = []
+
+        async def load(postcode):
+            calls.append(postcode)
+            return None
+
+        monkeypatch.setattr(util.postcode_loader, "load", load)
+
+        assert await util.get_postcode("ZZ99ZZ") is None
+        assert await util.get_postcode("ZZ9 9ZZ") is None
+        assert calls == ["ZZ99ZZ"]
+
+    async def test_missing_neighbourhood_expires(self, db, monkeypatch):
+        calls = []
+
+        async def fetch_neighbourhood(lat, long):
+            calls.append((lat, long))
+            return None
+
+        monkeypatch.setattr(util, "fetch_neighbourhood", fetch_neighbourhood)
+        monkeypatch.setattr(util, "negative_cache", TTLCache(10, -1))
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+
+        assert await util.get_neighbourhood(postcode) is None
+        assert await util.get_neighbourhood(postcode) is None
+        assert len(calls) == 2
+
+        monkeypatch.setattr(util, "negative_cache", TTLCache(10, 60))
+        assert await util.get_neighbourhood(postcode) is None
+        assert await util.get_neighbourhood(postcode) is None
+        assert len(calls) == 3
+
+
+@mark.asyncio
+class TestStaleWhileRevalidate:
+
+    @fixture(scope="function")
+    def stale_postcode(self, tmp_path):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        postcode = make_postcode("EH11AA", 55.9, -3.2)
+        postcode.cached_date = datetime(2000, 1, 1)
+        postcode.save()
+
+    async def test_stale_postcode_is_served_then_refreshed(self, stale_postcode, monkeypatch):
+        async def load(postcode):
+            return make_postcode(postcode, 55.95, -3.2)
+
+        monkeypatch.setattr(util.postcode_loader, "load", load)
+
+        stale = await util.get_postcode("EH11AA")
+        assert stale.lat == 55.9
+
+        await util.wait_for_refreshes()
+        assert (await util.get_postcode("EH11AA")).lat == 55.95
+        assert Postcode.get().cached_date > datetime(2000, 1, 1)
+
+    async def test_stale_postcode_is_served_when_breaker_open(self, stale_postcode, monkeypatch):
+        async def load(postcode):
+            raise CircuitBreakerError("open", datetime.now())
+
+        monkeypatch.setattr(util.postcode_loader, "load", load)
+
+        assert (await util.get_postcode("EH11AA")).lat == 55.9
+        await util.wait_for_refreshes()
+        assert (await util.get_postcode("EH11AA")).lat == 55.9
+
+
+@mark.asyncio
+class TestRandomPool:
+
+    @fixture(scope="function")
+    def fetches(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        monkeypatch.setattr(directory_module, "postcode_directory", None)
+        monkeypatch.setattr(directory_module, "directory_loaded", True)
+        monkeypatch.setattr(util, "RANDOM_POOL_SIZE", 4)
+        fetches = []
+
+        async def fetch_postcode_random():
+            fetches.append(len(fetches))
+            return make_postcode(f"EH1{len(fetches)}AA", 55.9, -3.2)
+
+        monkeypatch.setattr(util, "fetch_postcode_random", fetch_postcode_random)
+        return fetches
+
+    async def test_random_postcodes_come_from_pool(self, fetches):
+        postcodes = await util.get_postcodes_random(3)
+        assert len({postcode.postcode for postcode in postcodes}) == 3
+        assert len(fetches) == 3
+
+        await util.wait_for_refreshes()
+        assert len(util.random_pool) == 4
+        assert len(fetches) == 7
+
+        postcode = await util.get_postcode_random()
+        assert len(fetches) == 7
+        assert await util.get_postcode(postcode.postcode) is postcode
+        await util.wait_for_refreshes()
+        assert Postcode.select().count() == 0
+
+    async def test_random_postcodes_from_database_when_breaker_open(self, fetches, monkeypatch):
+        make_postcode("EH11AA", 55.9, -3.2).save()
+
+        async def fetch_postcode_random():
+            raise CircuitBreakerError("open", datetime.now())
+
+        monkeypatch.setattr(util, "fetch_postcode_random", fetch_postcode_random)
+        postcodes = await util.get_postcodes_random(2, refill=False)
+        assert [postcode.postcode for postcode in postcodes] == ["EH11AA"]
+
+        Postcode.delete().execute()
+        with raises(util.CachingError):
+            await util.get_postcode_random()
+        await util.wait_for_refreshes()
+
+
+@mark.asyncio
+class TestOffline:
+
+    @fixture(scope="function")
+    def offline(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        make_postcode("EH11AA", 55.9, -3.2).save()
+        monkeypatch.setattr(directory_module, "postcode_directory", None)
+        monkeypatch.setattr(directory_module, "directory_loaded", True)
+        monkeypatch.setattr(client, "offline", True)
+
+    async def test_cached_postcode(self, offline):
+        assert (await util.get_postcode("EH11AA")).lat == 55.9
+
+    async def test_miss_fails_without_fetching(self, offline):
+        with raises(util.CachingError):
+            await util.get_postcode("EH11AB")
+        with raises(util.CachingError):
+            await util.get_neighbourhood("EH11AA")
+        assert len(client.sessions) == 0
+
+    async def test_stale_rows_are_not_refreshed(self, offline):
+        Postcode.update(cached_date=datetime(2000, 1, 1)).execute()
+
+        assert (await util.get_postcode("EH11AA")).lat == 55.9
+        assert len(util.refreshes) == 0
+
+
+onspd = """pcd,pcd2,pcds,dointr,doterm,oslaua,ctry,msoa11,lat,long
+EH1 1AA,EH1  1AA,EH1 1AA,199801,,S12000036,S92000003,S02001586,55.953000,-3.189000
+EH1 1AB,EH1  1AB,EH1 1AB,199801,,S12000036,S92000003,S02001586,55.953300,-3.189000
+EH1 1AD,EH1  1AD,EH1 1AD,199801,200601,S12000036,S92000003,S02001586,55.953100,-3.189000
+ZZ991ZZ,ZZ99 1ZZ,ZZ99 1ZZ,199801,,,,,99.999999,0.000000
+G1  1AA,G1   1AA,G1 1AA,199801,,S12000049,S92000003,,55.861000,-4.250000
+"""
+
+
+@mark.asyncio
+class TestDirectory:
+
+    @fixture(scope="function")
+    def directory(self, tmp_path, monkeypatch):
+        initialize_database(str(tmp_path / "test-db.sqlite"))
+        monkeypatch.setattr(directory_module, "postcode_directory", None)
+        monkeypatch.setattr(directory_module, "directory_loaded", False)
+        names = io.StringIO("LAD20CD,LAD20NM\nS12000036,City of Edinburgh\n")
+        import_directory(io.StringIO(onspd), [names], str(tmp_path / "directory"))
+
+        async def load(postcode):
+            raise AssertionError("Fetched from the API")
+
+        monkeypatch.setattr(util.postcode_loader, "load", load)
+        return directory_module.get_postcode_directory()
+
+    async def test_lookup(self, directory):
+        assert len(directory) == 3
+
+        postcode = await util.get_postcode("EH1 1AA")
+        assert (postcode.postcode, postcode.lat, postcode.long) == ("EH11AA", 55.953, -3.189)
+        assert (postcode.district, postcode.country, postcode.zone) == ("City of Edinburgh", "Scotland", "S02001586")
+        assert (await util.get_postcode("G11AA")).zone is None
+        assert directory.get("EH11AD") is None
+
+    async def test_reverse_lookup(self, directory):
+        postcodes = await util.get_postcodes_from_coordinates(55.9532, -3.189)
+
+        assert [postcode.postcode for postcode in postcodes] == ["EH11AB", "EH11AA"]
+
+    async def test_random_sample(self, directory):
+        postcodes = await util.get_postcodes_random(10)
+        assert sorted(postcode.postcode for postcode in postcodes) == ["EH11AA", "EH11AB", "G11AA"]
+        assert len(await util.get_postcodes_random(2)) == 2
+        assert Postcode.select().count() == 0
+
+
+class TestDirectoryBuild:
+
+    @mark.parametrize("chunk_size", [1, 2, 3])
+    def test_build_in_chunks(self, tmp_path, chunk_size):
+        path = str(tmp_path / "directory")
+
+        assert PostcodeDirectory.build(read_onspd(io.StringIO(onspd)), path, chunk_size=chunk_size) == 3
+
+        directory = PostcodeDirectory(path)
+        assert [key.decode() for key in directory.keys] == ["EH11AA", "EH11AB", "G11AA"]
+        assert directory.get("EH11AA").district == "S12000036"
+        assert [postcode.postcode for postcode in directory.nearest(55.9532, -3.189)] == ["EH11AB", "EH11AA"]
@@ -0,0 +1,152 @@
+"""
+This module contains unit tests for the shared utilities.
+"""
+import asyncio
+
+import numpy as np
+from pytest import mark, raises
+
+from hyperion_cli.geo import distances
+from hyperion_cli.util import dataloader, BatchLoader, TTLCache, RateLimiter, gather_bounded, as_completed_bounded
+
+
+@mark.asyncio
+class TestBatchLoader:
+
+    async def test_batches_distinct_keys(self):
+        calls = []
+
+        async def batch(keys):
+            calls.append(keys)
+            return {key: key.lower() for key in keys}
+
+        loader = BatchLoader(batch, max_batch_size=2)
+        results = await asyncio.gather(*(loader.load(key) for key in ["A", "B", "A", "C"]))
+
+        assert results == ["a", "b", "a", "c"]
+        assert calls == [["A", "B"], ["C"]]
+
+    async def test_missing_keys_are_none(self):
+        async def batch(keys):
+            return {}
+
+        assert await BatchLoader(batch).load("A") is None
+
+    async def test_errors_reach_every_caller(self):
+        async def batch(keys):
+            raise ValueError()
+
+        loader = BatchLoader(batch)
+        for result in await asyncio.gather(loader.load("A"), loader.load("B"), return_exceptions=True):
+            assert isinstance(result, ValueError)
+
+        with raises(ValueError):
+            await loader.load("C")
+
+
+@mark.asyncio
+class TestDataLoader:
+
+    async def test_errors_reach_every_caller(self):
+        calls = []
+
+        @dataloader
+        async def load(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            raise ValueError()
+
+        for result in await asyncio.gather(load("A"), load("A"), return_exceptions=True):
+            assert isinstance(result, ValueError)
+        assert calls == ["A"]
+
+        with raises(ValueError):
+            await asyncio.wait_for(load("A"), 1)
+
+
+class TestTTLCache:
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache and "c" in cache
+        assert "b" not in cache
+
+    def test_expires_entries(self):
+        cache = TTLCache(max_size=2, ttl=-1)
+        cache.set("a", 1)
+
+        assert cache.get("a") is None
+        assert cache.misses == 1
+
+    def test_serves_stale_entries(self):
+        cache = TTLCache(max_size=2, ttl=-1, stale_ttl=60)
+        cache.set("a", 1)
+
+        assert cache.get("a") is None
+        assert cache.get_stale("a") == (1, False)
+        assert cache.get_stale("b") == (None, False)
+
+
+@mark.asyncio
+class TestConcurrency:
+
+    async def test_gather_bounded_limits_concurrency(self):
+        running, most_running = 0, 0
+
+        async def work(value):
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return value
+
+        assert await gather_bounded((work(value) for value in range(10)), 3) == list(range(10))
+        assert most_running == 3
+
+    async def test_as_completed_bounded_reads_lazily(self):
+        started = []
+
+        async def work(value):
+            await asyncio.sleep(0.01 * (3 - value % 3))
+            return value
+
+        def jobs():
+            for value in range(6):
+                started.append(value)
+                yield work(value)
+
+        results = []
+        async for result in as_completed_bounded(jobs(), 3):
+            results.append(result)
+            assert len(started) <= len(results) + 3
+
+        assert sorted(results) == list(range(6))
+        assert results[0] == 2
+
+    async def test_rate_limiter_spaces_out_calls(self):
+        limiter = RateLimiter(rate=100, burst=2)
+        loop = asyncio.get_event_loop()
+
+        start = loop.time()
+        await asyncio.gather(*(limiter.acquire() for _ in range(6)))
+        assert loop.time() - start >= 0.035
+
+    async def test_unlimited_rate_limiter(self):
+        limiter = RateLimiter(rate=0)
+        await asyncio.wait_for(asyncio.gather(*(limiter.acquire() for _ in range(1000))), 1)
+
+
+class TestDistances:
+
+    def test_methods_agree_over_short_distances(self):
+        lats, longs = [55.95, 55.9, 56.5], [-3.19, -3.3, -3.2]
+        expected = distances(55.9, -3.2, lats, longs, "geodesic")
+
+        for method in ["haversine", "equirectangular"]:
+            assert np.allclose(distances(55.9, -3.2, lats, longs, method), expected, rtol=0.005)